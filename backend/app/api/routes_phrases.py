@@ -0,0 +1,68 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+
+from ..schemas.phrases import (
+    PhraseExample,
+    PhraseExamplesResponse,
+    SimilarPhrase,
+    SimilarPhrasesResponse,
+)
+from ..services.concordance import Concordance, get_concordance
+from ..services.similar import SimilarIndex, get_similar_index
+
+router = APIRouter()
+
+
+def require_concordance() -> Concordance:
+    conc = get_concordance()
+    if conc is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Concordance is not configured or not keyed by DB phrase ids",
+        )
+    return conc
+
+
+def require_similar_index() -> SimilarIndex:
+    index = get_similar_index()
+    if index is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Similar-phrase index is not configured or not keyed by DB phrase ids",
+        )
+    return index
+
+
+@router.get("/phrases/{phrase_id}/examples", response_model=PhraseExamplesResponse)
+async def phrase_examples(
+    phrase_id: int,
+    limit: int = Query(10, ge=1, le=100),
+    conc: Concordance = Depends(require_concordance),
+):
+    if phrase_id < 0 or phrase_id >= conc.n_phrases:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Phrase not found")
+
+    examples = conc.examples(phrase_id, limit)
+    return PhraseExamplesResponse(
+        phrase_id=phrase_id,
+        total=conc.total(phrase_id),
+        examples=[PhraseExample(offset=e.offset, text=e.text) for e in examples],
+    )
+
+
+@router.get("/phrases/{phrase_id}/similar", response_model=SimilarPhrasesResponse)
+async def phrase_similar(
+    phrase_id: int,
+    limit: int = Query(10, ge=1, le=100),
+    index: SimilarIndex = Depends(require_similar_index),
+):
+    if not index.has(phrase_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Phrase not found")
+
+    return SimilarPhrasesResponse(
+        phrase_id=phrase_id,
+        text=index.text(phrase_id),
+        similar=[
+            SimilarPhrase(phrase_id=p.phrase_id, text=p.text, score=p.score)
+            for p in index.similar(phrase_id, limit)
+        ],
+    )
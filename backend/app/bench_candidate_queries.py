@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+bench_candidate_queries.py
+
+Сравнение двух схем поиска следующей фразы (srs_logic.CANDIDATE_QUERIES):
+"join" — через phrase_words, "arrays" — через phrases.word_ids с GIN
+(load_corpus_to_db.py --word-arrays).
+
+Как работает:
+- создаются синтетические пользователи разного уровня: первые N слов
+  по rank — KNOWN (часть пропускается), следующие — INTRO / LEARN,
+  самые частые фразы с одним новым словом — уже в истории;
+- для каждого пользователя find_next_phrase выполняется в обеих схемах
+  (после прогрева), берётся медиана из --repeat замеров;
+- результаты схем сравниваются (phrase_id, режим, целевое слово);
+- всё делается в одной транзакции и в конце откатывается — в БД
+  ничего не остаётся (кроме сдвига последовательности users.id).
+
+Запуск (из backend/app):
+    python3 bench_candidate_queries.py --users 20 --levels 0,50,200,1000,3000
+"""
+
+import argparse
+import random
+import statistics
+import sys
+import time
+
+import psycopg2
+
+from srs_logic import CANDIDATE_QUERIES, find_next_phrase, get_conn
+
+
+SQL_HAS_WORD_ARRAYS = """
+SELECT COUNT(*) FROM phrases WHERE word_ids IS NOT NULL;
+"""
+
+SQL_WORDS_BY_RANK = """
+SELECT id FROM words ORDER BY rank, id;
+"""
+
+SQL_INSERT_USER = """
+INSERT INTO users (name) VALUES (%(name)s) RETURNING id;
+"""
+
+SQL_INSERT_STATES = """
+INSERT INTO user_word_state (user_id, word_id, state)
+SELECT %(user_id)s, w, s::word_state_enum
+FROM unnest(%(word_ids)s::int[], %(states)s::text[]) AS t(w, s);
+"""
+
+# уже показанные фразы: самые частые из тех, где ровно одно слово не
+# виденное, — иначе STRICT-кандидаты, так что проверяется и исключение истории
+SQL_INSERT_HISTORY = """
+INSERT INTO user_phrase_history (user_id, phrase_id, result)
+SELECT %(user_id)s, p.id, 'green'
+FROM phrases p
+WHERE p.word_ids IS NOT NULL
+  AND (SELECT COUNT(*) FROM unnest(p.word_ids) w WHERE w <> ALL (%(seen)s::int[])) = 1
+ORDER BY p.freq DESC, p.id
+LIMIT %(n)s;
+"""
+
+
+def make_user(cur, rng, word_ids, level, n_history):
+    """Синтетический пользователь: level известных слов (по rank) + INTRO/LEARN."""
+    cur.execute(SQL_INSERT_USER, {"name": f"bench_{level}"})
+    user_id = cur.fetchone()[0]
+
+    known = [w for w in word_ids[:level] if rng.random() > 0.1]
+    tail = word_ids[level:level + 20]
+    ids = known + tail
+    states = (
+        [rng.choice(("KNOWN", "MATURE")) for _ in known]
+        + ["INTRO" if i % 2 == 0 else "LEARN" for i in range(len(tail))]
+    )
+    cur.execute(SQL_INSERT_STATES, {"user_id": user_id, "word_ids": ids, "states": states})
+    if n_history:
+        cur.execute(SQL_INSERT_HISTORY, {"user_id": user_id, "seen": ids, "n": n_history})
+    return user_id
+
+
+def run_once(cur, user_id, schema):
+    t0 = time.perf_counter()
+    result = find_next_phrase(cur, user_id, schema)
+    return (time.perf_counter() - t0) * 1000.0, result
+
+
+def summary(times):
+    times = sorted(times)
+    p95 = times[min(len(times) - 1, int(round(0.95 * (len(times) - 1))))]
+    return f"p50 {statistics.median(times):8.1f} ms   p95 {p95:8.1f} ms   max {times[-1]:8.1f} ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Бенчмарк поиска кандидатов: phrase_words (join) против phrases.word_ids (arrays)."
+    )
+    parser.add_argument("--users", type=int, default=20,
+                        help="Число синтетических пользователей. По умолчанию 20.")
+    parser.add_argument("--levels", default="0,50,200,1000,3000",
+                        help="Число известных слов у пользователей (по кругу).")
+    parser.add_argument("--history", type=int, default=50,
+                        help="Сколько уже показанных фраз у пользователя.")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Замеров на пользователя и схему (берётся медиана).")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    levels = [int(x) for x in args.levels.split(",") if x]
+    rng = random.Random(args.seed)
+
+    try:
+        conn = get_conn()
+    except Exception as e:
+        print("[ERROR] DB connect failed:", e, file=sys.stderr)
+        sys.exit(1)
+
+    schemas = list(CANDIDATE_QUERIES)
+    try:
+        with conn.cursor() as cur:
+            try:
+                cur.execute(SQL_HAS_WORD_ARRAYS)
+            except psycopg2.errors.UndefinedColumn:
+                print("[ERROR] phrases.word_ids is missing: run load_corpus_to_db.py --word-arrays",
+                      file=sys.stderr)
+                sys.exit(1)
+            if cur.fetchone()[0] == 0:
+                print("[ERROR] phrases.word_ids is empty: run load_corpus_to_db.py --word-arrays",
+                      file=sys.stderr)
+                sys.exit(1)
+
+            cur.execute(SQL_WORDS_BY_RANK)
+            word_ids = [r[0] for r in cur.fetchall()]
+
+            print(f"[INFO] Creating {args.users} synthetic users (levels {levels})...")
+            users = []
+            for i in range(args.users):
+                level = levels[i % len(levels)]
+                users.append((make_user(cur, rng, word_ids, level, args.history), level))
+            cur.execute("ANALYZE user_word_state;")
+
+            # прогрев кэша обеих схем
+            for schema in schemas:
+                run_once(cur, users[0][0], schema)
+
+            times = {schema: [] for schema in schemas}
+            by_level = {(schema, level): [] for schema in schemas for level in levels}
+            mismatches = 0
+            for user_id, level in users:
+                results = {}
+                for schema in schemas:
+                    samples = []
+                    for _ in range(args.repeat):
+                        ms, results[schema] = run_once(cur, user_id, schema)
+                        samples.append(ms)
+                    ms = statistics.median(samples)
+                    times[schema].append(ms)
+                    by_level[(schema, level)].append(ms)
+
+                picked = {
+                    schema: None if r is None else (r.phrase_id, r.mode, r.target_word_id)
+                    for schema, r in results.items()
+                }
+                if len(set(picked.values())) > 1:
+                    mismatches += 1
+                    print(f"[WARN] user {user_id} (level {level}): {picked}")
+    finally:
+        # синтетические пользователи не сохраняются
+        conn.rollback()
+        conn.close()
+
+    print("\n=== CANDIDATE QUERY LATENCY (find_next_phrase) ===")
+    for schema in schemas:
+        print(f"{schema:8s}: {summary(times[schema])}")
+    print("\nby level (p50, ms):")
+    print("level   " + "".join(f"{schema:>10s}" for schema in schemas))
+    for level in levels:
+        row = "".join(
+            f"{statistics.median(by_level[(schema, level)]):10.1f}"
+            if by_level[(schema, level)] else f"{'-':>10s}"
+            for schema in schemas
+        )
+        print(f"{level:<8d}{row}")
+    print(f"\n[DONE] users: {len(users)}, result mismatches between schemas: {mismatches}")
+
+
+if __name__ == "__main__":
+    main()
@@ -24,6 +24,12 @@ class Settings(BaseSettings):
 
     DEV_LOGIN_SECRET: str | None = None
 
+    # Каталог конкорданса (build_concordance.py) для /phrases/{id}/examples
+    CONCORDANCE_DIR: str | None = None
+
+    # Каталог индекса похожих фраз (build_similar_index.py) для /phrases/{id}/similar
+    SIMILAR_DIR: str | None = None
+
     model_config = SettingsConfigDict(
         env_file=str(ENV_FILE),
         env_file_encoding="utf-8",
@@ -1,13 +1,26 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from .api.routes_auth import router as auth_router
+from .api.routes_phrases import router as phrases_router
 from .api.routes_srs import router as srs_router
 from .api.routes_users import router as users_router
+from .services.similar import get_similar_index
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    # индекс похожих фраз открываем (mmap) при старте, а не на первом запросе
+    get_similar_index()
+    yield
+
 
 app = FastAPI(
     title="Lingro SRS API",
     version="0.1.0",
+    lifespan=lifespan,
 )
 
 # Разрешённые источники (откуда приходит фронт)
@@ -34,3 +47,4 @@ async def health():
 app.include_router(auth_router, prefix="/api/v1/auth", tags=["auth"])
 app.include_router(srs_router, prefix="/api/v1/srs", tags=["srs"])
 app.include_router(users_router, prefix="/api/v1", tags=["users"])
+app.include_router(phrases_router, prefix="/api/v1", tags=["phrases"])
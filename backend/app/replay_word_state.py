@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+"""
+replay_word_state.py
+
+Пересчёт user_word_state из user_phrase_history (event sourcing).
+
+Нужен после изменения правил перехода в srs_logic.apply_answer:
+история ответов проигрывается заново и user_word_state строится с нуля.
+
+Как работает:
+- пользователи делятся на шарды (user_id % shards), каждый шард —
+  отдельный процесс со своим соединением;
+- история читается server-side курсором, упорядоченно по
+  (user_id, shown_at, phrase_id), уже развёрнутая в слова фразы;
+- для каждого пользователя переходы применяются векторно (numpy):
+  таблицы переходов строятся из той же apply_answer, что и онлайн,
+  поэтому результат совпадает с process_answer; таблицы верны, только
+  пока переход не зависит от reps/lapses — это проверяется при импорте,
+  и если apply_answer с таблицами расходится, история проигрывается
+  вызовом apply_answer на каждое событие (медленнее, но точно);
+- результат пишется через COPY в staging-таблицу, после чего
+  строятся индексы и staging атомарно подменяет user_word_state.
+
+Строки истории с result, отличным от red/yellow/green (например 'shown'
+из srs_next_phrase_db.py), не меняют состояния и пропускаются.
+
+Во время пересчёта ответы пользователей лучше не принимать:
+ответы, записанные после чтения истории, в новую таблицу не попадут.
+
+Запуск (из backend/app):
+    python3 replay_word_state.py --shards 8
+    python3 replay_word_state.py --shards 8 --no-swap   # только staging + сравнение
+"""
+
+import argparse
+import io
+import sys
+import time
+from itertools import groupby
+from multiprocessing import Pool
+
+import numpy as np
+import psycopg2
+
+from srs_logic import (
+    ANSWER_COLORS,
+    ANSWER_INTERVALS,
+    DSN,
+    WORD_STATES,
+    apply_answer,
+)
+
+
+STAGING_TABLE = "user_word_state_replay"
+
+# reps/lapses 0..N-1, на которых таблицы переходов сверяются с apply_answer
+TABLE_CHECK_RANGE = 32
+
+# =============================
+# 1. SQL
+# =============================
+
+SQL_CREATE_STAGING = f"""
+DROP TABLE IF EXISTS {STAGING_TABLE};
+CREATE TABLE {STAGING_TABLE} (LIKE user_word_state INCLUDING DEFAULTS);
+"""
+
+# История, развёрнутая в слова фразы (как SQL_SELECT_WORD_STATES_FOR_PHRASE онлайн);
+# phrase_words фраз, выбывших из корпуса (phrases.retired_at), дельта-загрузка
+# сохраняет, так что их история тоже учитывается
+SQL_STREAM_HISTORY = """
+SELECT h.user_id, h.shown_at, h.phrase_id, h.result, pw.word_id
+FROM user_phrase_history h
+JOIN phrase_words pw ON pw.phrase_id = h.phrase_id
+WHERE h.user_id %% %(shards)s = %(shard)s
+ORDER BY h.user_id, h.shown_at, h.phrase_id;
+"""
+
+SQL_BUILD_STAGING_INDEXES = f"""
+ALTER TABLE {STAGING_TABLE}
+    ADD CONSTRAINT {STAGING_TABLE}_pkey PRIMARY KEY (user_id, word_id);
+CREATE INDEX idx_{STAGING_TABLE}_state
+    ON {STAGING_TABLE} (user_id, state);
+ANALYZE {STAGING_TABLE};
+"""
+
+SQL_DIFF_COUNT = f"""
+SELECT
+    (SELECT COUNT(*) FROM (
+        SELECT user_id, word_id, state, reps, lapses, last_result, last_seen, next_due
+        FROM user_word_state
+        EXCEPT
+        SELECT user_id, word_id, state, reps, lapses, last_result, last_seen, next_due
+        FROM {STAGING_TABLE}
+    ) a),
+    (SELECT COUNT(*) FROM (
+        SELECT user_id, word_id, state, reps, lapses, last_result, last_seen, next_due
+        FROM {STAGING_TABLE}
+        EXCEPT
+        SELECT user_id, word_id, state, reps, lapses, last_result, last_seen, next_due
+        FROM user_word_state
+    ) b);
+"""
+
+# Подмена таблицы в одной транзакции; FK добавляем NOT VALID и валидируем после
+SQL_SWAP = f"""
+LOCK TABLE user_word_state IN ACCESS EXCLUSIVE MODE;
+DROP TABLE user_word_state;
+ALTER TABLE {STAGING_TABLE} RENAME TO user_word_state;
+ALTER INDEX {STAGING_TABLE}_pkey RENAME TO user_word_state_pkey;
+ALTER INDEX idx_{STAGING_TABLE}_state RENAME TO idx_user_word_state_state;
+ALTER TABLE user_word_state
+    ADD CONSTRAINT user_word_state_user_id_fkey
+    FOREIGN KEY (user_id) REFERENCES users(id) NOT VALID;
+ALTER TABLE user_word_state
+    ADD CONSTRAINT user_word_state_word_id_fkey
+    FOREIGN KEY (word_id) REFERENCES words(id) NOT VALID;
+"""
+
+SQL_VALIDATE_FKS = """
+ALTER TABLE user_word_state VALIDATE CONSTRAINT user_word_state_user_id_fkey;
+ALTER TABLE user_word_state VALIDATE CONSTRAINT user_word_state_word_id_fkey;
+"""
+
+
+# =============================
+# 2. Таблицы переходов (из apply_answer)
+# =============================
+
+def build_transition_tables():
+    """
+    Для каждой пары (цвет, состояние) считаем через apply_answer:
+      next_state[c, s], reps_inc[c, s], lapses_inc[c, s].
+    """
+    n_c, n_s = len(ANSWER_COLORS), len(WORD_STATES)
+    next_state = np.zeros((n_c, n_s), dtype=np.int8)
+    reps_inc = np.zeros((n_c, n_s), dtype=np.int32)
+    lapses_inc = np.zeros((n_c, n_s), dtype=np.int32)
+
+    for c, color in enumerate(ANSWER_COLORS):
+        for s, state in enumerate(WORD_STATES):
+            new_state, reps, lapses = apply_answer(state, 0, 0, color)
+            next_state[c, s] = WORD_STATES.index(new_state)
+            reps_inc[c, s] = reps
+            lapses_inc[c, s] = lapses
+
+    return next_state, reps_inc, lapses_inc
+
+
+def tables_match_apply_answer(next_state, reps_inc, lapses_inc,
+                              limit: int = TABLE_CHECK_RANGE) -> bool:
+    """
+    Таблицы строятся при reps = lapses = 0; проверяем, что apply_answer
+    даёт то же состояние и те же приращения при любых reps/lapses < limit.
+    """
+    for c, color in enumerate(ANSWER_COLORS):
+        for s, state in enumerate(WORD_STATES):
+            for reps in range(limit):
+                for lapses in range(limit):
+                    expected = apply_answer(state, reps, lapses, color)
+                    got = (WORD_STATES[next_state[c, s]],
+                           reps + int(reps_inc[c, s]), lapses + int(lapses_inc[c, s]))
+                    if expected != got:
+                        return False
+    return True
+
+
+NEXT_STATE, REPS_INC, LAPSES_INC = build_transition_tables()
+TABLES_EXACT = tables_match_apply_answer(NEXT_STATE, REPS_INC, LAPSES_INC)
+COLOR_INDEX = {color: i for i, color in enumerate(ANSWER_COLORS)}
+
+
+# =============================
+# 3. Проигрывание истории одного пользователя
+# =============================
+
+def replay_user(rows):
+    """
+    rows: строки (user_id, shown_at, phrase_id, result, word_id) одного
+    пользователя в порядке (shown_at, phrase_id).
+
+    Возвращает (word_ids, states, reps, lapses, last_event, events):
+    массивы по уникальным словам (last_event — индекс последнего ответа
+    по слову) и список событий [(shown_at, color)], либо None.
+    """
+    events = []        # [(shown_at, color)]
+    ev_idx = []        # индекс события для каждой пары (событие, слово)
+    ev_word = []
+    last_key = None
+    seen_words = set()
+
+    for _uid, shown_at, phrase_id, result, word_id in rows:
+        if result not in COLOR_INDEX:
+            continue
+        key = (shown_at, phrase_id)
+        if key != last_key:
+            events.append((shown_at, result))
+            last_key = key
+            seen_words = set()
+        # повтор слова во фразе онлайн даёт тот же результат (читается одно
+        # и то же исходное состояние), поэтому достаточно одного применения
+        if word_id in seen_words:
+            continue
+        seen_words.add(word_id)
+        ev_idx.append(len(events) - 1)
+        ev_word.append(word_id)
+
+    if not ev_word:
+        return None
+
+    ev_idx = np.asarray(ev_idx, dtype=np.int64)
+    ev_word = np.asarray(ev_word, dtype=np.int64)
+    ev_color = np.asarray(
+        [COLOR_INDEX[events[i][1]] for i in ev_idx], dtype=np.int8
+    )
+
+    # группируем по слову, внутри слова — в порядке событий (сортировка стабильная)
+    order = np.argsort(ev_word, kind="stable")
+    ev_word = ev_word[order]
+    ev_idx = ev_idx[order]
+    ev_color = ev_color[order]
+
+    word_ids, starts, sizes = np.unique(ev_word, return_index=True, return_counts=True)
+
+    n_words = len(word_ids)
+    states = np.zeros(n_words, dtype=np.int8)   # NEW
+    reps = np.zeros(n_words, dtype=np.int32)
+    lapses = np.zeros(n_words, dtype=np.int32)
+
+    if TABLES_EXACT:
+        # шаг k: k-й ответ по каждому слову, у которого есть хотя бы k+1 ответов
+        for k in range(int(sizes.max())):
+            mask = sizes > k
+            pos = starts[mask] + k
+            colors = ev_color[pos]
+            cur = states[mask]
+            reps[mask] += REPS_INC[colors, cur]
+            lapses[mask] += LAPSES_INC[colors, cur]
+            states[mask] = NEXT_STATE[colors, cur]
+    else:
+        # переход зависит от reps/lapses — по одному apply_answer на событие
+        for w in range(n_words):
+            state, rp, lp = WORD_STATES[0], 0, 0
+            for pos in range(starts[w], starts[w] + sizes[w]):
+                state, rp, lp = apply_answer(state, rp, lp, ANSWER_COLORS[ev_color[pos]])
+            states[w] = WORD_STATES.index(state)
+            reps[w] = rp
+            lapses[w] = lp
+
+    last_event = ev_idx[starts + sizes - 1]
+    return word_ids, states, reps, lapses, last_event, events
+
+
+def write_user_rows(buf, user_id, result):
+    word_ids, states, reps, lapses, last_event, events = result
+    for wid, st, rp, lp, ev in zip(
+        word_ids.tolist(), states.tolist(), reps.tolist(),
+        lapses.tolist(), last_event.tolist(),
+    ):
+        shown_at, color = events[ev]
+        next_due = shown_at + ANSWER_INTERVALS[color]
+        buf.write(
+            f"{user_id}\t{wid}\t{WORD_STATES[st]}\t{rp}\t{lp}\t"
+            f"{color}\t{shown_at.isoformat()}\t{next_due.isoformat()}\n"
+        )
+    return len(word_ids)
+
+
+# =============================
+# 4. Шард: стрим истории → COPY в staging
+# =============================
+
+def flush_copy(cur, buf):
+    buf.seek(0)
+    cur.copy_expert(
+        f"""
+        COPY {STAGING_TABLE}
+            (user_id, word_id, state, reps, lapses, last_result, last_seen, next_due)
+        FROM STDIN
+        """,
+        buf,
+    )
+    buf.seek(0)
+    buf.truncate()
+
+
+def replay_shard(args):
+    shard, shards, itersize, flush_rows = args
+    t0 = time.time()
+
+    conn = psycopg2.connect(DSN)
+    read_cur = conn.cursor(name=f"replay_history_{shard}")  # server-side
+    read_cur.itersize = itersize
+    write_conn = psycopg2.connect(DSN)
+    write_cur = write_conn.cursor()
+
+    buf = io.StringIO()
+    pending = 0
+    n_users = 0
+    n_rows = 0
+
+    try:
+        read_cur.execute(SQL_STREAM_HISTORY, {"shards": shards, "shard": shard})
+
+        for user_id, rows in groupby(read_cur, key=lambda r: r[0]):
+            result = replay_user(rows)
+            n_users += 1
+            if result is None:
+                continue
+            written = write_user_rows(buf, user_id, result)
+            pending += written
+            n_rows += written
+            if pending >= flush_rows:
+                flush_copy(write_cur, buf)
+                pending = 0
+
+        if pending:
+            flush_copy(write_cur, buf)
+
+        write_conn.commit()
+    finally:
+        read_cur.close()
+        conn.close()
+        write_conn.close()
+
+    return shard, n_users, n_rows, time.time() - t0
+
+
+# =============================
+# 5. Main
+# =============================
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Пересчитать user_word_state из user_phrase_history (replay)."
+    )
+    parser.add_argument("--shards", type=int, default=4,
+                        help="Число шардов по user_id (= процессов). По умолчанию 4.")
+    parser.add_argument("--itersize", type=int, default=50_000,
+                        help="Сколько строк server-side курсор отдаёт за раз.")
+    parser.add_argument("--flush-rows", type=int, default=200_000,
+                        help="Сколько строк копить перед COPY в staging.")
+    parser.add_argument("--no-swap", action="store_true",
+                        help="Не подменять user_word_state: оставить staging и вывести расхождения.")
+    args = parser.parse_args()
+
+    try:
+        conn = psycopg2.connect(DSN)
+    except Exception as e:
+        print("[ERROR] DB connect failed:", e, file=sys.stderr)
+        sys.exit(1)
+    cur = conn.cursor()
+
+    print(f"[INFO] Creating staging table {STAGING_TABLE}...")
+    cur.execute(SQL_CREATE_STAGING)
+    conn.commit()
+
+    if not TABLES_EXACT:
+        print("[INFO] apply_answer depends on reps/lapses: replaying event by event (slower).")
+    print(f"[INFO] Replaying history in {args.shards} shards...")
+    t0 = time.time()
+    tasks = [(s, args.shards, args.itersize, args.flush_rows) for s in range(args.shards)]
+    total_users = 0
+    total_rows = 0
+    with Pool(processes=args.shards) as pool:
+        for shard, n_users, n_rows, dt in pool.imap_unordered(replay_shard, tasks):
+            total_users += n_users
+            total_rows += n_rows
+            print(f"[shard {shard}] users={n_users:,} rows={n_rows:,} ({dt:.1f}s)")
+    print(f"[OK] Replayed {total_users:,} users, {total_rows:,} word states "
+          f"in {time.time() - t0:.1f}s.")
+
+    print("[INFO] Building staging indexes...")
+    cur.execute(SQL_BUILD_STAGING_INDEXES)
+    conn.commit()
+
+    cur.execute(SQL_DIFF_COUNT)
+    only_old, only_new = cur.fetchone()
+    print(f"[INFO] Rows only in current user_word_state: {only_old:,}")
+    print(f"[INFO] Rows only in replayed state:          {only_new:,}")
+
+    if args.no_swap:
+        print(f"[DONE] Staging left in {STAGING_TABLE}, user_word_state untouched.")
+        conn.close()
+        return
+
+    print("[INFO] Swapping tables...")
+    cur.execute(SQL_SWAP)
+    conn.commit()
+    cur.execute(SQL_VALIDATE_FKS)
+    conn.commit()
+    print("[DONE] user_word_state rebuilt from history.")
+
+    cur.close()
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,24 @@
+from pydantic import BaseModel
+
+
+class PhraseExample(BaseModel):
+    offset: int
+    text: str
+
+
+class PhraseExamplesResponse(BaseModel):
+    phrase_id: int
+    total: int
+    examples: list[PhraseExample]
+
+
+class SimilarPhrase(BaseModel):
+    phrase_id: int
+    text: str
+    score: float
+
+
+class SimilarPhrasesResponse(BaseModel):
+    phrase_id: int
+    text: str
+    similar: list[SimilarPhrase]
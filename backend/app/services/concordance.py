@@ -0,0 +1,87 @@
+"""
+Чтение конкорданса, собранного offline/subtitle-phrase-miner/build_concordance.py:
+для phrase_id — примеры строк корпуса по сохранённым (файл, смещение).
+
+postings.u64 / offsets.u64 / totals.u64 открываются через mmap один раз
+на процесс; строка примера читается одним os.pread по смещению.
+
+Строки конкорданса — id фраз в БД (meta.json: ids = "db"); каталог,
+собранный по номерам строк файла (до phrase_ids_for_db.tsv), не
+используется — после дельта-загрузки его id указывают не на те фразы.
+"""
+import json
+import mmap
+import os
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+
+from ..core.config import settings
+
+FILE_SHIFT = 48
+OFFSET_MASK = (1 << FILE_SHIFT) - 1
+
+# больше этого строку примера не читаем
+MAX_LINE_BYTES = 4096
+
+
+@dataclass
+class PhraseExample:
+    offset: int
+    text: str
+
+
+class Concordance:
+    def __init__(self, root: Path):
+        with (root / "meta.json").open("r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.n_phrases: int = meta["n_phrases"]
+        self.db_ids: bool = meta.get("ids") == "db"
+        self.files: list[str] = meta["files"]
+
+        self._maps = []
+        self.postings = self._open_u64(root / "postings.u64")
+        self.offsets = self._open_u64(root / "offsets.u64")
+        self.totals = self._open_u64(root / "totals.u64")
+        self._fds = [os.open(path, os.O_RDONLY) for path in self.files]
+
+    def _open_u64(self, path: Path) -> memoryview:
+        if path.stat().st_size == 0:
+            return memoryview(b"").cast("Q")
+        with path.open("rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps.append(mm)
+        return memoryview(mm).cast("Q")
+
+    def _read_line(self, file_no: int, offset: int) -> str:
+        raw = os.pread(self._fds[file_no], MAX_LINE_BYTES, offset)
+        nl = raw.find(b"\n")
+        if nl >= 0:
+            raw = raw[:nl]
+        return raw.decode("utf-8", errors="ignore").rstrip("\r").strip()
+
+    def total(self, phrase_id: int) -> int:
+        return self.totals[phrase_id]
+
+    def examples(self, phrase_id: int, limit: int) -> list[PhraseExample]:
+        start = self.offsets[phrase_id]
+        end = min(self.offsets[phrase_id + 1], start + limit)
+        out = []
+        for i in range(start, end):
+            posting = self.postings[i]
+            file_no = posting >> FILE_SHIFT
+            offset = posting & OFFSET_MASK
+            out.append(PhraseExample(offset=offset, text=self._read_line(file_no, offset)))
+        return out
+
+
+@lru_cache()
+def get_concordance() -> Concordance | None:
+    """Конкорданс из settings.CONCORDANCE_DIR (None, если не настроен)."""
+    if not settings.CONCORDANCE_DIR:
+        return None
+    root = Path(settings.CONCORDANCE_DIR)
+    if not (root / "meta.json").exists():
+        return None
+    conc = Concordance(root)
+    return conc if conc.db_ids else None
@@ -0,0 +1,83 @@
+"""
+Похожие фразы из индекса offline/subtitle-phrase-miner/build_similar_index.py:
+для phrase_id — заранее посчитанные top-k соседей по эмбеддингам.
+
+knn_ids.i32 / knn_sims.f32 / тексты открываются через mmap один раз на
+процесс (при старте приложения); запрос — срез строки таблицы, без БД.
+
+Строки и соседи — id фраз в БД (meta.json: ids = "db"); индекс по номерам
+строк файла (до phrase_ids_for_db.tsv) не используется. У id без фразы в
+индексе (retired) текст пустой.
+"""
+import json
+import mmap
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+
+from ..core.config import settings
+
+
+@dataclass
+class SimilarPhrase:
+    phrase_id: int
+    text: str
+    score: float
+
+
+class SimilarIndex:
+    def __init__(self, root: Path):
+        with (root / "meta.json").open("r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.n_phrases: int = meta["n"]
+        self.k: int = meta["k"]
+        self.db_ids: bool = meta.get("ids") == "db"
+
+        self._maps = []
+        self.ids = self._open(root / "knn_ids.i32", "i")
+        self.sims = self._open(root / "knn_sims.f32", "f")
+        self.text_offsets = self._open(root / "text_offsets.u64", "Q")
+        self.texts = self._open(root / "texts.bin", "B")
+
+    def _open(self, path: Path, fmt: str) -> memoryview:
+        if path.stat().st_size == 0:
+            return memoryview(b"").cast(fmt)
+        with path.open("rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps.append(mm)
+        return memoryview(mm).cast(fmt)
+
+    def has(self, phrase_id: int) -> bool:
+        return (0 <= phrase_id < self.n_phrases
+                and self.text_offsets[phrase_id + 1] > self.text_offsets[phrase_id])
+
+    def text(self, phrase_id: int) -> str:
+        start = self.text_offsets[phrase_id]
+        end = self.text_offsets[phrase_id + 1]
+        return bytes(self.texts[start:end]).decode("utf-8")
+
+    def similar(self, phrase_id: int, limit: int) -> list[SimilarPhrase]:
+        base = phrase_id * self.k
+        out = []
+        for j in range(self.k):
+            other = self.ids[base + j]
+            # сама фраза (обычно столбец 0) и пустые места пропускаются
+            if other < 0 or other == phrase_id:
+                continue
+            out.append(SimilarPhrase(phrase_id=other, text=self.text(other),
+                                     score=self.sims[base + j]))
+            if len(out) >= limit:
+                break
+        return out
+
+
+@lru_cache()
+def get_similar_index() -> SimilarIndex | None:
+    """Индекс из settings.SIMILAR_DIR (None, если не настроен)."""
+    if not settings.SIMILAR_DIR:
+        return None
+    root = Path(settings.SIMILAR_DIR)
+    if not (root / "meta.json").exists():
+        return None
+    index = SimilarIndex(root)
+    return index if index.db_ids else None
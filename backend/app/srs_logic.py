@@ -29,6 +29,10 @@ DSN = (
     f"host={PG_HOST} port={PG_PORT}"
 )
 
+# схема поиска кандидатов: "join" — через phrase_words,
+# "arrays" — через phrases.word_ids (load_corpus_to_db.py --word-arrays)
+PHRASE_SCHEMA = os.getenv("SRS_PHRASE_SCHEMA", "join")
+
 
 def get_conn():
     return psycopg2.connect(DSN, cursor_factory=DictCursor)
@@ -85,10 +89,11 @@ candidates AS (
      AND h.phrase_id = p.id
     WHERE a.n_new = 1
       AND h.phrase_id IS NULL
+      AND p.retired_at IS NULL
 )
 SELECT id, phrase, freq, n_new, n_intro, n_learn
 FROM candidates
-ORDER BY freq DESC
+ORDER BY freq DESC, id
 LIMIT 1;
 """
 
@@ -122,7 +127,8 @@ SELECT
 FROM agg a
 JOIN phrases p ON p.id = a.phrase_id
 WHERE a.n_new >= 1
-ORDER BY p.freq DESC
+  AND p.retired_at IS NULL
+ORDER BY p.freq DESC, p.id
 LIMIT 1;
 """
 
@@ -139,6 +145,82 @@ ORDER BY pw.position
 LIMIT 1;
 """
 
+# --- те же запросы по phrases.word_ids / word_positions ---
+# Состояние пользователя сначала читается массивами id слов и передаётся
+# в запрос параметрами: для констант = ANY / <> ALL PostgreSQL (14+) строит
+# хеш-таблицу, так что счётчики фразы считаются по её массиву без соединения
+# с phrase_words. Фразы перебираются по idx_phrases_freq до первой подходящей.
+
+SQL_ARRAY_USER_STATE = """
+SELECT
+    COALESCE(array_agg(word_id) FILTER (WHERE state <> 'NEW'),   '{}') AS seen,
+    COALESCE(array_agg(word_id) FILTER (WHERE state = 'INTRO'), '{}') AS intro,
+    COALESCE(array_agg(word_id) FILTER (WHERE state = 'LEARN'), '{}') AS learn
+FROM user_word_state
+WHERE user_id = %(user_id)s;
+"""
+
+SQL_ARRAY_COUNTS = """
+        (SELECT COUNT(*) FROM unnest(p.word_ids) w WHERE w <> ALL (%(seen)s::int[])) AS n_new,
+        (SELECT COUNT(*) FROM unnest(p.word_ids) w WHERE w = ANY (%(intro)s::int[])) AS n_intro,
+        (SELECT COUNT(*) FROM unnest(p.word_ids) w WHERE w = ANY (%(learn)s::int[])) AS n_learn"""
+
+SQL_FIND_CANDIDATE_STRICT_ARRAYS = f"""
+SELECT c.id, c.phrase, c.freq, c.n_new, c.n_intro, c.n_learn
+FROM (
+    SELECT p.id, p.phrase, p.freq,{SQL_ARRAY_COUNTS}
+    FROM phrases p
+    WHERE p.word_ids IS NOT NULL
+      AND p.retired_at IS NULL
+) c
+WHERE c.n_new = 1
+  AND NOT EXISTS (
+      SELECT 1 FROM user_phrase_history h
+      WHERE h.user_id = %(user_id)s
+        AND h.phrase_id = c.id
+  )
+ORDER BY c.freq DESC, c.id
+LIMIT 1;
+"""
+
+# n_new >= 1 <=> в фразе есть ещё не виденное слово
+SQL_FIND_CANDIDATE_RELAXED_ARRAYS = f"""
+SELECT p.id, p.phrase, p.freq,{SQL_ARRAY_COUNTS}
+FROM phrases p
+WHERE p.word_ids IS NOT NULL
+  AND p.retired_at IS NULL
+  AND EXISTS (SELECT 1 FROM unnest(p.word_ids) w WHERE w <> ALL (%(seen)s::int[]))
+ORDER BY p.freq DESC, p.id
+LIMIT 1;
+"""
+
+SQL_FIND_TARGET_WORD_ARRAYS = """
+SELECT w.id AS word_id, w.word
+FROM phrases p
+CROSS JOIN LATERAL unnest(p.word_ids, p.word_positions) AS t(word_id, position)
+JOIN words w ON w.id = t.word_id
+LEFT JOIN user_word_state uws
+  ON uws.word_id = t.word_id
+ AND uws.user_id = %(user_id)s
+WHERE p.id = %(phrase_id)s
+  AND COALESCE(uws.state::text, 'NEW') = 'NEW'
+ORDER BY t.position
+LIMIT 1;
+"""
+
+# схема -> (strict, relaxed, target word)
+CANDIDATE_QUERIES = {
+    "join": (SQL_FIND_CANDIDATE_STRICT, SQL_FIND_CANDIDATE_RELAXED, SQL_FIND_TARGET_WORD),
+    "arrays": (SQL_FIND_CANDIDATE_STRICT_ARRAYS, SQL_FIND_CANDIDATE_RELAXED_ARRAYS,
+               SQL_FIND_TARGET_WORD_ARRAYS),
+}
+
+# опечатка в SRS_PHRASE_SCHEMA — ошибка при старте, а не KeyError на запросе
+if PHRASE_SCHEMA not in CANDIDATE_QUERIES:
+    print(f"[ERROR] SRS_PHRASE_SCHEMA={PHRASE_SCHEMA!r}: expected one of "
+          f"{', '.join(CANDIDATE_QUERIES)}", file=sys.stderr)
+    sys.exit(1)
+
 
 SQL_INSERT_HISTORY = """
 INSERT INTO user_phrase_history (user_id, phrase_id, shown_at, result)
@@ -199,55 +281,66 @@ class NextPhrase:
 # 4. Логика выбора следующей фразы
 # =============================
 
+def find_next_phrase(cur, user_id: int, schema: str = PHRASE_SCHEMA) -> NextPhrase | None:
+    """Выбор фразы на открытом курсоре; schema — ключ CANDIDATE_QUERIES."""
+    sql_strict, sql_relaxed, sql_target = CANDIDATE_QUERIES[schema]
+    params = {"user_id": user_id}
+    if schema == "arrays":
+        cur.execute(SQL_ARRAY_USER_STATE, params)
+        params.update(cur.fetchone())
+
+    # строгий режим
+    cur.execute(sql_strict, params)
+    row = cur.fetchone()
+    mode = "STRICT"
+
+    if row is None:
+        # ослабленный: допускаем уже виденные фразы
+        cur.execute(sql_relaxed, params)
+        row = cur.fetchone()
+        mode = "RELAXED"
+
+    if row is None:
+        return None
+
+    phrase_id = row["id"]
+    phrase    = row["phrase"]
+    freq      = row["freq"]
+    n_new     = row["n_new"]
+    n_intro   = row["n_intro"]
+    n_learn   = row["n_learn"]
+
+    # целевое слово (одно NEW-слово в фразе)
+    cur.execute(
+        sql_target,
+        {"user_id": user_id, "phrase_id": phrase_id},
+    )
+    wrow = cur.fetchone()
+    if wrow:
+        target_word_id = wrow["word_id"]
+        target_word    = wrow["word"]
+    else:
+        target_word_id = None
+        target_word    = None
+
+    return NextPhrase(
+        phrase_id=phrase_id,
+        phrase=phrase,
+        freq=freq,
+        n_new=n_new,
+        n_intro=n_intro,
+        n_learn=n_learn,
+        mode=mode,
+        target_word_id=target_word_id,
+        target_word=target_word,
+    )
+
+
 def get_next_phrase(user_id: int) -> NextPhrase | None:
     conn = get_conn()
     try:
         with conn.cursor() as cur:
-            # строгий режим
-            cur.execute(SQL_FIND_CANDIDATE_STRICT, {"user_id": user_id})
-            row = cur.fetchone()
-            mode = "STRICT"
-
-            if row is None:
-                # ослабленный: допускаем уже виденные фразы
-                cur.execute(SQL_FIND_CANDIDATE_RELAXED, {"user_id": user_id})
-                row = cur.fetchone()
-                mode = "RELAXED"
-
-            if row is None:
-                return None
-
-            phrase_id = row["id"]
-            phrase    = row["phrase"]
-            freq      = row["freq"]
-            n_new     = row["n_new"]
-            n_intro   = row["n_intro"]
-            n_learn   = row["n_learn"]
-
-            # целевое слово (одно NEW-слово в фразе)
-            cur.execute(
-                SQL_FIND_TARGET_WORD,
-                {"user_id": user_id, "phrase_id": phrase_id},
-            )
-            wrow = cur.fetchone()
-            if wrow:
-                target_word_id = wrow["word_id"]
-                target_word    = wrow["word"]
-            else:
-                target_word_id = None
-                target_word    = None
-
-            return NextPhrase(
-                phrase_id=phrase_id,
-                phrase=phrase,
-                freq=freq,
-                n_new=n_new,
-                n_intro=n_intro,
-                n_learn=n_learn,
-                mode=mode,
-                target_word_id=target_word_id,
-                target_word=target_word,
-            )
+            return find_next_phrase(cur, user_id)
     finally:
         conn.close()
 
@@ -257,6 +350,59 @@ def get_next_phrase(user_id: int) -> NextPhrase | None:
 #    answer_color: "red" | "yellow" | "green"
 # =============================
 
+ANSWER_COLORS = ("red", "yellow", "green")
+
+# порядок совпадает с word_state_enum в БД
+WORD_STATES = ("NEW", "INTRO", "LEARN", "KNOWN", "MATURE")
+
+# интервалы (можно будет подстроить)
+ANSWER_INTERVALS = {
+    "red": timedelta(days=0.5),   # через 12 часов
+    "yellow": timedelta(days=2),  # через 2 дня
+    "green": timedelta(days=7),   # через неделю
+}
+
+
+def apply_answer(state: str, reps: int, lapses: int, answer_color: str) -> tuple[str, int, int]:
+    """
+    Переход состояния одного слова по ответу на фразу.
+    Чистая функция: используется и онлайн (process_answer),
+    и при пересчёте user_word_state из истории (replay_word_state.py).
+
+    Возвращает (new_state, reps, lapses).
+    """
+    new_state = state
+
+    if answer_color == "red":
+        # откат / закрепление
+        lapses += 1
+        if state in ("NEW", "INTRO"):
+            new_state = "INTRO"
+        else:
+            new_state = "LEARN"
+
+    elif answer_color == "yellow":
+        # нормальное продвижение
+        reps += 1
+        if state in ("NEW", "INTRO"):
+            new_state = "LEARN"
+        elif state == "LEARN":
+            new_state = "LEARN"
+        elif state == "KNOWN":
+            new_state = "KNOWN"
+
+    else:  # green
+        reps += 1
+        if state in ("NEW", "INTRO"):
+            new_state = "LEARN"
+        elif state == "LEARN":
+            new_state = "KNOWN"
+        elif state == "KNOWN":
+            new_state = "KNOWN"
+
+    return new_state, reps, lapses
+
+
 def process_answer(user_id: int, phrase_id: int, answer_color: str) -> None:
     """
     Простая базовая логика SRS под 3 цвета:
@@ -267,20 +413,11 @@ def process_answer(user_id: int, phrase_id: int, answer_color: str) -> None:
     Для отладки: обновляем все СЛАБЫЕ слова фразы
     (NEW/INTRO/LEARN), KNOWN/MATURE сильно не трогаем.
     """
-    if answer_color not in ("red", "yellow", "green"):
+    if answer_color not in ANSWER_COLORS:
         raise ValueError("answer_color must be 'red', 'yellow' or 'green'")
 
     now = datetime.now(timezone.utc)
-
-    # интервалы (можно будет подстроить)
-    if answer_color == "red":
-        delta = timedelta(days=0.5)   # через 12 часов
-    elif answer_color == "yellow":
-        delta = timedelta(days=2)     # через 2 дня
-    else:  # green
-        delta = timedelta(days=7)     # через неделю
-
-    next_due = now + delta
+    next_due = now + ANSWER_INTERVALS[answer_color]
 
     conn = get_conn()
     try:
@@ -309,34 +446,7 @@ def process_answer(user_id: int, phrase_id: int, answer_color: str) -> None:
                 reps    = row["reps"] or 0
                 lapses  = row["lapses"] or 0
 
-                new_state = state
-
-                if answer_color == "red":
-                    # откат / закрепление
-                    lapses += 1
-                    if state in ("NEW", "INTRO"):
-                        new_state = "INTRO"
-                    else:
-                        new_state = "LEARN"
-
-                elif answer_color == "yellow":
-                    # нормальное продвижение
-                    reps += 1
-                    if state in ("NEW", "INTRO"):
-                        new_state = "LEARN"
-                    elif state == "LEARN":
-                        new_state = "LEARN"
-                    elif state == "KNOWN":
-                        new_state = "KNOWN"
-
-                else:  # green
-                    reps += 1
-                    if state in ("NEW", "INTRO"):
-                        new_state = "LEARN"
-                    elif state == "LEARN":
-                        new_state = "KNOWN"
-                    elif state == "KNOWN":
-                        new_state = "KNOWN"
+                new_state, reps, lapses = apply_answer(state, reps, lapses, answer_color)
 
                 cur.execute(
                     SQL_UPSERT_WORD_STATE,
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+ngram_extract.py
+
+Общие куски параллельного извлечения n-грамм из JSONL-корпуса
+(строки вида {"text": "..."}), для offline/hablai/count_ngrams_*.py.
+
+Корпус режется на диапазоны байт (parallel_lines), каждый диапазон
+обрабатывается в своём процессе. Внутри процесса токены интернируются
+в целые id (локальный словарь воркера), n-граммы считаются как кортежи
+id — без склейки строки на каждое вхождение. В строки " ".join(...)
+превращаются только уникальные ключи при сбросе счётчика.
+
+Подключение:
+
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "common"))
+    from ngram_extract import iter_corpus_range, count_ngram_ids, ...
+"""
+import json
+import os
+import sys
+import time
+import zlib
+from collections import Counter, defaultdict
+from typing import Dict, Iterator, List, Tuple
+
+from parallel_lines import iter_range_lines
+
+
+def iter_corpus_range(
+    path: str,
+    start: int,
+    end: int,
+    min_chars: int,
+    max_chars: int,
+    strip_text: bool = False,
+) -> Iterator[Tuple[int, List[str]]]:
+    """
+    (номер строки внутри диапазона, токены) для строк корпуса в [start, end),
+    прошедших фильтр по длине текста. strip_text — делать ли .strip()
+    у text перед проверками (count_ngrams_simple делает, external — нет).
+    """
+    for i, line in enumerate(iter_range_lines(path, start, end)):
+        line = line.strip()
+        if not line:
+            continue
+
+        text = json.loads(line).get("text", "")
+        if strip_text:
+            text = text.strip()
+        if not text:
+            continue
+        if len(text) < min_chars or len(text) > max_chars:
+            continue
+
+        tokens = text.split()
+        if not tokens:
+            continue
+
+        yield i, tokens
+
+
+def intern_tokens(tokens: List[str], vocab: Dict[str, int], words: List[str]) -> List[int]:
+    """Токены -> id локального словаря (новые слова дописываются в vocab/words)."""
+    ids = []
+    for t in tokens:
+        tid = vocab.get(t)
+        if tid is None:
+            tid = len(words)
+            vocab[t] = tid
+            words.append(t)
+        ids.append(tid)
+    return ids
+
+
+def count_ngram_ids(ids: List[int], counters: Dict[int, Counter]) -> int:
+    """
+    Добавить n-граммы строки в counters[n] (ключ — кортеж id).
+    Несколько n могут делить один Counter: кортежи разной длины не совпадают.
+    Возвращает число добавленных n-грамм.
+    """
+    total = 0
+    L = len(ids)
+    for n, counter in counters.items():
+        if L < n:
+            continue
+        counter.update(zip(*(ids[k:] for k in range(n))))
+        total += L - n + 1
+    return total
+
+
+def ids_to_text(counter: Counter, words: List[str]) -> Counter:
+    """Counter кортежей id -> Counter строк " ".join(слова)."""
+    out = Counter()
+    for key, c in counter.items():
+        out[" ".join([words[t] for t in key])] = c
+    return out
+
+
+def partition_of(key: str, partitions: int) -> int:
+    # crc32 стабилен между процессами (в отличие от hash())
+    return zlib.crc32(key.encode("utf-8", "surrogatepass")) % partitions
+
+
+def report_workers(stats: List[Tuple[int, int, int, float]]):
+    """
+    Сводка по воркерам: stats — [(pid, строк, n-грамм, секунд)]
+    по диапазонам; суммируется по pid.
+    """
+    per_pid = defaultdict(lambda: [0, 0, 0.0])
+    for pid, lines, ngrams, secs in stats:
+        acc = per_pid[pid]
+        acc[0] += lines
+        acc[1] += ngrams
+        acc[2] += secs
+
+    for pid, (lines, ngrams, secs) in sorted(per_pid.items()):
+        secs = max(secs, 1e-9)
+        print(f"[worker {pid}] {lines:,} lines, {ngrams:,} ngrams in {secs:.1f}s: "
+              f"{lines / secs:,.0f} lines/s, {ngrams / secs:,.0f} ngrams/s",
+              file=sys.stderr)
+
+
+def range_stats(lines: int, ngrams: int, t0: float) -> Tuple[int, int, int, float]:
+    return os.getpid(), lines, ngrams, time.time() - t0
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+parallel_lines.py
+
+Общий параллельный построчный ридер для оффлайн-скриптов корпуса.
+
+Большой файл режется на диапазоны байт, выровненные по '\\n';
+каждый диапазон читается в своём процессе через mmap. Результаты
+собираются в порядке диапазонов, поэтому построчные фильтры
+дают тот же вывод, что и последовательный проход.
+
+Строки разбиваются так же, как при open(..., "r") (universal newlines:
+\\n, \\r\\n, \\r), декодируются utf-8 с errors="ignore" и отдаются
+без символа перевода строки.
+
+Подключение из скриптов в соседних каталогах offline/:
+
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "common"))
+    from parallel_lines import filter_lines_parallel, map_byte_ranges
+"""
+import mmap
+from bisect import bisect_left
+import os
+import shutil
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+# сколько байт mmap декодируется за раз внутри диапазона
+READ_BLOCK_BYTES = 32 * 1024 * 1024
+
+
+def split_byte_ranges(path: str, n_parts: int) -> List[Tuple[int, int]]:
+    """
+    Разбить файл на <= n_parts диапазонов [start, end), каждый
+    начинается с начала строки и заканчивается сразу после '\\n' (или EOF).
+    """
+    size = os.path.getsize(path)
+    if size == 0:
+        return []
+
+    n_parts = max(1, n_parts)
+    bounds = [0]
+    with open(path, "rb") as f:
+        for i in range(1, n_parts):
+            target = size * i // n_parts
+            if target <= bounds[-1]:
+                continue
+            f.seek(target - 1)
+            f.readline()  # дочитываем до конца строки, в которую попали
+            pos = f.tell()
+            if pos >= size:
+                break
+            if pos > bounds[-1]:
+                bounds.append(pos)
+    bounds.append(size)
+
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def line_start_offsets(path: str, every: int) -> List[int]:
+    """
+    Смещения начала строк с номерами every, 2 * every, ... (с 0, строки —
+    как при open(..., "r"): конец строки — \n, \r\n или одиночный \r).
+    Один проход numpy по mmap блоками READ_BLOCK_BYTES.
+    """
+    size = os.path.getsize(path)
+    if size == 0 or every <= 0:
+        return []
+
+    starts = []
+    lines = 0  # строк, закончившихся до текущего блока
+    with open(path, "rb") as f, \
+         mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for pos in range(0, size, READ_BLOCK_BYTES):
+            n = min(READ_BLOCK_BYTES, size - pos)
+            block = np.frombuffer(mm, dtype=np.uint8, count=n, offset=pos)
+            ends = np.flatnonzero(block == 10)
+            cr = np.flatnonzero(block == 13)
+            if len(cr):
+                # \r — конец строки, только если за ним не \n
+                nxt = np.empty(len(cr), dtype=np.uint8)
+                inside = cr + 1 < n
+                nxt[inside] = block[cr[inside] + 1]
+                if not inside[-1]:
+                    nxt[-1] = mm[pos + n] if pos + n < size else 0
+                ends = np.union1d(ends, cr[nxt != 10])
+            # строка с номером k начинается после конца строки k - 1
+            first = -lines % every or every
+            for j in range(first - 1, len(ends), every):
+                start = pos + int(ends[j]) + 1
+                if start < size:
+                    starts.append(start)
+            lines += len(ends)
+            del block
+    return starts
+
+
+def split_aligned_ranges(path: str, n_parts: int, every: int) -> List[Tuple[int, int]]:
+    """
+    Как split_byte_ranges, но границы диапазонов — только в начале строк
+    с номерами, кратными every: каждый диапазон состоит из целых групп по
+    every строк, счёт строк внутри диапазона совпадает с глобальным по модулю every.
+    """
+    size = os.path.getsize(path)
+    if size == 0:
+        return []
+
+    aligned = line_start_offsets(path, every)
+    bounds = [0]
+    n_parts = max(1, n_parts)
+    for i in range(1, n_parts):
+        target = size * i // n_parts
+        k = bisect_left(aligned, target)
+        if k < len(aligned) and aligned[k] > bounds[-1]:
+            bounds.append(aligned[k])
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def iter_range_lines(path: str, start: int, end: int) -> Iterator[str]:
+    """
+    Строки диапазона [start, end) через mmap, без '\\n' на конце.
+    """
+    if end <= start:
+        return
+
+    with open(path, "rb") as f, \
+         mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+
+        pos = start
+        while pos < end:
+            block_end = min(pos + READ_BLOCK_BYTES, end)
+            if block_end < end:
+                nl = mm.rfind(b"\n", pos, block_end)
+                if nl >= 0:
+                    block_end = nl + 1
+                else:
+                    # строка длиннее блока — читаем до её конца
+                    nl = mm.find(b"\n", block_end, end)
+                    block_end = end if nl < 0 else nl + 1
+
+            text = mm[pos:block_end].decode("utf-8", errors="ignore")
+            pos = block_end
+
+            if "\r" in text:
+                text = text.replace("\r\n", "\n").replace("\r", "\n")
+            lines = text.split("\n")
+            # хвост после последнего '\n' (или недекодируемые байты) — не строка
+            if not lines[-1]:
+                lines.pop()
+            yield from lines
+
+
+def iter_range_line_offsets(path: str, start: int, end: int) -> Iterator[Tuple[int, str]]:
+    """
+    (смещение начала строки в файле, строка) для диапазона [start, end).
+    Строки режутся только по '\n' (хвостовой '\r' срезается), чтобы
+    смещения были точными байтовыми позициями для seek().
+    """
+    if end <= start:
+        return
+
+    with open(path, "rb") as f, \
+         mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+
+        pos = start
+        while pos < end:
+            block_end = min(pos + READ_BLOCK_BYTES, end)
+            if block_end < end:
+                nl = mm.rfind(b"\n", pos, block_end)
+                if nl >= 0:
+                    block_end = nl + 1
+                else:
+                    nl = mm.find(b"\n", block_end, end)
+                    block_end = end if nl < 0 else nl + 1
+
+            pieces = mm[pos:block_end].split(b"\n")
+            if not pieces[-1]:
+                pieces.pop()
+            off = pos
+            for piece in pieces:
+                line = piece.decode("utf-8", errors="ignore")
+                if line.endswith("\r"):
+                    line = line[:-1]
+                yield off, line
+                off += len(piece) + 1
+            pos = block_end
+
+
+def map_byte_ranges(
+    path: str,
+    func: Callable,
+    workers: int,
+    *args,
+    parts: Optional[int] = None,
+    progress: bool = True,
+    ranges: Optional[List[Tuple[int, int]]] = None,
+) -> list:
+    """
+    Вызвать func(path, start, end, *args) для каждого диапазона файла
+    в пуле процессов. Возвращает результаты в порядке диапазонов.
+
+    parts — число диапазонов (по умолчанию 4 * workers, чтобы
+    неравномерные диапазоны не простаивали на одном воркере);
+    ranges — готовые диапазоны (например, split_aligned_ranges) вместо них.
+    """
+    if ranges is None:
+        ranges = split_byte_ranges(path, parts or 4 * workers)
+    if not ranges:
+        return []
+
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        futures = [ex.submit(func, path, s, e, *args) for s, e in ranges]
+        results = []
+        for i, fut in enumerate(futures, start=1):
+            results.append(fut.result())
+            if progress:
+                print(f"[progress] range {i}/{len(ranges)} done", file=sys.stderr)
+    return results
+
+
+def _filter_range(
+    path: str,
+    start: int,
+    end: int,
+    line_fn: Callable[[str], Optional[str]],
+    part_path: str,
+) -> Tuple[int, int, int]:
+    n_in = n_out = n_changed = 0
+    with open(part_path, "w", encoding="utf-8") as fout:
+        for line in iter_range_lines(path, start, end):
+            n_in += 1
+            out = line_fn(line)
+            if out is None:
+                continue
+            fout.write(out + "\n")
+            n_out += 1
+            if out != line:
+                n_changed += 1
+    return n_in, n_out, n_changed
+
+
+def filter_lines_parallel(
+    in_path: str,
+    out_path: str,
+    line_fn: Callable[[str], Optional[str]],
+    workers: int,
+    parts: Optional[int] = None,
+    tmp_dir: Optional[str] = None,
+) -> Tuple[int, int, int]:
+    """
+    Построчный фильтр/преобразователь: line_fn(line) -> новая строка или None
+    (строка выбрасывается). line_fn должна быть picklable (функция модуля
+    или functools.partial от неё).
+
+    Каждый диапазон пишется во временный файл, затем файлы склеиваются
+    по порядку — вывод совпадает с последовательным проходом.
+    Возвращает (строк прочитано, строк записано, строк изменено).
+    """
+    part_dir = tempfile.mkdtemp(
+        prefix="lines_", dir=tmp_dir or os.path.dirname(os.path.abspath(out_path))
+    )
+    stats = [0, 0, 0]
+    try:
+        ranges = split_byte_ranges(in_path, parts or 4 * workers)
+        part_paths = [os.path.join(part_dir, f"part_{i:05d}.txt") for i in range(len(ranges))]
+
+        with ProcessPoolExecutor(max_workers=workers) as ex:
+            futures = [
+                ex.submit(_filter_range, in_path, s, e, line_fn, pp)
+                for (s, e), pp in zip(ranges, part_paths)
+            ]
+            for i, fut in enumerate(futures, start=1):
+                for k, v in enumerate(fut.result()):
+                    stats[k] += v
+                print(f"[progress] range {i}/{len(ranges)} done, "
+                      f"{stats[0]:,} lines read, {stats[1]:,} kept", file=sys.stderr)
+
+        with open(out_path, "wb") as fout:
+            for pp in part_paths:
+                with open(pp, "rb") as fin:
+                    shutil.copyfileobj(fin, fout, 16 * 1024 * 1024)
+    finally:
+        shutil.rmtree(part_dir, ignore_errors=True)
+
+    return stats[0], stats[1], stats[2]
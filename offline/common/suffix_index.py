@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+"""
+suffix_index.py
+
+Суффиксный массив (с LCP) над хранилищем id слов (token_store) —
+точные частоты любой фразы без таблиц n-грамм.
+
+Текст индекса — токены всех строк хранилища подряд, после каждой строки
+разделитель SEP (больше любого id слова), поэтому совпадения никогда
+не пересекают границу строки. Частота фразы из m слов — число суффиксов,
+начинающихся с неё; это непрерывный диапазон суффиксного массива,
+который находится двумя бинарными поисками: O(m log n).
+
+Каталог индекса:
+
+    text.u32    токены со разделителями SEP (uint32)
+    sa.u32|u64  суффиксный массив: позиции в text, только начала слов
+    lcp.u8      LCP соседних суффиксов (lcp[i] = общий префикс sa[i-1], sa[i]),
+                обрезан сверху значением lcp_max
+    cumw.i64    накопленные веса (count строки хранилища) в порядке sa,
+                n + 1 значений: взвешенная частота диапазона = cumw[hi] - cumw[lo]
+    meta.json   n_suffixes, sa_dtype, depth, lcp_max, store
+
+depth > 0 — суффиксы упорядочены только по первым depth словам
+(быстрее строится); тогда запросы длиннее depth не поддерживаются.
+
+Подключение:
+
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "common"))
+    from suffix_index import SuffixIndex, build_suffix_index
+"""
+import json
+import os
+import sys
+import time
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from token_store import TokenStore
+
+SEP = np.uint32(0xFFFFFFFF)
+
+TEXT_FILE = "text.u32"
+LCP_FILE = "lcp.u8"
+CUMW_FILE = "cumw.i64"
+META_FILE = "meta.json"
+
+
+def _sa_file(dtype: str) -> str:
+    return "sa.u32" if dtype == "uint32" else "sa.u64"
+
+
+def build_text(store: TokenStore) -> np.ndarray:
+    """Токены хранилища с SEP после каждой строки."""
+    n_tok = len(store.tokens)
+    n_rows = store.n_rows
+    text = np.empty(n_tok + n_rows, dtype=np.uint32)
+    offsets = np.asarray(store.offsets, dtype=np.int64)
+    # позиция SEP строки r в text: offsets[r + 1] + r
+    sep_pos = offsets[1:] + np.arange(n_rows, dtype=np.int64)
+    is_tok = np.ones(len(text), dtype=bool)
+    is_tok[sep_pos] = False
+    text[is_tok] = store.tokens
+    text[sep_pos] = SEP
+    return text
+
+
+def suffix_array(text: np.ndarray, depth: int = 0, log=None) -> np.ndarray:
+    """
+    Суффиксный массив удвоением префиксов (Manber–Myers) на numpy.
+    depth > 0 — остановиться, когда суффиксы упорядочены по первым depth символам.
+    """
+    n = len(text)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    _, rank = np.unique(text, return_inverse=True)
+    rank = rank.astype(np.int64).reshape(-1)
+    sa = np.argsort(rank, kind="stable")
+    sorted_len = 1
+
+    def n_groups(sa_, rank_):
+        return int(rank_[sa_[-1]]) + 1
+
+    # пересчитать ранги по отсортированным ключам
+    def rerank(sa_, key):
+        ks = key[sa_]
+        new = np.empty(n, dtype=np.int64)
+        new[sa_] = np.concatenate(([0], np.cumsum(ks[1:] != ks[:-1])))
+        return new
+
+    rank = rerank(sa, rank)
+    while n_groups(sa, rank) < n and (depth <= 0 or sorted_len < depth):
+        k = sorted_len
+        second = np.zeros(n, dtype=np.int64)
+        second[:n - k] = rank[k:] + 1
+        key = rank * (n + 1) + second
+        del second
+        sa = np.argsort(key)
+        rank = rerank(sa, key)
+        del key
+        sorted_len *= 2
+        if log:
+            log(f"[sa] sorted by {sorted_len} tokens, {n_groups(sa, rank):,} distinct of {n:,}")
+
+    return sa
+
+
+def lcp_capped(text: np.ndarray, sa: np.ndarray, cap: int) -> np.ndarray:
+    """
+    LCP соседних суффиксов, не больше cap (SEP в общий префикс не входит).
+    O(n * cap), но векторно.
+    """
+    n = len(sa)
+    lcp = np.zeros(n, dtype=np.uint8)
+    if n < 2:
+        return lcp
+    padded = np.concatenate((text, np.full(cap, SEP, dtype=np.uint32)))
+    a = sa[:-1].astype(np.int64)
+    b = sa[1:].astype(np.int64)
+    active = np.ones(n - 1, dtype=bool)
+    acc = np.zeros(n - 1, dtype=np.uint8)
+    for j in range(cap):
+        idx = np.flatnonzero(active)
+        if len(idx) == 0:
+            break
+        ta = padded[a[idx] + j]
+        eq = (ta == padded[b[idx] + j]) & (ta != SEP)
+        acc[idx[eq]] += 1
+        active[idx[~eq]] = False
+    lcp[1:] = acc
+    return lcp
+
+
+def build_suffix_index(store_dir: str, out_dir: str, depth: int = 0,
+                       lcp_max: int = 32) -> dict:
+    t0 = time.time()
+    log = lambda msg: print(msg, file=sys.stderr)  # noqa: E731
+
+    lcp_max = max(1, min(255, lcp_max))
+    if depth > 0:
+        lcp_max = min(lcp_max, depth)
+
+    store = TokenStore(store_dir)
+    os.makedirs(out_dir, exist_ok=True)
+
+    text = build_text(store)
+    log(f"[info] text: {len(text):,} symbols ({store.n_rows:,} rows)")
+
+    sa = suffix_array(text, depth, log)
+    # суффиксы, начинающиеся с SEP, сортируются последними — отрезаем
+    n_suf = len(store.tokens)
+    sa = sa[:n_suf]
+    sa_dtype = "uint32" if len(text) < 2**32 else "uint64"
+    sa = sa.astype(sa_dtype)
+    log(f"[info] suffix array built in {time.time() - t0:.1f}s")
+
+    lcp = lcp_capped(text, sa, lcp_max)
+
+    # вес суффикса = count строки, в которой он начинается
+    row_of_pos = np.cumsum(text == SEP) - (text == SEP)
+    w = np.asarray(store.counts, dtype=np.int64)[row_of_pos[sa]]
+    del row_of_pos
+    cumw = np.zeros(n_suf + 1, dtype=np.int64)
+    np.cumsum(w, out=cumw[1:])
+
+    text.tofile(os.path.join(out_dir, TEXT_FILE))
+    sa.tofile(os.path.join(out_dir, _sa_file(sa_dtype)))
+    lcp.tofile(os.path.join(out_dir, LCP_FILE))
+    cumw.tofile(os.path.join(out_dir, CUMW_FILE))
+
+    meta = {
+        "n_suffixes": n_suf,
+        "n_text": len(text),
+        "sa_dtype": sa_dtype,
+        "depth": depth,
+        "lcp_max": lcp_max,
+        "store": os.path.abspath(store_dir),
+    }
+    with open(os.path.join(out_dir, META_FILE), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+
+    log(f"[done] index {out_dir}: {n_suf:,} suffixes in {time.time() - t0:.1f}s")
+    return meta
+
+
+class SuffixIndex:
+    """
+    Запросы к индексу: массивы открываются через memmap,
+    фразы переводятся в id через словарь хранилища.
+    """
+
+    def __init__(self, index_dir: str, store_dir: Optional[str] = None):
+        with open(os.path.join(index_dir, META_FILE), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.store = TokenStore(store_dir or self.meta["store"])
+        self.n = self.meta["n_suffixes"]
+        self.depth = self.meta["depth"]
+        self.lcp_max = self.meta["lcp_max"]
+        self.text = self._memmap(index_dir, TEXT_FILE, np.uint32)
+        self.sa = self._memmap(index_dir, _sa_file(self.meta["sa_dtype"]),
+                               np.dtype(self.meta["sa_dtype"]))
+        self.lcp = self._memmap(index_dir, LCP_FILE, np.uint8)
+        self.cumw = self._memmap(index_dir, CUMW_FILE, np.int64)
+
+    @staticmethod
+    def _memmap(index_dir: str, name: str, dtype) -> np.ndarray:
+        path = os.path.join(index_dir, name)
+        if os.path.getsize(path) == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode="r")
+
+    def encode(self, phrase: str) -> Optional[List[int]]:
+        """id слов фразы или None, если какого-то слова нет в словаре."""
+        word2id = self.store.word2id
+        ids = []
+        for w in phrase.split():
+            wid = word2id.get(w)
+            if wid is None:
+                return None
+            ids.append(wid)
+        return ids
+
+    def _prefix(self, i: int, m: int) -> List[int]:
+        p = int(self.sa[i])
+        return self.text[p:p + m].tolist()
+
+    def range(self, ids: Sequence[int]) -> Tuple[int, int]:
+        """[lo, hi) суффиксов, начинающихся с ids."""
+        m = len(ids)
+        if m == 0:
+            return 0, self.n
+        if self.depth > 0 and m > self.depth:
+            raise ValueError(f"query of {m} tokens is longer than index depth {self.depth}")
+        pattern = list(ids)
+
+        lo, hi = 0, self.n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._prefix(mid, m) < pattern:
+                lo = mid + 1
+            else:
+                hi = mid
+        start = lo
+
+        hi = self.n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._prefix(mid, m) <= pattern:
+                lo = mid + 1
+            else:
+                hi = mid
+        return start, lo
+
+    def count_ids(self, ids: Sequence[int]) -> Tuple[int, int]:
+        """(число вхождений, взвешенная частота по count строк)."""
+        lo, hi = self.range(ids)
+        return hi - lo, int(self.cumw[hi] - self.cumw[lo])
+
+    def count(self, phrase: str) -> Tuple[int, int]:
+        ids = self.encode(phrase)
+        if ids is None:
+            return 0, 0
+        return self.count_ids(ids)
+
+    def ngrams(self, n: int, min_count: int = 1, weighted: bool = True,
+               chunk: int = 10_000_000) -> Iterator[Tuple[List[int], int, int]]:
+        """
+        Все различные n-граммы (n <= lcp_max) с частотой >= min_count:
+        (id слов, вхождений, взвешенная частота), в порядке суффиксного массива.
+        Группы — отрезки, где lcp >= n; суффиксы короче n (упираются в SEP)
+        пропускаются.
+        """
+        if n > self.lcp_max:
+            raise ValueError(f"n={n} is larger than lcp_max={self.lcp_max}")
+
+        starts = np.flatnonzero(np.asarray(self.lcp) < n)
+        if len(starts) == 0 or starts[0] != 0:
+            starts = np.concatenate(([0], starts))
+        bounds = np.append(starts, self.n)
+
+        for c0 in range(0, len(starts), chunk):
+            lo = starts[c0:c0 + chunk]
+            hi = bounds[c0 + 1:c0 + 1 + len(lo)]
+            occ = hi - lo
+            wsum = np.asarray(self.cumw)[hi] - np.asarray(self.cumw)[lo]
+            value = wsum if weighted else occ
+            cand = np.flatnonzero(value >= min_count)
+            for g in cand.tolist():
+                ids = self._prefix(int(lo[g]), n)
+                if len(ids) < n or int(SEP) in ids:
+                    continue
+                yield ids, int(occ[g]), int(wsum[g])
+
+    def decode(self, ids: Sequence[int]) -> str:
+        vocab = self.store.vocab
+        return " ".join([vocab[t] for t in ids])
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""
+token_store.py
+
+Токенизированное хранилище файла фраз (phrase<TAB>count[<TAB>...]):
+фразы один раз режутся по пробелам, слова заменяются на uint32 id,
+дальше шаги пайплайна работают с массивами id через memmap,
+не разбивая и не хешируя строки заново.
+
+Каталог хранилища:
+
+    vocab.txt     слово на строку, id = номер строки (с 0);
+                  id выдаются в порядке первого появления слова в файле
+    tokens.u32    id слов всех фраз подряд (uint32)
+    offsets.u64   начало каждой фразы в tokens.u32, n_rows + 1 значений (uint64)
+    counts.i64    второй столбец строки (count/freq), int64
+    meta.json     n_rows, n_tokens, vocab_size, source
+
+Строка i — это i-я строка входа, у которой второй столбец — целое число
+(остальные пропускаются, как в step3/step4). Для корпуса без частот
+(одна фраза на строку, with_counts=False) строка — каждая непустая
+строка входа, count = 1. Фраза восстанавливается как
+" ".join(слова), т.е. с одиночными пробелами (в выходе clean_phrases_step1
+они и так одиночные).
+
+Подключение:
+
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "common"))
+    from token_store import TokenStore, build_token_store
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from parallel_lines import iter_range_lines, map_byte_ranges
+
+VOCAB_FILE = "vocab.txt"
+TOKENS_FILE = "tokens.u32"
+OFFSETS_FILE = "offsets.u64"
+COUNTS_FILE = "counts.i64"
+META_FILE = "meta.json"
+
+# строк на один векторный шаг при обходе хранилища
+ROWS_PER_CHUNK = 1_000_000
+
+# копирование частей в итоговые файлы — по столько токенов за раз
+COPY_TOKENS = 16 * 1024 * 1024
+
+
+def parse_phrase_line(line: str) -> Optional[Tuple[str, int]]:
+    """(phrase, count) из phrase<TAB>count[<TAB>...] или None."""
+    if not line:
+        return None
+    parts = line.split("\t")
+    if len(parts) < 2:
+        return None
+    try:
+        return parts[0], int(parts[1])
+    except ValueError:
+        return None
+
+
+def _tokenize_range(path: str, start: int, end: int, part_dir: str,
+                    with_counts: bool = True) -> Tuple[int, List[str], int]:
+    """
+    Токенизировать диапазон [start, end) с локальным словарём.
+    Пишет {start}.tok (uint32 локальные id), {start}.len (uint32 длины фраз),
+    {start}.cnt (int64). Возвращает (start, локальный словарь, строк).
+    """
+    vocab: Dict[str, int] = {}
+    words: List[str] = []
+    tokens: List[int] = []
+    lengths: List[int] = []
+    counts: List[int] = []
+
+    for line in iter_range_lines(path, start, end):
+        if with_counts:
+            parsed = parse_phrase_line(line)
+            if parsed is None:
+                continue
+            phrase, count = parsed
+        elif line:
+            phrase, count = line, 1
+        else:
+            continue
+        n = 0
+        for w in phrase.split():
+            tid = vocab.get(w)
+            if tid is None:
+                tid = len(words)
+                vocab[w] = tid
+                words.append(w)
+            tokens.append(tid)
+            n += 1
+        lengths.append(n)
+        counts.append(count)
+
+    base = os.path.join(part_dir, f"{start:016d}")
+    np.asarray(tokens, dtype=np.uint32).tofile(base + ".tok")
+    np.asarray(lengths, dtype=np.uint32).tofile(base + ".len")
+    np.asarray(counts, dtype=np.int64).tofile(base + ".cnt")
+    return start, words, len(lengths)
+
+
+def build_token_store(in_path: str, out_dir: str, workers: int,
+                      parts: Optional[int] = None, with_counts: bool = True) -> dict:
+    """
+    Токенизировать файл фраз в out_dir. Диапазоны файла токенизируются
+    параллельно с локальными словарями; глобальные id выдаются при склейке
+    в порядке диапазонов, поэтому совпадают с однопроходной нумерацией
+    по первому появлению. Возвращает meta.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    part_dir = tempfile.mkdtemp(prefix="tokstore_", dir=out_dir)
+    try:
+        results = map_byte_ranges(in_path, _tokenize_range, workers, part_dir,
+                                  with_counts, parts=parts or 4 * workers)
+
+        word2id: Dict[str, int] = {}
+        vocab: List[str] = []
+        n_rows = n_tokens = 0
+
+        with open(os.path.join(out_dir, TOKENS_FILE), "wb") as ftok, \
+             open(os.path.join(out_dir, OFFSETS_FILE), "wb") as foff, \
+             open(os.path.join(out_dir, COUNTS_FILE), "wb") as fcnt:
+
+            np.zeros(1, dtype=np.uint64).tofile(foff)
+
+            for start, local_words, rows in results:
+                remap = np.empty(len(local_words), dtype=np.uint32)
+                for i, w in enumerate(local_words):
+                    gid = word2id.get(w)
+                    if gid is None:
+                        gid = len(vocab)
+                        word2id[w] = gid
+                        vocab.append(w)
+                    remap[i] = gid
+
+                base = os.path.join(part_dir, f"{start:016d}")
+                local = np.fromfile(base + ".tok", dtype=np.uint32)
+                for s in range(0, len(local), COPY_TOKENS):
+                    remap[local[s:s + COPY_TOKENS]].tofile(ftok)
+
+                lengths = np.fromfile(base + ".len", dtype=np.uint32)
+                offsets = np.cumsum(lengths, dtype=np.uint64) + np.uint64(n_tokens)
+                offsets.tofile(foff)
+                with open(base + ".cnt", "rb") as fin:
+                    shutil.copyfileobj(fin, fcnt)
+
+                n_rows += rows
+                n_tokens += len(local)
+                for ext in (".tok", ".len", ".cnt"):
+                    os.remove(base + ext)
+    finally:
+        shutil.rmtree(part_dir, ignore_errors=True)
+
+    with open(os.path.join(out_dir, VOCAB_FILE), "w", encoding="utf-8") as f:
+        for w in vocab:
+            f.write(w + "\n")
+
+    meta = {
+        "n_rows": n_rows,
+        "n_tokens": n_tokens,
+        "vocab_size": len(vocab),
+        "source": os.path.abspath(in_path),
+    }
+    with open(os.path.join(out_dir, META_FILE), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    return meta
+
+
+class TokenStore:
+    """
+    Чтение хранилища: массивы открываются через memmap,
+    словарь (и обратный индекс слово -> id) загружается по требованию.
+    """
+
+    def __init__(self, store_dir: str):
+        self.dir = store_dir
+        with open(os.path.join(store_dir, META_FILE), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.n_rows = self.meta["n_rows"]
+        self.tokens = self._memmap(TOKENS_FILE, np.uint32)
+        self.offsets = self._memmap(OFFSETS_FILE, np.uint64)
+        self.counts = self._memmap(COUNTS_FILE, np.int64)
+        self._vocab: Optional[List[str]] = None
+        self._word2id: Optional[Dict[str, int]] = None
+
+    def _memmap(self, name: str, dtype) -> np.ndarray:
+        path = os.path.join(self.dir, name)
+        if os.path.getsize(path) == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode="r")
+
+    @property
+    def vocab(self) -> List[str]:
+        if self._vocab is None:
+            with open(os.path.join(self.dir, VOCAB_FILE), "r", encoding="utf-8", newline="\n") as f:
+                self._vocab = f.read().split("\n")[:-1]
+        return self._vocab
+
+    @property
+    def word2id(self) -> Dict[str, int]:
+        if self._word2id is None:
+            self._word2id = {w: i for i, w in enumerate(self.vocab)}
+        return self._word2id
+
+    @property
+    def vocab_size(self) -> int:
+        return self.meta["vocab_size"]
+
+    def row(self, i: int) -> np.ndarray:
+        return self.tokens[int(self.offsets[i]):int(self.offsets[i + 1])]
+
+    def phrase(self, i: int) -> str:
+        vocab = self.vocab
+        return " ".join([vocab[t] for t in self.row(i).tolist()])
+
+    def iter_chunks(self, rows_per_chunk: int = ROWS_PER_CHUNK) -> Iterator[
+            Tuple[int, np.ndarray, np.ndarray, np.ndarray]]:
+        """
+        (первая строка, длины фраз, токены, counts) кусками по rows_per_chunk строк.
+        """
+        for r0 in range(0, self.n_rows, rows_per_chunk):
+            r1 = min(r0 + rows_per_chunk, self.n_rows)
+            off = np.asarray(self.offsets[r0:r1 + 1], dtype=np.int64)
+            lengths = np.diff(off)
+            toks = np.asarray(self.tokens[off[0]:off[-1]])
+            yield r0, lengths, toks, np.asarray(self.counts[r0:r1])
+
+    def word_weights(self) -> np.ndarray:
+        """
+        Частоты слов, взвешенные count фразы (как step3_word_freq):
+        int64 по id словаря.
+        """
+        acc = np.zeros(self.vocab_size, dtype=np.int64)
+        for _r0, lengths, toks, counts in self.iter_chunks():
+            if len(toks) == 0:
+                continue
+            # веса в bincount — float64, точны до 2**53 на кусок
+            w = np.bincount(toks, weights=np.repeat(counts, lengths),
+                            minlength=self.vocab_size)
+            acc += np.rint(w).astype(np.int64)
+        return acc
+
+    def rows_within(self, allowed: np.ndarray, min_count: Optional[int] = None) -> Iterator[np.ndarray]:
+        """
+        Номера строк, все слова которых отмечены в allowed (bool по id словаря)
+        и count >= min_count; кусками, по возрастанию.
+        """
+        for r0, lengths, toks, counts in self.iter_chunks():
+            n = len(lengths)
+            row_of_tok = np.repeat(np.arange(n), lengths)
+            bad = np.bincount(row_of_tok[~allowed[toks]], minlength=n)
+            keep = bad == 0
+            if min_count is not None:
+                keep &= counts >= min_count
+            yield r0 + np.flatnonzero(keep)
+
+
+def log_meta(meta: dict, out_dir: str):
+    print(f"[done] token store {out_dir}: {meta['n_rows']:,} rows, "
+          f"{meta['n_tokens']:,} tokens, vocab {meta['vocab_size']:,}", file=sys.stderr)
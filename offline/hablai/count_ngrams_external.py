@@ -1,11 +1,25 @@
+import bisect
 import json
+import mmap
 import os
+import sys
 import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from collections import Counter
 from tqdm import tqdm
 import heapq
 
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "common"))
+from parallel_lines import map_byte_ranges, split_aligned_ranges
+from ngram_extract import (
+    count_ngram_ids, ids_to_text, intern_tokens, iter_corpus_range,
+    range_stats, report_workers,
+)
+
 # ==========================
 #   КОНФИГУРАЦИЯ
 # ==========================
@@ -17,6 +31,8 @@ INPUT_JSONL = Path("corpus/jsonl/mix_es_60os_40c4.jsonl")
 OUTPUT_UNI        = Path("corpus/jsonl/freq_unigrams.jsonl")
 OUTPUT_NGRAMS_2_4 = Path("corpus/jsonl/freq_ngrams_2_4.jsonl")
 OUTPUT_NGRAMS_5   = Path("corpus/jsonl/freq_ngrams_5.jsonl")
+# Только режим "sketch": top-K самых частых 2–5-грамм (Space-Saving) с точными частотами
+OUTPUT_TOP        = Path("corpus/jsonl/freq_ngrams_top.jsonl")
 
 # Размер батча (кол-во строк корпуса)
 BATCH_SIZE   = 300_000        # можно менять: 200k–500k
@@ -28,117 +44,295 @@ GLOBAL_MIN_5 = 30             # минимум повторов 5-граммы 
 MIN_CHARS = 5
 MAX_CHARS = 5000
 
+# Режим подсчёта n-грамм:
+#   "batch"  — все 2–4-граммы (без порога) через run-файлы; в каждом батче
+#              отбрасываем 5-граммы с частотой < BATCH_MIN_5 (теряются
+#              5-граммы, размазанные тонким слоем по многим батчам);
+#   "sketch" — два прохода. Первый: униграммы как в "batch", все 2–5-граммы
+#              корпуса — только в Count-Min Sketch и Space-Saving top-K
+#              (память фиксирована, run-файлов n-грамм нет). Второй: точный
+#              подсчёт только кандидатов — 2–4-грамм с оценкой CMS
+#              >= GLOBAL_MIN_2_4, 5-грамм с оценкой >= GLOBAL_MIN_5 и членов
+#              top-K. Оценка CMS никогда не занижена, поэтому ни одна
+#              n-грамма выше порога не теряется, а счётчики точные; 2–4-граммы
+#              ниже GLOBAL_MIN_2_4 в выход не попадают.
+NGRAM_MODE = "batch"
+
+# Только "sketch": порог для 2–4-грамм (build_phrase_index.py всё равно
+# отбрасывает фразы с частотой < F_MIN = 5)
+GLOBAL_MIN_2_4 = 5
+
+# Память под Count-Min Sketch (МБ) и число хеш-строк
+SKETCH_MEMORY_MB = 1024
+SKETCH_DEPTH     = 4
+# Сколько n-грамм хешировать/обновлять за один векторный шаг
+SKETCH_CHUNK     = 2_000_000
+# Размер Space-Saving top-K (хеш + счётчики + текст, ~150 байт на запись)
+TOPK_SIZE        = 200_000
+
+# Извлечение n-грамм: число процессов. Корпус режется на диапазоны только
+# по границам батчей (строки с номером, кратным BATCH_SIZE), так что батчи
+# и отсечение BATCH_MIN_5 те же, что при последовательном проходе, — выход
+# не зависит от числа процессов. 1 — последовательный проход; режим
+# "sketch" всегда последовательный.
+EXTRACT_WORKERS  = os.cpu_count() or 1
+
+# Слияние: число процессов и диапазонов ключей
+MERGE_WORKERS    = os.cpu_count() or 1
+MERGE_PARTITIONS = 4 * MERGE_WORKERS
+
+# Разреженный индекс run-файла: (ключ, смещение) каждые N записей
+RUN_INDEX_EVERY = 4096
+
+# Запись выходных файлов кусками такого размера
+WRITE_CHUNK_BYTES = 8 * 1024 * 1024
+
 # ==========================
-#   УТИЛИТЫ
+#   ФОРМАТ RUN-ФАЙЛОВ
 # ==========================
-
-def spill_counter(counter: Counter, tmp_list: list):
-    """Записать Counter -> временный .jsonl файл, сохранить путь в tmp_list."""
-    fd, fname = tempfile.mkstemp(prefix="ngr_", suffix=".jsonl")
-    with os.fdopen(fd, "w", encoding="utf-8") as out:
-        for key, val in counter.items():
-            out.write(json.dumps({"text": key, "count": val}, ensure_ascii=False) + "\n")
-    tmp_list.append(fname)
-
-
-def sort_jsonl(input_file: str) -> str:
+#
+# Запись: varint(len(key)) + key (UTF-8) + varint(count), записи отсортированы
+# по байтам ключа. Порядок байт UTF-8 совпадает с порядком кодовых точек,
+# т.е. с сортировкой str в Python — выход тот же, что при сортировке по "text".
+# surrogatepass — на случай одиночных суррогатов из JSON (порядок тоже сохраняется).
+
+def encode_varint(n: int, out: bytearray):
+    while n >= 0x80:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def decode_varint(buf, pos: int):
+    result = 0
+    shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7F) << shift
+        if b < 0x80:
+            return result, pos
+        shift += 7
+
+
+def spill_counter(counter: Counter, runs: list):
     """
-    Отсортировать JSONL-файл по полю 'text', вернуть путь к .sorted-файлу.
-    (Файл читается в память; делаем это на уровне уже агрегированных частот, а не сырого корпуса.)
+    Записать Counter -> временный отсортированный бинарный run-файл.
+    В runs добавляется (путь, разреженный индекс [(ключ, смещение), ...]).
     """
-    sorted_file = input_file + ".sorted"
-    items = []
-
-    with open(input_file, "r", encoding="utf-8") as inp:
-        for line in inp:
-            row = json.loads(line)
-            items.append(row)
-
-    items.sort(key=lambda x: x["text"])
+    items = sorted(
+        (key.encode("utf-8", "surrogatepass"), val) for key, val in counter.items()
+    )
+
+    fd, fname = tempfile.mkstemp(prefix="ngr_", suffix=".run")
+    index = []
+    buf = bytearray()
+    written = 0
+
+    with os.fdopen(fd, "wb") as out:
+        for i, (kb, val) in enumerate(items):
+            if i % RUN_INDEX_EVERY == 0:
+                index.append((kb, written + len(buf)))
+            encode_varint(len(kb), buf)
+            buf += kb
+            encode_varint(val, buf)
+            if len(buf) >= WRITE_CHUNK_BYTES:
+                out.write(buf)
+                written += len(buf)
+                buf.clear()
+        out.write(buf)
+
+    runs.append((fname, index))
+
+
+def read_run(path: str, offset: int, lo, hi):
+    """Записи run-файла с ключами в [lo, hi), начиная со смещения offset."""
+    if os.path.getsize(path) == 0:
+        return
+
+    with open(path, "rb") as f, \
+         mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        size = len(mm)
+        pos = offset
+        while pos < size:
+            klen, pos = decode_varint(mm, pos)
+            key = mm[pos:pos + klen]
+            pos += klen
+            val, pos = decode_varint(mm, pos)
+            if lo is not None and key < lo:
+                continue
+            if hi is not None and key >= hi:
+                return
+            yield key, val
 
-    with open(sorted_file, "w", encoding="utf-8") as out:
-        for obj in items:
-            out.write(json.dumps(obj, ensure_ascii=False) + "\n")
 
-    return sorted_file
+# ==========================
+#   СЛИЯНИЕ
+# ==========================
 
+def format_row(key: bytes, count: int) -> str:
+    # то же, что json.dumps({"text": ..., "count": ...}, ensure_ascii=False)
+    text = key.decode("utf-8", "surrogatepass")
+    return '{"text": ' + json.dumps(text, ensure_ascii=False) + ', "count": ' + str(count) + "}\n"
 
-def multiway_merge_sorted(files, output_path: Path):
-    """Слить много отсортированных JSONL-файлов в один, суммируя count (без порога)."""
-    streams = [open(f, "r", encoding="utf-8") for f in files]
 
-    def row_iter(stream):
-        for line in stream:
-            obj = json.loads(line)
-            yield obj["text"], obj["count"]
-
-    iterators = [row_iter(s) for s in streams]
-    merged = heapq.merge(*iterators, key=lambda x: x[0])
+def merge_partition(sources, lo, hi, part_path: str, min_count: int) -> int:
+    """
+    Слить диапазон ключей [lo, hi) из всех run-файлов в part_path (JSONL),
+    суммируя count и отбрасывая ключи с суммой < min_count.
+    sources: [(путь run-файла, смещение начала диапазона)].
+    """
+    merged = heapq.merge(*(read_run(path, off, lo, hi) for path, off in sources))
+    rows = 0
+    chunk = []
+    chunk_len = 0
 
-    with output_path.open("w", encoding="utf-8") as out:
+    with open(part_path, "w", encoding="utf-8") as out:
         last_key = None
         acc = 0
 
+        def emit(key, count):
+            nonlocal rows, chunk_len
+            if count >= min_count:
+                row = format_row(key, count)
+                chunk.append(row)
+                chunk_len += len(row)
+                rows += 1
+                if chunk_len >= WRITE_CHUNK_BYTES:
+                    out.write("".join(chunk))
+                    chunk.clear()
+                    chunk_len = 0
+
         for key, val in merged:
             if key != last_key and last_key is not None:
-                out.write(json.dumps({"text": last_key, "count": acc}, ensure_ascii=False) + "\n")
+                emit(last_key, acc)
                 acc = 0
             last_key = key
             acc += val
 
         if last_key is not None:
-            out.write(json.dumps({"text": last_key, "count": acc}, ensure_ascii=False) + "\n")
+            emit(last_key, acc)
 
-    for s in streams:
-        s.close()
+        out.write("".join(chunk))
 
+    return rows
 
-def multiway_merge_sorted_with_min(files, output_path: Path, min_count: int):
-    """Слить много отсортированных JSONL-файлов в один, суммируя count и применяя порог по частоте."""
-    streams = [open(f, "r", encoding="utf-8") for f in files]
 
-    def row_iter(stream):
-        for line in stream:
-            obj = json.loads(line)
-            yield obj["text"], obj["count"]
+def partition_bounds(runs: list, partitions: int) -> list:
+    """
+    Границы диапазонов ключей по выборке из индексов run-файлов:
+    [None, b1, ..., b_{P-1}, None]. Диапазоны идут по порядку ключей,
+    поэтому склейка частей даёт глобально отсортированный файл.
+    """
+    sample = sorted({kb for _path, index in runs for kb, _off in index})
+    bounds = [None]
+    if sample and partitions > 1:
+        step = len(sample) / partitions
+        for i in range(1, partitions):
+            b = sample[int(i * step)]
+            if len(bounds) == 1 or b > bounds[-1]:
+                bounds.append(b)
+    bounds.append(None)
+    return bounds
+
+
+def start_offset(index: list, lo) -> int:
+    """Смещение последней индексной записи с ключом <= lo (или 0)."""
+    if lo is None or not index:
+        return 0
+    keys = [kb for kb, _off in index]
+    i = bisect.bisect_right(keys, lo) - 1
+    return index[i][1] if i >= 0 else 0
+
+
+def merge_runs(runs: list, output_path: Path, min_count: int = 0):
+    """
+    Слить отсортированные run-файлы в один JSONL, суммируя count
+    (и применяя порог min_count). Диапазоны ключей сливаются параллельно,
+    части склеиваются по порядку.
+    """
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    bounds = partition_bounds(runs, MERGE_PARTITIONS)
+    part_dir = tempfile.mkdtemp(prefix="ngr_merge_")
+    part_paths = []
+
+    try:
+        with ProcessPoolExecutor(max_workers=MERGE_WORKERS) as ex:
+            futures = []
+            for p, (lo, hi) in enumerate(zip(bounds[:-1], bounds[1:])):
+                sources = [(path, start_offset(index, lo)) for path, index in runs]
+                part_path = os.path.join(part_dir, f"part_{p:05d}.jsonl")
+                part_paths.append(part_path)
+                futures.append(ex.submit(merge_partition, sources, lo, hi, part_path, min_count))
+            total = sum(f.result() for f in futures)
+
+        with output_path.open("wb") as out:
+            for part_path in part_paths:
+                with open(part_path, "rb") as inp:
+                    while True:
+                        block = inp.read(WRITE_CHUNK_BYTES)
+                        if not block:
+                            break
+                        out.write(block)
+                os.remove(part_path)
+    finally:
+        for part_path in part_paths:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+        os.rmdir(part_dir)
+
+    for path, _index in runs:
+        os.remove(path)
+
+    print(f"  {output_path.name}: {total:,} rows from {len(runs)} runs, "
+          f"{len(bounds) - 1} key ranges")
 
-    iterators = [row_iter(s) for s in streams]
-    merged = heapq.merge(*iterators, key=lambda x: x[0])
+# ==========================
+#   COUNT-MIN SKETCH И SPACE-SAVING (РЕЖИМ "sketch")
+# ==========================
 
-    with output_path.open("w", encoding="utf-8") as out:
-        last_key = None
-        acc = 0
+class CountMinSketch:
+    """
+    Count-Min Sketch фиксированного размера (depth x width, uint32).
+    Ключи подаются как 64-битные хеши; строки таблицы получают
+    независимые multiply-shift хеши от них. Обновление и оценка — пачками.
+    """
 
-        for key, val in merged:
-            if key != last_key and last_key is not None:
-                if acc >= min_count:
-                    out.write(json.dumps({"text": last_key, "count": acc}, ensure_ascii=False) + "\n")
-                acc = 0
-            last_key = key
-            acc += val
+    def __init__(self, memory_mb: int, depth: int, seed: int = 0x5EED):
+        self.depth = depth
+        self.width = max(1, memory_mb * 1024 * 1024 // (4 * depth))
+        self.table = np.zeros((depth, self.width), dtype=np.uint32)
+        rng = np.random.default_rng(seed)
+        self.mul = rng.integers(1, 2**63, size=depth, dtype=np.uint64) | np.uint64(1)
+        self.add = rng.integers(0, 2**63, size=depth, dtype=np.uint64)
+        self.total = 0
 
-        if last_key is not None and acc >= min_count:
-            out.write(json.dumps({"text": last_key, "count": acc}, ensure_ascii=False) + "\n")
+    def _row_index(self, row: int, hashes: np.ndarray) -> np.ndarray:
+        return ((hashes * self.mul[row] + self.add[row]) >> np.uint64(32)) % np.uint64(self.width)
 
-    for s in streams:
-        s.close()
+    def update(self, hashes: np.ndarray):
+        for r in range(self.depth):
+            np.add.at(self.table[r], self._row_index(r, hashes), 1)
+        self.total += len(hashes)
 
-# ==========================
-#   ОСНОВНОЙ ПРОЦЕСС
-# ==========================
+    def estimate(self, hashes: np.ndarray) -> np.ndarray:
+        est = np.full(len(hashes), np.iinfo(np.uint32).max, dtype=np.uint32)
+        for r in range(self.depth):
+            np.minimum(est, self.table[r][self._row_index(r, hashes)], out=est)
+        return est
 
-def process():
-    # списки временных файлов
-    tmp_uni = []
-    tmp_2_4 = []
-    tmp_5 = []
 
-    counter_uni = Counter()
-    counter_2_4 = Counter()
-    counter_5 = Counter()
+def hash_ngrams(ngrams: list) -> np.ndarray:
+    # hash() str стабилен внутри одного процесса — оба прохода идут в нём
+    return np.fromiter(
+        (hash(ng) for ng in ngrams), dtype=np.int64, count=len(ngrams)
+    ).view(np.uint64)
+
 
+def iter_corpus_tokens(desc: str):
+    """(номер строки, токены) для строк корпуса, прошедших фильтры."""
     with INPUT_JSONL.open("r", encoding="utf-8") as f:
-        for i, line in enumerate(tqdm(f, desc="Reading corpus")):
+        for i, line in enumerate(tqdm(f, desc=desc)):
             line = line.strip()
             if not line:
                 continue
@@ -152,41 +346,218 @@ def process():
                 continue
 
             tokens = text.split()
-            L = len(tokens)
-            if not L:
+            if not tokens:
                 continue
 
-            # униграммы
-            counter_uni.update(tokens)
-
-            # 2–5-граммы
-            for n in range(2, 6):
-                if L < n:
-                    break
-                for j in range(L - n + 1):
-                    ngram = " ".join(tokens[j:j+n])
-                    if n < 5:
-                        counter_2_4[ngram] += 1
-                    else:
-                        counter_5[ngram] += 1
-
-            # сброс батча
-            if (i + 1) % BATCH_SIZE == 0:
-                print(f"--- Flushing batch at {i+1} lines")
-
-                spill_counter(counter_uni, tmp_uni)
-                spill_counter(counter_2_4, tmp_2_4)
-
-                # 5-граммы: оставляем только те, что достаточно частые в батче
-                if counter_5:
-                    filtered_5 = Counter({ng: c for ng, c in counter_5.items()
-                                          if c >= BATCH_MIN_5})
-                    if filtered_5:
-                        spill_counter(filtered_5, tmp_5)
-
-                counter_uni.clear()
-                counter_2_4.clear()
-                counter_5.clear()
+            yield i, tokens
+
+
+class SpaceSaving:
+    """
+    Space-Saving top-K (Metwally et al.) по 64-битным хешам, пачками.
+    Не более capacity ключей; count — оценка сверху (err — насколько она
+    может быть завышена). Любая n-грамма с частотой > total / capacity
+    гарантированно в наборе. Тексты хранятся только для ключей набора.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.keys = np.empty(0, dtype=np.uint64)      # по возрастанию
+        self.counts = np.empty(0, dtype=np.int64)
+        self.errors = np.empty(0, dtype=np.int64)
+        self.texts = {}
+        self.total = 0
+
+    def update(self, hashes: np.ndarray, ngrams: list):
+        uniq, first, cnt = np.unique(hashes, return_index=True, return_counts=True)
+        pos = np.searchsorted(self.keys, uniq)
+        hit = pos < len(self.keys)
+        hit[hit] = self.keys[pos[hit]] == uniq[hit]
+        self.counts[pos[hit]] += cnt[hit]
+
+        # новые ключи вытесняют минимальные: их счёт начинается с текущего
+        # минимума (верхняя граница частоты невидимых в наборе n-грамм)
+        floor = int(self.counts.min()) if len(self.keys) >= self.capacity else 0
+        new = ~hit
+        keys = np.concatenate([self.keys, uniq[new]])
+        counts = np.concatenate([self.counts, cnt[new] + floor])
+        errors = np.concatenate([self.errors, np.full(int(new.sum()), floor, dtype=np.int64)])
+        for h, f in zip(uniq[new].tolist(), first[new].tolist()):
+            self.texts[h] = ngrams[f]
+
+        if len(keys) > self.capacity:
+            keep = np.argpartition(-counts, self.capacity - 1)[:self.capacity]
+            dropped = np.ones(len(keys), dtype=bool)
+            dropped[keep] = False
+            for h in keys[dropped].tolist():
+                del self.texts[h]
+            keys, counts, errors = keys[keep], counts[keep], errors[keep]
+
+        order = np.argsort(keys)
+        self.keys, self.counts, self.errors = keys[order], counts[order], errors[order]
+        self.total += len(hashes)
+
+    def contains(self, hashes: np.ndarray) -> np.ndarray:
+        if not len(self.keys):
+            return np.zeros(len(hashes), dtype=bool)
+        pos = np.minimum(np.searchsorted(self.keys, hashes), len(self.keys) - 1)
+        return self.keys[pos] == hashes
+
+
+def iter_ngram_chunks(desc: str, on_batch=None, on_tokens=None):
+    """
+    Проход режима "sketch": {n: [n-граммы]} для n = 2..5 кусками примерно
+    по SKETCH_CHUNK. on_tokens(tokens) — на каждую строку, on_batch() —
+    на границе батча (строки [b * BATCH_SIZE, (b + 1) * BATCH_SIZE), как
+    в extract_sequential), после отдачи накопленного куска.
+    """
+    pending = {n: [] for n in range(2, 6)}
+    size = 0
+    batch = 0
+
+    for i, tokens in iter_corpus_tokens(desc):
+        if i // BATCH_SIZE != batch:
+            batch = i // BATCH_SIZE
+            if size:
+                yield pending
+                pending = {n: [] for n in range(2, 6)}
+                size = 0
+            if on_batch:
+                on_batch()
+        if on_tokens:
+            on_tokens(tokens)
+        L = len(tokens)
+        for n in range(2, min(L, 5) + 1):
+            pending[n].extend(" ".join(tokens[j:j+n]) for j in range(L - n + 1))
+            size += L - n + 1
+        if size >= SKETCH_CHUNK:
+            yield pending
+            pending = {n: [] for n in range(2, 6)}
+            size = 0
+
+    if size:
+        yield pending
+
+
+def sketch_pass(tmp_uni: list, sketch: CountMinSketch, topk: SpaceSaving):
+    """Первый проход "sketch": униграммы в run-файлы, 2–5-граммы в CMS и top-K."""
+    counter_uni = Counter()
+
+    def flush_uni():
+        if counter_uni:
+            spill_counter(counter_uni, tmp_uni)
+            counter_uni.clear()
+
+    for pending in iter_ngram_chunks("Sketching n-grams", flush_uni, counter_uni.update):
+        for ngrams in pending.values():
+            if ngrams:
+                hashes = hash_ngrams(ngrams)
+                sketch.update(hashes)
+                topk.update(hashes, ngrams)
+    flush_uni()
+
+
+def count_candidates(sketch: CountMinSketch, topk: SpaceSaving,
+                     tmp_2_4: list, tmp_5: list) -> Counter:
+    """
+    Второй проход "sketch": точно считаем только кандидатов (оценка CMS
+    не ниже порога своей длины или член top-K); счётчики сбрасываются
+    в run-файлы по батчам, как в extract_sequential. Возвращает точные
+    частоты членов top-K.
+    """
+    c_2_4 = Counter()
+    c_5 = Counter()
+    top_exact = Counter()
+    candidates = 0
+
+    def flush_batch():
+        if c_2_4:
+            spill_counter(c_2_4, tmp_2_4)
+        if c_5:
+            spill_counter(c_5, tmp_5)
+        c_2_4.clear()
+        c_5.clear()
+
+    for pending in iter_ngram_chunks("Counting n-gram candidates", flush_batch):
+        for n, ngrams in pending.items():
+            if not ngrams:
+                continue
+            hashes = hash_ngrams(ngrams)
+            in_top = topk.contains(hashes)
+            keep = (sketch.estimate(hashes) >= (GLOBAL_MIN_5 if n == 5 else GLOBAL_MIN_2_4)) | in_top
+            counter = c_5 if n == 5 else c_2_4
+            for ng, k, t in zip(ngrams, keep.tolist(), in_top.tolist()):
+                if k:
+                    counter[ng] += 1
+                    candidates += 1
+                if t:
+                    top_exact[ng] += 1
+    flush_batch()
+
+    print(f"  {sketch.total:,} n-grams seen, {candidates:,} candidate occurrences counted "
+          f"({candidates / max(sketch.total, 1):.1%})")
+    return top_exact
+
+
+def write_top(topk: SpaceSaving, top_exact: Counter, output_path: Path):
+    """Top-K по убыванию точной частоты (при равенстве — по тексту)."""
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    rows = sorted(top_exact.items(), key=lambda kv: (-kv[1], kv[0]))
+    with output_path.open("w", encoding="utf-8") as out:
+        out.write("".join(format_row(ng.encode("utf-8", "surrogatepass"), c) for ng, c in rows))
+    print(f"  {output_path.name}: {len(rows):,} rows, Space-Saving K = {topk.capacity:,}, "
+          f"max overestimate {int(topk.errors.max()) if len(topk.errors) else 0:,}")
+
+# ==========================
+#   ОСНОВНОЙ ПРОЦЕСС
+# ==========================
+
+def extract_sequential(tmp_uni: list, tmp_2_4: list, tmp_5: list):
+    """Один проход по корпусу в текущем процессе (режим "batch")."""
+    counter_uni = Counter()
+    counter_2_4 = Counter()
+    counter_5 = Counter()
+
+    batch = 0
+
+    def flush_batch():
+        spill_counter(counter_uni, tmp_uni)
+        spill_counter(counter_2_4, tmp_2_4)
+
+        # 5-граммы: оставляем только те, что достаточно частые в батче
+        if counter_5:
+            filtered_5 = Counter({ng: c for ng, c in counter_5.items()
+                                  if c >= BATCH_MIN_5})
+            if filtered_5:
+                spill_counter(filtered_5, tmp_5)
+
+        counter_uni.clear()
+        counter_2_4.clear()
+        counter_5.clear()
+
+    for i, tokens in iter_corpus_tokens("Reading corpus"):
+        # батч — строки [b * BATCH_SIZE, (b + 1) * BATCH_SIZE) по номеру в файле,
+        # даже если строка на границе пропущена фильтрами (так же режет extract_range)
+        if i // BATCH_SIZE != batch:
+            batch = i // BATCH_SIZE
+            print(f"--- Flushing batch at {batch * BATCH_SIZE} lines")
+            flush_batch()
+
+        L = len(tokens)
+
+        # униграммы
+        counter_uni.update(tokens)
+
+        # 2–5-граммы
+        for n in range(2, 6):
+            if L < n:
+                break
+            for j in range(L - n + 1):
+                ngram = " ".join(tokens[j:j+n])
+                if n < 5:
+                    counter_2_4[ngram] += 1
+                else:
+                    counter_5[ngram] += 1
 
     # хвостовой батч
     if counter_uni:
@@ -199,25 +570,121 @@ def process():
         if filtered_5:
             spill_counter(filtered_5, tmp_5)
 
-    print("Sorting temporary files...")
 
-    sorted_uni  = [sort_jsonl(f) for f in tmp_uni]
-    sorted_2_4  = [sort_jsonl(f) for f in tmp_2_4]
-    sorted_5    = [sort_jsonl(f) for f in tmp_5]
+def extract_range(path: str, start: int, end: int, batch_size: int,
+                  batch_min_5: int, min_chars: int, max_chars: int):
+    """
+    Воркер параллельного режима: диапазон корпуса [start, end) (начинается
+    на границе батча) с токенами, интернированными в id. Каждые batch_size
+    строк счётчики сбрасываются в run-файлы (5-граммы — с порогом
+    batch_min_5, как в батчевом режиме).
+    Возвращает (runs_uni, runs_2_4, runs_5, статистика воркера).
+    """
+    t0 = time.time()
+    runs_uni, runs_2_4, runs_5 = [], [], []
+    vocab, words = {}, []
+
+    uni = Counter()
+    c_2_4 = Counter()
+    c_5 = Counter()
+    counters = {2: c_2_4, 3: c_2_4, 4: c_2_4, 5: c_5}
+    lines = ngrams = 0
+    batch = 0
+
+    def flush():
+        if uni:
+            spill_counter(Counter({words[t]: c for t, c in uni.items()}), runs_uni)
+        if c_2_4:
+            spill_counter(ids_to_text(c_2_4, words), runs_2_4)
+        filtered_5 = Counter({k: c for k, c in c_5.items() if c >= batch_min_5})
+        if filtered_5:
+            spill_counter(ids_to_text(filtered_5, words), runs_5)
+        uni.clear()
+        c_2_4.clear()
+        c_5.clear()
+
+    for i, tokens in iter_corpus_range(path, start, end, min_chars, max_chars):
+        if i // batch_size != batch:
+            batch = i // batch_size
+            flush()
+        lines = i + 1
+        ids = intern_tokens(tokens, vocab, words)
+        uni.update(ids)
+        ngrams += count_ngram_ids(ids, counters)
+
+    flush()
+    return runs_uni, runs_2_4, runs_5, range_stats(lines, ngrams, t0)
 
+
+def extract_parallel(tmp_uni: list, tmp_2_4: list, tmp_5: list):
+    """
+    Диапазоны корпуса обрабатываются в EXTRACT_WORKERS процессах. Диапазоны
+    выровнены по батчам: номер строки внутри диапазона совпадает с глобальным
+    по модулю BATCH_SIZE, поэтому extract_range сбрасывает те же батчи.
+    """
+    t0 = time.time()
+    print(f"Reading corpus: {EXTRACT_WORKERS} workers")
+    ranges = split_aligned_ranges(str(INPUT_JSONL), EXTRACT_WORKERS, BATCH_SIZE)
+    results = map_byte_ranges(
+        str(INPUT_JSONL), extract_range, EXTRACT_WORKERS,
+        BATCH_SIZE, BATCH_MIN_5, MIN_CHARS, MAX_CHARS,
+        ranges=ranges,
+    )
+
+    stats = []
+    for runs_uni, runs_2_4, runs_5, st in results:
+        tmp_uni.extend(runs_uni)
+        tmp_2_4.extend(runs_2_4)
+        tmp_5.extend(runs_5)
+        stats.append(st)
+    report_workers(stats)
+
+    lines = sum(st[1] for st in stats)
+    ngrams = sum(st[2] for st in stats)
+    elapsed = max(time.time() - t0, 1e-9)
+    print(f"  {lines:,} lines, {ngrams:,} ngrams in {elapsed:.1f}s "
+          f"({lines / elapsed:,.0f} lines/s, {ngrams / elapsed:,.0f} ngrams/s)")
+
+
+def process():
+    # списки временных run-файлов: [(путь, индекс)]
+    tmp_uni = []
+    tmp_2_4 = []
+    tmp_5 = []
+
+    use_sketch = NGRAM_MODE == "sketch"
+    if use_sketch:
+        sketch = CountMinSketch(SKETCH_MEMORY_MB, SKETCH_DEPTH)
+        topk = SpaceSaving(TOPK_SIZE)
+        sketch_pass(tmp_uni, sketch, topk)
+        print(f"Counting n-grams exactly for sketch candidates, GLOBAL_MIN_2_4 = {GLOBAL_MIN_2_4}, "
+              f"GLOBAL_MIN_5 = {GLOBAL_MIN_5} ...")
+        top_exact = count_candidates(sketch, topk, tmp_2_4, tmp_5)
+    elif EXTRACT_WORKERS <= 1:
+        extract_sequential(tmp_uni, tmp_2_4, tmp_5)
+    else:
+        extract_parallel(tmp_uni, tmp_2_4, tmp_5)
+
+    # run-файлы уже отсортированы при записи
     print("Merging unigrams...")
-    multiway_merge_sorted(sorted_uni, OUTPUT_UNI)
+    merge_runs(tmp_uni, OUTPUT_UNI)
 
     print("Merging 2–4-grams...")
-    multiway_merge_sorted(sorted_2_4, OUTPUT_NGRAMS_2_4)
+    merge_runs(tmp_2_4, OUTPUT_NGRAMS_2_4, GLOBAL_MIN_2_4 if use_sketch else 0)
 
     print(f"Merging 5-grams with GLOBAL_MIN_5 = {GLOBAL_MIN_5} ...")
-    multiway_merge_sorted_with_min(sorted_5, OUTPUT_NGRAMS_5, GLOBAL_MIN_5)
+    merge_runs(tmp_5, OUTPUT_NGRAMS_5, GLOBAL_MIN_5)
+
+    if use_sketch:
+        print("Writing top-K n-grams...")
+        write_top(topk, top_exact, OUTPUT_TOP)
 
     print("Done.")
     print("Unigrams:", OUTPUT_UNI.resolve())
     print("Ngrams 2–4:", OUTPUT_NGRAMS_2_4.resolve())
     print("Ngrams 5:", OUTPUT_NGRAMS_5.resolve())
+    if use_sketch:
+        print("Top-K:", OUTPUT_TOP.resolve())
 
 
 if __name__ == "__main__":
@@ -1,7 +1,20 @@
 import json
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import time
 from pathlib import Path
 from collections import Counter
-from tqdm import tqdm
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "common"))
+from parallel_lines import map_byte_ranges
+from ngram_extract import (
+    count_ngram_ids, ids_to_text, intern_tokens, iter_corpus_range,
+    partition_of, range_stats, report_workers,
+)
 
 # Входной объединённый корпус
 INPUT_JSONL = Path("corpus/jsonl/mix_es_60os_40c4.jsonl")
@@ -14,58 +27,134 @@ NGRAMS_OUT   = Path("corpus/jsonl/freq_ngrams_2_5.json")
 MIN_CHARS = 5
 MAX_CHARS = 5000
 
-
-def main():
-    unigram_counter = Counter()
-    ngram_counter = Counter()
-
-    with INPUT_JSONL.open("r", encoding="utf-8") as f:
-        for line in tqdm(f, desc=f"reading {INPUT_JSONL.name}"):
-            line = line.strip()
-            if not line:
+# Число процессов; корпус режется на RANGES диапазонов байт,
+# частичные счётчики раскладываются по PARTITIONS хеш-партициям (crc32)
+WORKERS    = os.cpu_count() or 1
+RANGES     = 4 * WORKERS
+PARTITIONS = 4 * WORKERS
+
+
+def count_range(path: str, start: int, end: int, part_dir: str):
+    """
+    Униграммы и n-граммы 2–5 слов диапазона [start, end).
+    Счётчики раскладываются по хеш-партициям в part_dir:
+    {uni|ngr}.{партиция}.{начало диапазона}.pkl
+    """
+    t0 = time.time()
+    vocab, words = {}, []
+    uni = Counter()
+    ngr = Counter()
+    counters = {2: ngr, 3: ngr, 4: ngr, 5: ngr}
+    lines = ngrams = 0
+
+    for i, tokens in iter_corpus_range(path, start, end, MIN_CHARS, MAX_CHARS, strip_text=True):
+        lines = i + 1
+        ids = intern_tokens(tokens, vocab, words)
+        uni.update(ids)
+        ngrams += count_ngram_ids(ids, counters)
+
+    for kind, counter in (("uni", Counter({words[t]: c for t, c in uni.items()})),
+                          ("ngr", ids_to_text(ngr, words))):
+        parts = [{} for _ in range(PARTITIONS)]
+        for key, c in counter.items():
+            parts[partition_of(key, PARTITIONS)][key] = c
+        for p, part in enumerate(parts):
+            if part:
+                with open(os.path.join(part_dir, f"{kind}.{p:05d}.{start:016d}.pkl"), "wb") as f:
+                    pickle.dump(part, f, pickle.HIGHEST_PROTOCOL)
+
+    return range_stats(lines, ngrams, t0)
+
+
+def reduce_partition(paths, out_path: str) -> int:
+    """
+    Слить частичные счётчики одной партиции и записать фрагмент
+    JSON-объекта ("ключ": count, ...) без фигурных скобок.
+    """
+    merged = Counter()
+    for path in paths:
+        with open(path, "rb") as f:
+            merged.update(pickle.load(f))
+        os.remove(path)
+
+    with open(out_path, "w", encoding="utf-8") as out:
+        out.write(", ".join(
+            f"{json.dumps(key, ensure_ascii=False)}: {c}" for key, c in merged.items()
+        ))
+    return len(merged)
+
+
+def merge_kind(part_dir: str, kind: str, output_path: Path) -> int:
+    """
+    Слить партиции одного вида параллельно и склеить их в один JSON-объект
+    (тот же формат, что json.dump(Counter)).
+    """
+    by_part = {}
+    for name in sorted(os.listdir(part_dir)):
+        if name.startswith(kind + "."):
+            by_part.setdefault(int(name.split(".")[1]), []).append(os.path.join(part_dir, name))
+
+    frag_paths = []
+    with ProcessPoolExecutor(max_workers=WORKERS) as ex:
+        futures = []
+        for p, paths in sorted(by_part.items()):
+            frag = os.path.join(part_dir, f"{kind}.{p:05d}.json")
+            frag_paths.append(frag)
+            futures.append(ex.submit(reduce_partition, paths, frag))
+        total = sum(f.result() for f in futures)
+
+    with output_path.open("w", encoding="utf-8") as out:
+        out.write("{")
+        first = True
+        for frag in frag_paths:
+            with open(frag, "r", encoding="utf-8") as inp:
+                body = inp.read()
+            os.remove(frag)
+            if not body:
                 continue
+            if not first:
+                out.write(", ")
+            out.write(body)
+            first = False
+        out.write("}")
 
-            obj = json.loads(line)
-            text = obj.get("text", "").strip()
-            if not text:
-                continue
-            if len(text) < MIN_CHARS or len(text) > MAX_CHARS:
-                continue
+    return total
 
-            # очень простая токенизация по пробелам
-            tokens = text.split()
-            if not tokens:
-                continue
 
-            # униграммы
-            unigram_counter.update(tokens)
-
-            # n-граммы 2–5 слов
-            L = len(tokens)
-            for n in range(2, 6):
-                if L < n:
-                    break
-                for i in range(L - n + 1):
-                    ngram = " ".join(tokens[i:i+n])
-                    ngram_counter[ngram] += 1
-
-    # Сохраняем результаты
-    print("Сохранение частот...")
-
-    UNIGRAMS_OUT.parent.mkdir(parents=True, exist_ok=True)
-
-    # Преобразуем Counter в обычный словарь для json
-    with UNIGRAMS_OUT.open("w", encoding="utf-8") as f_out:
-        json.dump(unigram_counter, f_out, ensure_ascii=False)
-
-    with NGRAMS_OUT.open("w", encoding="utf-8") as f_out:
-        json.dump(ngram_counter, f_out, ensure_ascii=False)
+def main():
+    t0 = time.time()
+    part_dir = tempfile.mkdtemp(prefix="ngr_parts_")
+
+    try:
+        print(f"reading {INPUT_JSONL.name}: {WORKERS} workers, {RANGES} ranges, "
+              f"{PARTITIONS} partitions")
+        stats = map_byte_ranges(
+            str(INPUT_JSONL), count_range, WORKERS, part_dir, parts=RANGES,
+        )
+        report_workers(stats)
+
+        lines = sum(s[1] for s in stats)
+        ngrams = sum(s[2] for s in stats)
+        elapsed = max(time.time() - t0, 1e-9)
+        print(f"extract: {lines:,} lines, {ngrams:,} ngrams in {elapsed:.1f}s "
+              f"({lines / elapsed:,.0f} lines/s, {ngrams / elapsed:,.0f} ngrams/s)")
+
+        # Сохраняем результаты
+        print("Сохранение частот...")
+
+        UNIGRAMS_OUT.parent.mkdir(parents=True, exist_ok=True)
+        NGRAMS_OUT.parent.mkdir(parents=True, exist_ok=True)
+
+        n_uni = merge_kind(part_dir, "uni", UNIGRAMS_OUT)
+        n_ngr = merge_kind(part_dir, "ngr", NGRAMS_OUT)
+    finally:
+        shutil.rmtree(part_dir, ignore_errors=True)
 
     print("Готово.")
     print("Unigrams:", UNIGRAMS_OUT.resolve())
     print("N-grams 2–5:", NGRAMS_OUT.resolve())
-    print("Всего уникальных слов:", len(unigram_counter))
-    print("Всего уникальных n-грамм 2–5:", len(ngram_counter))
+    print("Всего уникальных слов:", n_uni)
+    print("Всего уникальных n-грамм 2–5:", n_ngr)
 
 
 if __name__ == "__main__":
@@ -1,12 +1,120 @@
 #!/usr/bin/env python3
 import argparse
+import mmap
 import sys
 from pathlib import Path
-from collections import defaultdict
 
 import numpy as np
 from tqdm import tqdm
 
+# байты на один кусок чтения (режется по концу строки)
+CHUNK_BYTES = 16 << 20
+
+
+def read_cluster_ids(path: Path) -> np.ndarray:
+    """cluster_id на строку -> int32, кусками (быстрее np.loadtxt в разы)."""
+    parts = []
+    tail = b""
+    with path.open("rb") as f:
+        while True:
+            block = f.read(CHUNK_BYTES)
+            if not block:
+                break
+            block = tail + block
+            cut = block.rfind(b"\n") + 1
+            tail = block[cut:]
+            if cut:
+                parts.append(np.fromstring(block[:cut], dtype=np.int64, sep=" "))
+    if tail.strip():
+        parts.append(np.fromstring(tail, dtype=np.int64, sep=" "))
+    if not parts:
+        return np.zeros(0, dtype=np.int32)
+    return np.concatenate(parts).astype(np.int32)
+
+
+def parse_uint(buf: np.ndarray, start: np.ndarray, end: np.ndarray) -> np.ndarray:
+    """Целые без знака из полей buf[start:end] (векторно, по разряду за шаг)."""
+    width = end - start
+    if len(width) and width.min() <= 0:
+        raise ValueError("empty integer field in meta")
+    val = np.zeros(len(start), dtype=np.int64)
+    for j in range(int(width.max()) if len(width) else 0):
+        m = width > j
+        digit = buf[start[m] + j].astype(np.int64) - 48
+        if digit.min() < 0 or digit.max() > 9:
+            raise ValueError("non-numeric field in meta")
+        val[m] = val[m] * 10 + digit
+    return val
+
+
+def scan_meta(buf: np.ndarray, base: int):
+    """
+    Строки row<TAB>phrase<TAB>freq<TAB>length одного куска (buf кончается '\\n').
+    Строки не из 4 полей пропускаются, как раньше. Возвращает row, freq,
+    length, смещение фразы в файле и её длину в байтах.
+    """
+    nl = np.flatnonzero(buf == 10)
+    starts = np.concatenate(([0], nl[:-1] + 1))
+    ends = nl
+    tabs = np.flatnonzero(buf == 9)
+    t0 = np.searchsorted(tabs, starts)
+    n_tabs = np.searchsorted(tabs, ends) - t0
+    ok = n_tabs == 3
+    starts, ends, t0 = starts[ok], ends[ok], t0[ok]
+    tab1, tab2, tab3 = tabs[t0], tabs[t0 + 1], tabs[t0 + 2]
+
+    row = parse_uint(buf, starts, tab1).astype(np.int32)
+    freq = parse_uint(buf, tab2 + 1, tab3)
+    length = parse_uint(buf, tab3 + 1, ends).astype(np.int32)
+    return row, freq, length, base + tab1 + 1, (tab2 - tab1 - 1).astype(np.int32)
+
+
+def read_meta(path: Path):
+    """Весь meta в массивы; сами фразы не читаются — только смещение и длина в байтах."""
+    rows, freqs, lengths, p_starts, p_lens = [], [], [], [], []
+    size = path.stat().st_size
+    if size == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty, empty, empty
+    with path.open("rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            pos = 0
+            with tqdm(total=size, desc="meta", unit="B", unit_scale=True) as pbar:
+                while pos < size:
+                    end = min(pos + CHUNK_BYTES, size)
+                    if end < size:
+                        end = mm.rfind(b"\n", pos, end) + 1 or size
+                    block = mm[pos:end]
+                    if not block.endswith(b"\n"):
+                        block += b"\n"
+                    r, fr, ln, ps, pl = scan_meta(np.frombuffer(block, dtype=np.uint8), pos)
+                    rows.append(r)
+                    freqs.append(fr)
+                    lengths.append(ln)
+                    p_starts.append(ps)
+                    p_lens.append(pl)
+                    pbar.update(end - pos)
+                    pos = end
+        finally:
+            mm.close()
+    return (np.concatenate(rows), np.concatenate(freqs), np.concatenate(lengths),
+            np.concatenate(p_starts), np.concatenate(p_lens))
+
+
+def read_previous(path: Path):
+    """Предыдущий clusters_aggregated.tsv: cluster_id по порядку строк и их представители."""
+    cids, reps = [], []
+    with path.open("r", encoding="utf-8") as f:
+        next(f, None)
+        for line in f:
+            parts = line.rstrip("\n").split("\t")
+            if len(parts) != 4:
+                continue
+            cids.append(int(parts[0]))
+            reps.append(parts[3])
+    return np.array(cids, dtype=np.int64), reps
+
 
 def main():
     parser = argparse.ArgumentParser(
@@ -15,54 +123,70 @@ def main():
     parser.add_argument("--meta", required=True, help="bge_m3_meta.tsv")
     parser.add_argument("--clusters", required=True, help="cluster_ids.txt")
     parser.add_argument("--out", required=True, help="Output CSV/TSV with aggregated clusters.")
-    parser.add_argument("--progress-interval", type=int, default=500000)
+    parser.add_argument("--progress-interval", type=int, default=500000,
+                        help="Kept for compatibility: progress is shown per chunk.")
+    parser.add_argument("--previous", default=None,
+                        help="Previous clusters_aggregated.tsv (incremental runs): its clusters keep "
+                             "their representative and row order, freq/size are recomputed, "
+                             "new clusters are appended.")
     args = parser.parse_args()
 
     meta_path = Path(args.meta)
     cl_path = Path(args.clusters)
 
     print("[info] loading cluster ids...", file=sys.stderr)
-    cluster_ids = np.loadtxt(cl_path, dtype=np.int32)
+    cluster_ids = read_cluster_ids(cl_path)
     n = len(cluster_ids)
     print(f"[info] total phrases: {n:,}", file=sys.stderr)
 
-    clusters = defaultdict(list)
-
-    print("[info] reading metadata and grouping...", file=sys.stderr)
-    with meta_path.open("r", encoding="utf-8") as f:
-        for idx, line in tqdm(enumerate(f), total=n):
-            parts = line.rstrip("\n").split("\t")
-            if len(parts) != 4:
-                continue
-            pid, phrase, freq, length = parts
-            pid = int(pid)
-            freq = int(freq)
-            length = int(length)
-
-            cid = cluster_ids[pid]
-            clusters[cid].append((phrase, freq, length))
+    print("[info] reading metadata...", file=sys.stderr)
+    row, freq, length, p_start, p_len = read_meta(meta_path)
+    cid = cluster_ids[row]
 
     print("[info] computing representatives...", file=sys.stderr)
+    # представитель: 1) max freq, 2) при равенстве — длина ближе к 4 слов,
+    # 3) дальше — раньше в meta (lexsort устойчив)
+    order = np.lexsort((np.abs(length - 4), -freq, cid))
+    cid_s = cid[order]
+    bounds = np.flatnonzero(np.concatenate(([True], cid_s[1:] != cid_s[:-1])))
+
+    total_freq = np.add.reduceat(freq[order], bounds) if len(order) else freq[:0]
+    sizes = np.diff(np.append(bounds, len(order)))
+    rep = order[bounds]
+    # кластеры — в порядке первой встречи в meta, как dict раньше
+    first_seen = np.minimum.reduceat(order, bounds) if len(order) else order[:0]
+    out_order = np.argsort(first_seen, kind="stable")
+
+    # кластер g -> представитель из предыдущего прогона (если был)
+    kept_rep = {}
+    if args.previous:
+        prev_cids, prev_reps = read_previous(Path(args.previous))
+        uniq = cid_s[bounds]
+        pos = np.minimum(np.searchsorted(uniq, prev_cids), max(len(uniq) - 1, 0))
+        present = (uniq[pos] == prev_cids) if len(uniq) else np.zeros(len(prev_cids), dtype=bool)
+        for j in np.flatnonzero(present).tolist():
+            kept_rep[int(pos[j])] = prev_reps[j]
+        prev_groups = pos[present]
+        is_new = np.ones(len(bounds), dtype=bool)
+        is_new[prev_groups] = False
+        out_order = np.concatenate([prev_groups, out_order[is_new[out_order]]])
+        print(f"[info] previous clusters kept: {len(prev_groups):,} "
+              f"(dropped: {len(prev_cids) - len(prev_groups):,}), "
+              f"new: {int(is_new.sum()):,}", file=sys.stderr)
 
     out_path = Path(args.out)
-    with out_path.open("w", encoding="utf-8") as fout:
+    with meta_path.open("rb") as fmeta, out_path.open("w", encoding="utf-8") as fout:
+        mm = mmap.mmap(fmeta.fileno(), 0, access=mmap.ACCESS_READ) if len(rep) else None
         fout.write("cluster_id\tcluster_freq\tcluster_size\trepresentative\n")
-
-        for cid, items in clusters.items():
-            # cluster frequency
-            total_freq = sum(fr for _, fr, _ in items)
-            size = len(items)
-
-            # choose representative:
-            # 1) max freq
-            # 2) tie → choose shorter phrase (but >= 3 words)
-            items_sorted = sorted(
-                items,
-                key=lambda x: (-x[1], abs(x[2] - 4))  # freq desc, length close to 4
-            )
-            rep_phrase = items_sorted[0][0]
-
-            fout.write(f"{cid}\t{total_freq}\t{size}\t{rep_phrase}\n")
+        for g in out_order.tolist():
+            if g in kept_rep:
+                rep_phrase = kept_rep[g]
+            else:
+                r = rep[g]
+                rep_phrase = mm[p_start[r]:p_start[r] + p_len[r]].decode("utf-8")
+            fout.write(f"{cid_s[bounds[g]]}\t{total_freq[g]}\t{sizes[g]}\t{rep_phrase}\n")
+        if mm is not None:
+            mm.close()
 
     print(f"[done] written: {out_path}")
 
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+build_concordance.py
+
+Конкорданс для final_phrases: для каждой фразы — ограниченная выборка
+вхождений (файл, смещение строки) в сыром корпусе, чтобы бэкенд мог
+показать примеры предложений одним seek() без grep по корпусу.
+
+Один параллельный проход по корпусу (диапазоны байт). Строка корпуса
+нормализуется так же, как в clean_phrases_step1 (теги/URL, lower,
+только буквы), слова переводятся в id словаря фраз, и все окна длиной
+от min до max длины фразы ищутся в хеш-таблице кортежей id.
+
+Выборка на фразу — bottom-k по хешу позиции (одинаковая для любого
+разбиения на диапазоны и равномерная по корпусу, а не «первые k»).
+
+Выходной каталог (формат читает backend/app/services/concordance.py):
+
+    postings.u64   примеры всех фраз подряд: (номер файла << 48) | смещение строки,
+                   внутри фразы отсортированы по файлу и смещению
+    offsets.u64    начало примеров фразы с id i в postings.u64, n_phrases + 1 значений
+    totals.u64     сколько всего строк корпуса содержат фразу
+    meta.json      n_phrases, max_examples, files (абсолютные пути корпуса), ids = "db"
+
+Строки индекса — id фраз в БД (phrases.id): фразы файла (строки по
+phrase_index.parse_final_line) переводятся в них по phrase_ids_for_db.tsv
+из load_corpus_to_db.py. n_phrases = max(id) + 1; у id, которых нет в
+файле (retired после дельты), примеров нет.
+"""
+import argparse
+import heapq
+import json
+import os
+import sys
+import time
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "common"))
+from parallel_lines import iter_range_line_offsets, map_byte_ranges  # noqa: E402
+
+from clean_phrases_step1 import split_letters, strip_tags_and_urls  # noqa: E402
+from phrase_index import parse_final_line, read_phrase_db_ids  # noqa: E402
+
+FILE_SHIFT = 48
+OFFSET_MASK = (1 << FILE_SHIFT) - 1
+
+# перемешивание позиции для bottom-k выборки (64-битный multiplicative hash)
+MIX = 0x9E3779B97F4A7C15
+MASK64 = (1 << 64) - 1
+
+
+def normalize(line: str) -> List[str]:
+    """Слова строки так, как их видит clean_line (без фильтра по длине)."""
+    return split_letters(strip_tags_and_urls(line).strip().lower())
+
+
+def read_final_phrases(path: str) -> List[str]:
+    """Тексты фраз; что считается фразой, решает phrase_index.parse_final_line."""
+    phrases = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            parsed = parse_final_line(line.rstrip("\n"))
+            if parsed is not None:
+                phrases.append(parsed[0])
+    return phrases
+
+
+@lru_cache(maxsize=1)
+def load_matcher(phrases_path: str) -> Tuple[Dict[str, int], Dict[tuple, int], List[int]]:
+    """
+    (слово -> id, кортеж id слов фразы -> id фразы, длины фраз по возрастанию).
+    Кэшируется на процесс: каждый воркер строит таблицу один раз.
+    """
+    vocab: Dict[str, int] = {}
+    table: Dict[tuple, int] = {}
+    for pid, phrase in enumerate(read_final_phrases(phrases_path)):
+        words = normalize(phrase)
+        if not words:
+            continue
+        key = tuple(vocab.setdefault(w, len(vocab)) for w in words)
+        table.setdefault(key, pid)
+    lengths = sorted({len(k) for k in table})
+    return vocab, table, lengths
+
+
+def scan_range(path: str, start: int, end: int, file_no: int,
+               phrases_path: str, max_examples: int):
+    """
+    Найти вхождения фраз в [start, end). Возвращает
+    (строк, {id фразы: [строк с фразой, heap[(-hash, posting)]]}).
+    """
+    vocab, table, lengths = load_matcher(phrases_path)
+    found: Dict[int, list] = {}
+    n_lines = 0
+    file_bits = file_no << FILE_SHIFT
+
+    for off, line in iter_range_line_offsets(path, start, end):
+        n_lines += 1
+        ids = [vocab.get(w, -1) for w in normalize(line)]
+        L = len(ids)
+        if not lengths or L < lengths[0]:
+            continue
+
+        seen = set()
+        for n in lengths:
+            if n > L:
+                break
+            for j in range(L - n + 1):
+                pid = table.get(tuple(ids[j:j + n]))
+                if pid is None or pid in seen:
+                    continue
+                # одна строка — один пример фразы
+                seen.add(pid)
+                posting = file_bits | off
+                h = (posting * MIX) & MASK64
+                entry = found.get(pid)
+                if entry is None:
+                    found[pid] = [1, [(-h, posting)]]
+                    continue
+                entry[0] += 1
+                heap = entry[1]
+                if len(heap) < max_examples:
+                    heapq.heappush(heap, (-h, posting))
+                elif -h > heap[0][0]:
+                    heapq.heapreplace(heap, (-h, posting))
+
+    return n_lines, found
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Конкорданс: для каждой фразы final_phrases — выборка строк корпуса "
+            "(файл, смещение) в memmap-файле для эндпоинта /phrases/{id}/examples."
+        )
+    )
+    parser.add_argument(
+        "--phrases",
+        required=True,
+        help="final_phrases*.tsv (phrase<TAB>freq<TAB>cluster_size), тот же, что грузится в БД.",
+    )
+    parser.add_argument(
+        "--phrase-ids",
+        required=True,
+        help="phrase_ids_for_db.tsv (file_id<TAB>db_id), который load_corpus_to_db.py "
+             "пишет после загрузки этого же файла.",
+    )
+    parser.add_argument(
+        "--corpus",
+        required=True,
+        nargs="+",
+        help="Сырые файлы корпуса (одна реплика на строку), например data/es.txt.",
+    )
+    parser.add_argument(
+        "--out-dir",
+        required=True,
+        help="Каталог конкорданса (postings.u64, offsets.u64, totals.u64, meta.json).",
+    )
+    parser.add_argument(
+        "--max-examples",
+        type=int,
+        default=20,
+        help="Сколько примеров хранить на фразу. По умолчанию 20.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Число процессов (файлы режутся на диапазоны байт). По умолчанию = числу CPU.",
+    )
+    args = parser.parse_args()
+
+    t0 = time.time()
+    phrases_path = os.path.abspath(args.phrases)
+    n_phrases = len(read_final_phrases(phrases_path))
+    try:
+        db_of = read_phrase_db_ids(args.phrase_ids, n_phrases)
+    except (OSError, ValueError) as e:
+        print(f"[error] {e}: rerun load_corpus_to_db.py for {phrases_path}", file=sys.stderr)
+        sys.exit(1)
+    n_rows = int(db_of.max()) + 1 if n_phrases else 0
+    _vocab, table, lengths = load_matcher(phrases_path)
+    print(f"[info] {n_phrases:,} phrases, {len(table):,} distinct word sequences, "
+          f"lengths {lengths}", file=sys.stderr)
+
+    totals = np.zeros(n_phrases, dtype=np.uint64)
+    samples: Dict[int, list] = {}
+    files = [os.path.abspath(p) for p in args.corpus]
+    total_lines = 0
+
+    for file_no, path in enumerate(files):
+        print(f"[info] scanning {path}", file=sys.stderr)
+        for n_lines, found in map_byte_ranges(path, scan_range, args.workers,
+                                              file_no, phrases_path, args.max_examples):
+            total_lines += n_lines
+            for pid, (cnt, heap) in found.items():
+                totals[pid] += cnt
+                cur = samples.get(pid)
+                if cur is None:
+                    samples[pid] = heap
+                    continue
+                # bottom-k двух выборок — k наименьших хешей объединения
+                for item in heap:
+                    if len(cur) < args.max_examples:
+                        heapq.heappush(cur, item)
+                    elif item[0] > cur[0][0]:
+                        heapq.heapreplace(cur, item)
+
+    out_dir = Path(args.out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    # строки — по id в БД
+    pid_of_row = np.full(n_rows, -1, dtype=np.int64)
+    pid_of_row[db_of] = np.arange(n_phrases)
+    offsets = np.zeros(n_rows + 1, dtype=np.uint64)
+    with (out_dir / "postings.u64").open("wb") as fpost:
+        pos = 0
+        for row, pid in enumerate(pid_of_row.tolist()):
+            heap = samples.get(pid)
+            if heap:
+                postings = np.array(sorted(p for _h, p in heap), dtype=np.uint64)
+                postings.tofile(fpost)
+                pos += len(postings)
+            offsets[row + 1] = pos
+    offsets.tofile(out_dir / "offsets.u64")
+    row_totals = np.zeros(n_rows, dtype=np.uint64)
+    row_totals[db_of] = totals
+    row_totals.tofile(out_dir / "totals.u64")
+
+    meta = {
+        "n_phrases": n_rows,
+        "max_examples": args.max_examples,
+        "files": files,
+        "phrases": phrases_path,
+        "phrase_ids": os.path.abspath(args.phrase_ids),
+        "ids": "db",
+    }
+    with (out_dir / "meta.json").open("w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+
+    covered = int((offsets[1:] > offsets[:-1]).sum())
+    elapsed = max(time.time() - t0, 1e-9)
+    print(f"[done] {covered:,} of {n_phrases:,} phrases have examples, "
+          f"{int(offsets[-1]):,} postings written to {out_dir}", file=sys.stderr)
+    print(f"[stats] {total_lines:,} corpus lines in {elapsed:.1f}s, "
+          f"{total_lines / elapsed:,.0f} lines/s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
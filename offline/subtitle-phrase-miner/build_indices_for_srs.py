@@ -1,13 +1,26 @@
 #!/usr/bin/env python3
 import argparse
+import os
 import sys
+import time
 from pathlib import Path
-from collections import Counter
+
+from phrase_index import (
+    PHRASE_WORDS_FILE,
+    PHRASE_WORDS_POS_FILE,
+    PHRASES_FILE,
+    WORDS_FILE,
+    read_phrase_table,
+    write_phrase_words,
+    write_phrases,
+    write_word_arrays,
+    write_words,
+)
 
 
 def main():
     parser = argparse.ArgumentParser(
-        description="Построить индексы слов и фраз из final_phrases.tsv."
+        description="Построить индексы слов и фраз из final_phrases.tsv (за один проход по файлу)."
     )
     parser.add_argument(
         "-i", "--input",
@@ -17,13 +30,14 @@ def main():
     parser.add_argument(
         "--out-dir",
         required=True,
-        help="Каталог для файлов words.tsv, phrases.tsv, phrase_words.tsv.",
+        help="Каталог для words.tsv, phrases.tsv, phrase_words.tsv, phrase_words_pos.tsv "
+             "и двоичных phrase_word_ids.i32 / phrase_word_offsets.u64.",
     )
     parser.add_argument(
-        "--progress-interval",
+        "--workers",
         type=int,
-        default=200000,
-        help="Интервал прогресса по строкам.",
+        default=os.cpu_count() or 1,
+        help="Процессов для чтения файла (по диапазонам байт).",
     )
     args = parser.parse_args()
 
@@ -31,111 +45,28 @@ def main():
     out_dir = Path(args.out_dir)
     out_dir.mkdir(parents=True, exist_ok=True)
 
-    # 1. Первый проход: считаем частоты слов (взвешенные freq фразы)
-    word_freq = Counter()
-    total_phrases = 0
-    next_progress = args.progress_interval
-
-    print(f"[info] pass 1: counting word frequencies from {in_path}", file=sys.stderr)
-    with in_path.open("r", encoding="utf-8") as fin:
-        for line in fin:
-            total_phrases += 1
-            if total_phrases >= next_progress:
-                print(f"[pass1] {total_phrases:,} phrases...", file=sys.stderr)
-                next_progress += args.progress_interval
-
-            line = line.rstrip("\n")
-            if not line:
-                continue
-
-            parts = line.split("\t")
-            if len(parts) < 2:
-                continue
-
-            phrase = parts[0]
-            try:
-                freq = int(parts[1])
-            except ValueError:
-                continue
-
-            words = phrase.split()
-            for w in words:
-                if w:
-                    word_freq[w] += freq
+    t0 = time.time()
+    print(f"[info] reading phrases from {in_path} ({args.workers} workers)", file=sys.stderr)
+    table = read_phrase_table(str(in_path), args.workers)
+    print(f"[info] total phrases read: {table.n:,}", file=sys.stderr)
+    print(f"[info] vocab size: {len(table.vocab):,}", file=sys.stderr)
 
-    print(f"[info] total phrases read: {total_phrases:,}", file=sys.stderr)
-    print(f"[info] vocab size: {len(word_freq):,}", file=sys.stderr)
-
-    # 2. Строим словарь: word -> word_id, сортируем по убыванию freq
+    # word_id = rank - 1 по убыванию суммарной freq слова
     print("[info] building word index...", file=sys.stderr)
-    words_sorted = sorted(word_freq.items(), key=lambda x: x[1], reverse=True)
-
-    word2id = {}
-    words_path = out_dir / "words.tsv"
-    with words_path.open("w", encoding="utf-8") as fout:
-        fout.write("word_id\tword\ttotal_freq\trank\n")
-        for rank, (w, f) in enumerate(words_sorted, start=1):
-            wid = rank - 1  # можно от 0
-            word2id[w] = wid
-            fout.write(f"{wid}\t{w}\t{f}\t{rank}\n")
-
-    print(f"[done] words.tsv written: {len(word2id):,} words", file=sys.stderr)
-
-    # 3. Второй проход: phrases.tsv и phrase_words.tsv
-    phrases_path = out_dir / "phrases.tsv"
-    pw_path = out_dir / "phrase_words.tsv"
-
-    print("[info] pass 2: writing phrases and phrase_words...", file=sys.stderr)
-    total_phrases = 0
-    next_progress = args.progress_interval
-
-    with in_path.open("r", encoding="utf-8") as fin, \
-         phrases_path.open("w", encoding="utf-8") as fphr, \
-         pw_path.open("w", encoding="utf-8") as fpw:
-
-        fphr.write("phrase_id\tphrase\tfreq\tcluster_size\tlength\n")
-        # phrase_words.tsv без заголовка: phrase_id<TAB>word_id
-
-        for phrase_id, line in enumerate(fin):
-            total_phrases += 1
-            if total_phrases >= next_progress:
-                print(f"[pass2] {total_phrases:,} phrases...", file=sys.stderr)
-                next_progress += args.progress_interval
-
-            line = line.rstrip("\n")
-            if not line:
-                continue
-            parts = line.split("\t")
-            if len(parts) < 2:
-                continue
-
-            phrase = parts[0]
-            try:
-                freq = int(parts[1])
-            except ValueError:
-                continue
-
-            cluster_size = 1
-            if len(parts) >= 3:
-                try:
-                    cluster_size = int(parts[2])
-                except ValueError:
-                    pass
-
-            words = phrase.split()
-            length = len(words)
-
-            # пишем фразу
-            fphr.write(f"{phrase_id}\t{phrase}\t{freq}\t{cluster_size}\t{length}\n")
-
-            # связи фраза-слово
-            for w in words:
-                wid = word2id.get(w)
-                if wid is not None:
-                    fpw.write(f"{phrase_id}\t{wid}\n")
-
-    print(f"[done] phrases.tsv written, total phrases: {total_phrases:,}", file=sys.stderr)
-    print(f"[done] phrase_words.tsv written", file=sys.stderr)
+    totals = table.word_totals()
+    order, wid_of = table.ranked_word_ids(totals)
+    write_words(str(out_dir / WORDS_FILE), table, totals, order)
+    print(f"[done] words.tsv written: {len(order):,} words", file=sys.stderr)
+
+    word_ids = wid_of[table.tokens]
+    write_phrases(str(out_dir / PHRASES_FILE), table)
+    print(f"[done] phrases.tsv written, total phrases: {table.n:,}", file=sys.stderr)
+    rows = write_phrase_words(str(out_dir / PHRASE_WORDS_FILE), table, word_ids)
+    write_phrase_words(str(out_dir / PHRASE_WORDS_POS_FILE), table, word_ids, with_positions=True)
+    write_word_arrays(str(out_dir), table, word_ids)
+    print(f"[done] phrase_words written: {rows:,} rows (tsv, tsv with positions, binary)",
+          file=sys.stderr)
+    print(f"[done] in {time.time() - t0:.1f}s", file=sys.stderr)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+build_similar_index.py
+
+ANN-индекс (FAISS HNSW, inner product) по эмбеддингам финальных фраз
+и таблица похожих фраз для backend (/api/v1/phrases/{id}/similar).
+
+Строки индекса и соседи — id фраз в БД (phrases.id): фразы финального
+файла (строки по phrase_index.parse_final_line) переводятся в них по
+phrase_ids_for_db.tsv из load_corpus_to_db.py; n = max(id) + 1, у id,
+которых нет в файле (retired после дельты), нет ни текста, ни соседей.
+Вектор берётся из bge_m3_embeddings.dat по тексту фразы (без
+восстановленных ¿?).
+
+Каталог выхода:
+
+    index.faiss        HNSW по фразам с эмбеддингом (позиция -> phrase_id
+                       через index_ids.i32) — для разовых запросов офлайн
+    index_ids.i32      id фразы каждой позиции индекса
+    knn_ids.i32        (n, k) — формат knn_graph.py, строка = id фразы;
+    knn_sims.f32       соседи уже в id фраз, -1 — соседа нет
+    meta.json          ids = "db"
+    texts.bin          тексты фраз (UTF-8 подряд) — ответ API без запроса к БД
+    text_offsets.u64   (n + 1) смещений в texts.bin
+"""
+import argparse
+import os
+import sys
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+import faiss
+from tqdm import tqdm
+
+from build_concordance import read_final_phrases
+from phrase_index import read_phrase_db_ids
+from knn_graph import create_graph, finish_graph
+
+
+def read_meta_rows(meta_path: str) -> Dict[str, int]:
+    """phrase -> row из bge_m3_meta.tsv (row<TAB>phrase<TAB>freq<TAB>len)."""
+    rows = {}
+    with open(meta_path, "r", encoding="utf-8") as f:
+        for line in f:
+            parts = line.rstrip("\n").split("\t")
+            if len(parts) < 2:
+                continue
+            rows.setdefault(parts[1], int(parts[0]))
+    return rows
+
+
+def write_texts(out_dir: str, phrases: List[str]):
+    offsets = np.zeros(len(phrases) + 1, dtype=np.uint64)
+    with open(os.path.join(out_dir, "texts.bin"), "wb") as f:
+        pos = 0
+        for i, phrase in enumerate(phrases):
+            raw = phrase.encode("utf-8")
+            f.write(raw)
+            pos += len(raw)
+            offsets[i + 1] = pos
+    offsets.tofile(os.path.join(out_dir, "text_offsets.u64"))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=(
+            "HNSW-индекс по эмбеддингам финальных фраз и таблица top-k похожих "
+            "для /api/v1/phrases/{id}/similar."
+        )
+    )
+    parser.add_argument("--phrases", required=True,
+                        help="Финальный файл фраз (тот же, что грузится в БД).")
+    parser.add_argument("--phrase-ids", required=True,
+                        help="phrase_ids_for_db.tsv (file_id<TAB>db_id) из load_corpus_to_db.py.")
+    parser.add_argument("--meta", required=True, help="bge_m3_meta.tsv")
+    parser.add_argument("--emb", required=True, help="bge_m3_embeddings.dat")
+    parser.add_argument("--dim", type=int, default=1024, help="Embedding dimension.")
+    parser.add_argument("--out-dir", required=True, help="Каталог индекса (SIMILAR_DIR в backend).")
+    parser.add_argument("--k", type=int, default=21,
+                        help="Соседей на фразу, включая её саму. По умолчанию 21.")
+    parser.add_argument("--hnsw-m", type=int, default=32)
+    parser.add_argument("--ef-construction", type=int, default=200)
+    parser.add_argument("--ef-search", type=int, default=128)
+    parser.add_argument("--batch-size", type=int, default=4096)
+    args = parser.parse_args()
+
+    os.makedirs(args.out_dir, exist_ok=True)
+
+    phrases = read_final_phrases(args.phrases)
+    try:
+        db_of = read_phrase_db_ids(args.phrase_ids, len(phrases))
+    except (OSError, ValueError) as e:
+        print(f"[error] {e}: rerun load_corpus_to_db.py for {args.phrases}", file=sys.stderr)
+        sys.exit(1)
+    n = int(db_of.max()) + 1 if len(phrases) else 0
+    print(f"[info] final phrases: {len(phrases):,}, max db id: {n - 1:,}", file=sys.stderr)
+    texts = [""] * n
+    for pid, db_id in enumerate(db_of.tolist()):
+        texts[db_id] = phrases[pid]
+    write_texts(args.out_dir, texts)
+
+    meta_rows = read_meta_rows(args.meta)
+    emb_rows = np.array([meta_rows.get(p.strip("¿?"), -1) for p in phrases], dtype=np.int64)
+    del meta_rows
+    have = np.flatnonzero(emb_rows >= 0).astype(np.int32)
+    print(f"[info] phrases with embeddings: {len(have):,} / {len(phrases):,}", file=sys.stderr)
+
+    emb_all = np.memmap(args.emb, mode="r", dtype="float16").reshape(-1, args.dim)
+    index = faiss.IndexHNSWFlat(args.dim, args.hnsw_m, faiss.METRIC_INNER_PRODUCT)
+    index.hnsw.efConstruction = args.ef_construction
+    for s in tqdm(range(0, len(have), args.batch_size), desc="index add", unit="batch"):
+        rows = emb_rows[have[s:s + args.batch_size]]
+        index.add(np.asarray(emb_all[rows], dtype="float32"))
+    index.hnsw.efSearch = args.ef_search
+    faiss.write_index(index, os.path.join(args.out_dir, "index.faiss"))
+    have_db = db_of[have].astype(np.int32)
+    have_db.tofile(os.path.join(args.out_dir, "index_ids.i32"))
+
+    ids, sims = create_graph(args.out_dir, n, args.k)
+    ids[:] = -1
+    sims[:] = 0
+    for s in tqdm(range(0, len(have), args.batch_size), desc="kNN", unit="batch"):
+        pids = have[s:s + args.batch_size]
+        D, I = index.search(np.asarray(emb_all[emb_rows[pids]], dtype="float32"), args.k)
+        rows = db_of[pids]
+        ids[rows] = np.where(I >= 0, have_db[np.maximum(I, 0)], -1)
+        sims[rows] = D
+
+    finish_graph(args.out_dir, ids, sims, {
+        "n": n, "k": args.k, "dim": args.dim, "indexed": int(len(have)),
+        "phrases": str(Path(args.phrases).resolve()), "emb": str(Path(args.emb).resolve()),
+        "phrase_ids": str(Path(args.phrase_ids).resolve()), "ids": "db",
+        "hnsw_m": args.hnsw_m, "ef_construction": args.ef_construction,
+        "ef_search": args.ef_search,
+    })
+    print(f"[done] similar-phrase index written to {args.out_dir}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
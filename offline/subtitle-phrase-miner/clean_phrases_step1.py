@@ -1,10 +1,13 @@
 #!/usr/bin/env python3
 import argparse
 import os
+import resource
 import sys
 import re
+import string
+import time
+from collections import deque
 from concurrent.futures import ProcessPoolExecutor
-from itertools import repeat
 from typing import List, Iterable
 
 
@@ -28,6 +31,14 @@ BRACKETS_RE = re.compile(
     flags=re.UNICODE,
 )
 
+# Символы, по которым URL_RE / BRACKETS_RE вообще могут сработать:
+# если их нет в строке, регэкспы можно не запускать (результат тот же).
+BRACKET_CHARS = ("[", "<", "{", "(", "♪")
+
+# Небуквенные символы, которые обычно висят на краях слов ("¿qué", "aquí,").
+# Срезаем их str.strip(), не заходя в посимвольный цикл.
+EDGE_CHARS = string.punctuation + string.digits + "¿¡«»…—–“”‘’♪"
+
 
 def strip_tags_and_urls(line: str) -> str:
     """
@@ -36,11 +47,37 @@ def strip_tags_and_urls(line: str) -> str:
       - теги субтитров: [..], <..>, {..}, (..), ♪..♪
     Заменяет их пробелами (чтобы не склеивать слова).
     """
-    line = URL_RE.sub(" ", line)
-    line = BRACKETS_RE.sub(" ", line)
+    if "://" in line or ("." in line and "www." in line.lower()):
+        line = URL_RE.sub(" ", line)
+    if any(ch in line for ch in BRACKET_CHARS):
+        line = BRACKETS_RE.sub(" ", line)
     return line
 
 
+def split_letters(line: str) -> List[str]:
+    """
+    Слова = максимальные последовательности букв (isalpha), всё прочее — разделитель.
+
+    Быстрый путь: режем по пробелам, чисто буквенные токены берём как есть,
+    у остальных срезаем пунктуацию по краям. Посимвольно по isalpha()
+    разбираются только токены с небуквенными символами внутри ("x-men", "x²").
+    """
+    tokens = []
+    for tok in line.split():
+        if tok.isalpha():
+            tokens.append(tok)
+            continue
+        tok = tok.strip(EDGE_CHARS)
+        if not tok:
+            continue
+        if tok.isalpha():
+            tokens.append(tok)
+        else:
+            chars = [ch if ch.isalpha() else " " for ch in tok]
+            tokens.extend("".join(chars).split())
+    return tokens
+
+
 def clean_line(line: str, min_words: int, max_words: int) -> str | None:
     """
     Грубая очистка одной строки:
@@ -58,17 +95,8 @@ def clean_line(line: str, min_words: int, max_words: int) -> str | None:
     if not line:
         return None
 
-    # Шаг 3: только буквы и пробелы (прочее -> пробел)
-    chars = []
-    for ch in line:
-        if ch.isalpha():
-            chars.append(ch)
-        else:
-            chars.append(" ")
-    cleaned = "".join(chars)
-
-    # Шаг 4: токенизация и фильтр по длине
-    tokens = cleaned.split()
+    # Шаг 3–4: только буквы (прочее -> разделитель), токенизация и фильтр по длине
+    tokens = split_letters(line)
     n = len(tokens)
     if min_words <= n <= max_words:
         return " ".join(tokens)
@@ -155,38 +183,66 @@ def main():
         default=1_000_000,
         help="Как часто показывать прогресс (по числу обработанных строк). По умолчанию 1_000_000.",
     )
+    parser.add_argument(
+        "--max-inflight",
+        type=int,
+        default=0,
+        help="Макс. число чанков в обработке одновременно (ограничивает память). По умолчанию 2 * workers.",
+    )
 
     args = parser.parse_args()
 
+    max_inflight = args.max_inflight or 2 * args.workers
+
     total_lines = 0
+    total_out = 0
+    next_progress = args.progress_interval
+    t0 = time.time()
+
+    print(f"[info] using {args.workers} workers, chunk_size={args.chunk_size}, "
+          f"max {max_inflight} chunks in flight", file=sys.stderr)
 
     with open(args.input, "r", encoding="utf-8", errors="ignore") as fin, \
          open(args.output, "w", encoding="utf-8") as fout, \
          ProcessPoolExecutor(max_workers=args.workers) as ex:
 
-        chunks = list(chunk_reader(fin, args.chunk_size))
-
-        # Чтобы прогресс был точным, считаем реальный размер каждого чанка
-        total_input_lines = sum(len(c) for c in chunks)
-        print(f"[info] total input lines: {total_input_lines:,}", file=sys.stderr)
-
-        for out_lines, chunk in zip(
-            ex.map(
-                process_chunk,
-                chunks,
-                repeat(args.min_words),
-                repeat(args.max_words),
-            ),
-            chunks,
-        ):
+        # Очередь (future, размер чанка) в порядке чтения:
+        # пишем строго по порядку, в полёте не больше max_inflight чанков.
+        inflight = deque()
+
+        def write_head():
+            nonlocal total_lines, total_out, next_progress
+            fut, n_lines = inflight.popleft()
+            out_lines = fut.result()
             fout.writelines(out_lines)
-            total_lines += len(chunk)
+            total_lines += n_lines
+            total_out += len(out_lines)
+
+            if total_lines >= next_progress:
+                print(f"[progress] processed {total_lines:,} lines", file=sys.stderr)
+                next_progress += args.progress_interval
+
+        for chunk in chunk_reader(fin, args.chunk_size):
+            if len(inflight) >= max_inflight:
+                write_head()
+            fut = ex.submit(process_chunk, chunk, args.min_words, args.max_words)
+            inflight.append((fut, len(chunk)))
+
+        while inflight:
+            write_head()
 
-            if total_lines % args.progress_interval < len(chunk):
-                print(f"[progress] processed {total_lines:,} / {total_input_lines:,} lines",
-                      file=sys.stderr)
+    elapsed = max(time.time() - t0, 1e-9)
+    in_bytes = os.path.getsize(args.input)
+    # ru_maxrss в Linux — в килобайтах
+    rss_main = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    rss_workers = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
 
     print(f"[done] total processed lines: {total_lines:,}", file=sys.stderr)
+    print(f"[done] lines written:         {total_out:,}", file=sys.stderr)
+    print(f"[stats] elapsed: {elapsed:.1f}s, {total_lines / elapsed:,.0f} lines/s, "
+          f"{in_bytes / elapsed / 1e6:,.1f} MB/s", file=sys.stderr)
+    print(f"[stats] peak RSS: main {rss_main:,.0f} MB, largest worker {rss_workers:,.0f} MB",
+          file=sys.stderr)
 
 
 if __name__ == "__main__":
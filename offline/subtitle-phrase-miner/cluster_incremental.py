@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+cluster_incremental.py
+
+Инкрементальная leader-кластеризация: фразы, уже известные состоянию
+(cluster_leader_faiss.py --state-dir), сохраняют свой cluster_id; новые
+ищутся по индексу лидеров и присоединяются к ближайшему лидеру со
+сходством >= threshold или открывают новый кластер (становятся лидером).
+
+Эмбеддинги нужны только новым фразам — с encode_bge_m3.py --cache-dir
+кодируются только они. Выход — cluster_ids.txt по строкам нового meta
+(для aggregate_clusters.py --previous), состояние обновляется на месте.
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+from tqdm import tqdm
+
+from cluster_state import lookup_keys, open_state, read_meta_phrases, save_state
+from embedding_cache import phrase_keys
+
+
+def assign_batch(index, leader_cids: list, x: np.ndarray, threshold: float,
+                 next_cid: int) -> tuple:
+    """
+    Один батч новых фраз (x — нормированные векторы, по порядку строк):
+    сначала ближайший лидер из индекса; не присоединённые разбираются
+    по порядку, как в leader-кластеризации: новая фраза присоединяется к
+    лидеру, открытому раньше в этом же батче, иначе сама становится лидером.
+    """
+    cid = np.full(len(x), -1, dtype=np.int64)
+    if index.ntotal:
+        D, I = index.search(x, 1)
+        hit = (I[:, 0] >= 0) & (D[:, 0] >= threshold)
+        cid[hit] = np.asarray(leader_cids)[I[hit, 0]]
+
+    rest = np.flatnonzero(cid < 0)
+    is_leader = np.zeros(len(rest), dtype=bool)
+    if len(rest):
+        sims = x[rest] @ x[rest].T
+        for a in range(len(rest)):
+            if a:
+                cand = np.where(is_leader[:a], sims[a, :a], -np.inf)
+                b = int(cand.argmax())
+                if cand[b] >= threshold:
+                    cid[rest[a]] = cid[rest[b]]
+                    continue
+            cid[rest[a]] = next_cid
+            next_cid += 1
+            is_leader[a] = True
+
+    new_leaders = np.flatnonzero(is_leader)
+    if len(new_leaders):
+        lead_rows = rest[new_leaders]
+        index.add(x[lead_rows])
+        leader_cids.extend(cid[lead_rows].tolist())
+    return cid, next_cid, len(new_leaders)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Инкрементальная кластеризация: новые фразы — к существующим лидерам "
+            "или в новые кластеры; номера старых кластеров не меняются."
+        )
+    )
+    parser.add_argument("--state-dir", required=True,
+                        help="Состояние кластеризации (cluster_leader_faiss.py --state-dir); обновляется.")
+    parser.add_argument("--meta", required=True, help="Новый bge_m3_meta.tsv.")
+    parser.add_argument("--emb", required=True, help="Новый bge_m3_embeddings.dat (по строкам meta).")
+    parser.add_argument("--dim", type=int, default=1024, help="Embedding dimension.")
+    parser.add_argument("--out", required=True, help="Output: cluster_id per line of the new meta.")
+    parser.add_argument("--threshold", type=float, default=None,
+                        help="Порог косинусного сходства; по умолчанию — из состояния.")
+    parser.add_argument("--batch-size", type=int, default=4096)
+    parser.add_argument("--ef-search", type=int, default=64)
+    args = parser.parse_args()
+
+    t0 = time.time()
+    index, leader_cids, keys, cids, meta = open_state(args.state_dir)
+    threshold = args.threshold if args.threshold is not None else meta["threshold"]
+    if hasattr(index, "hnsw"):
+        index.hnsw.efSearch = args.ef_search
+
+    phrases = read_meta_phrases(args.meta)
+    n = len(phrases)
+    new_keys = phrase_keys(phrases)
+    del phrases
+    cluster_id = lookup_keys(keys, cids, new_keys)
+    fresh = np.flatnonzero(cluster_id < 0)
+    print(f"[info] phrases: {n:,}, known: {n - len(fresh):,}, new: {len(fresh):,}",
+          file=sys.stderr)
+
+    emb = np.memmap(args.emb, mode="r", dtype="float16").reshape(-1, args.dim)
+    if len(emb) != n:
+        print(f"[error] embeddings have {len(emb):,} rows, meta {n:,}", file=sys.stderr)
+        sys.exit(1)
+
+    leader_list = leader_cids.tolist()
+    next_cid = meta["n_clusters"]
+    opened = 0
+    for s in tqdm(range(0, len(fresh), args.batch_size), desc="assign", unit="batch"):
+        rows = fresh[s:s + args.batch_size]
+        x = np.ascontiguousarray(emb[rows], dtype="float32")
+        cid, next_cid, n_new = assign_batch(index, leader_list, x, threshold, next_cid)
+        cluster_id[rows] = cid
+        opened += n_new
+
+    print(f"[info] joined existing clusters: {len(fresh) - opened:,}, "
+          f"new clusters: {opened:,}", file=sys.stderr)
+
+    out_path = Path(args.out)
+    np.savetxt(out_path, cluster_id, fmt="%d")
+    print(f"[done] cluster ids written to {out_path}", file=sys.stderr)
+
+    if len(fresh):
+        all_keys = np.concatenate([keys, new_keys[fresh]])
+        all_cids = np.concatenate([cids, cluster_id[fresh].astype(np.int32)])
+        meta.update({"n_clusters": next_cid, "n_phrases": int(len(all_keys)),
+                     "threshold": threshold})
+        save_state(args.state_dir, index, np.asarray(leader_list, dtype=np.int32),
+                   all_keys, all_cids, meta)
+    print(f"[done] in {time.time() - t0:.1f}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
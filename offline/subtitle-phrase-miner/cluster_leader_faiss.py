@@ -7,6 +7,12 @@ import numpy as np
 import faiss
 from tqdm import tqdm
 
+from cluster_state import save_full_state
+from knn_graph import (
+    assign_leader, check_graph_emb, create_graph, emb_fingerprint, finish_graph, graph_exists,
+    leader_clusters, open_graph,
+)
+
 
 def load_memmap(path: Path, dim: int, dtype="float16") -> np.memmap:
     # shape: (N, dim); N нужно вычислить по размеру файла
@@ -17,6 +23,66 @@ def load_memmap(path: Path, dim: int, dtype="float16") -> np.memmap:
     return arr
 
 
+def build_index(emb: np.memmap, chunk: int, hnsw_m: int, ef_construction: int):
+    """
+    HNSW по эмбеддингам: fp16 -> fp32 кусками по chunk строк,
+    без полной float32-копии массива в памяти.
+    """
+    n, d = emb.shape
+    print("[info] building FAISS index (HNSW)...", file=sys.stderr)
+    index = faiss.IndexHNSWFlat(d, hnsw_m, faiss.METRIC_INNER_PRODUCT)
+    index.hnsw.efConstruction = ef_construction
+    index.verbose = True
+
+    # Нормировка уже сделана при encode
+    for s in tqdm(range(0, n, chunk), desc="index add", unit="chunk"):
+        index.add(np.asarray(emb[s:s + chunk], dtype="float32"))
+    return index
+
+
+def search_graph(index, emb: np.memmap, k: int, batch: int, graph_dir: str, meta: dict):
+    """kNN всех точек батчами, прямо в memmap-граф на диске."""
+    n = emb.shape[0]
+    ids, sims = create_graph(graph_dir, n, k)
+    for s in tqdm(range(0, n, batch), desc="kNN graph", unit="batch"):
+        D, I = index.search(np.asarray(emb[s:s + batch], dtype="float32"), k)
+        sims[s:s + len(D)] = D
+        ids[s:s + len(I)] = I
+    finish_graph(graph_dir, ids, sims, meta)
+    print(f"[done] kNN graph saved to {graph_dir}", file=sys.stderr)
+
+
+def cluster_batched(index, emb: np.memmap, k: int, threshold: float, batch: int):
+    """
+    Leader-кластеризация без сохранённого графа: точки идут блоками по batch
+    подряд; все ещё не назначенные точки блока ищутся одним index.search,
+    затем блок разбирается по порядку с той же семантикой лидера, что
+    и поштучный цикл (точка, назначенная лидером раньше в этом же блоке,
+    лидером уже не становится).
+    """
+    n = emb.shape[0]
+    cluster_id = np.full(n, -1, dtype=np.int32)
+    current = 0
+    searches = 0
+
+    with tqdm(total=n, desc="clustering", unit="phr") as pbar:
+        for s in range(0, n, batch):
+            e = min(s + batch, n)
+            cand = s + np.flatnonzero(cluster_id[s:e] == -1)
+            if len(cand):
+                D, I = index.search(np.asarray(emb[cand], dtype="float32"), k)
+                searches += 1
+                for r, i in enumerate(cand.tolist()):
+                    if cluster_id[i] != -1:
+                        continue
+                    assign_leader(cluster_id, i, current, I[r], D[r], threshold)
+                    current += 1
+            pbar.update(e - s)
+
+    print(f"[info] {searches:,} batched FAISS searches", file=sys.stderr)
+    return cluster_id, current
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Leader clustering on BGE-M3 embeddings using FAISS (cosine)."
@@ -27,54 +93,54 @@ def main():
     parser.add_argument("--k", type=int, default=32, help="K nearest neighbors to check.")
     parser.add_argument("--threshold", type=float, default=0.92,
                         help="Cosine similarity threshold.")
-    parser.add_argument("--progress-interval", type=int, default=10000)
+    parser.add_argument("--batch-size", type=int, default=4096,
+                        help="Rows per batched FAISS search (and per fp16->fp32 chunk).")
+    parser.add_argument("--graph-dir", default=None,
+                        help="kNN graph directory: reused if it exists and was built from --emb "
+                             "(path, size, mtime; no index/search), otherwise the full graph "
+                             "is searched once and saved there.")
+    parser.add_argument("--state-dir", default=None,
+                        help="Save leader index + phrase -> cluster map for cluster_incremental.py "
+                             "(requires --meta).")
+    parser.add_argument("--meta", default=None,
+                        help="bge_m3_meta.tsv matching --emb (needed for --state-dir).")
+    parser.add_argument("--progress-interval", type=int, default=10000,
+                        help="Kept for compatibility: progress is shown per batch.")
     args = parser.parse_args()
+    if args.state_dir and not args.meta:
+        parser.error("--state-dir requires --meta")
 
     emb_path = Path(args.emb)
     emb = load_memmap(emb_path, args.dim, dtype="float16")
     n, d = emb.shape
 
-    # FAISS работает с float32
-    print("[info] building FAISS index (HNSW)...", file=sys.stderr)
-    index = faiss.IndexHNSWFlat(d, 32, faiss.METRIC_INNER_PRODUCT)
-    index.hnsw.efConstruction = 200
-    index.verbose = True
-
-    # Нормировка уже сделана при encode, но если сомневаемся, можно повторно
-    emb32 = np.array(emb, dtype="float32")
-    index.add(emb32)
-
-    print("[info] index built, starting leader clustering...", file=sys.stderr)
-
-    cluster_id = np.full(n, -1, dtype=np.int32)
-    current_cluster = 0
-
-    with tqdm(total=n, desc="clustering", unit="phr") as pbar:
-        for i in range(n):
-            if cluster_id[i] != -1:
-                pbar.update(1)
-                continue
-
-            # Новый кластер
-            cid = current_cluster
-            current_cluster += 1
-            cluster_id[i] = cid
-
-            # NN search
-            x = emb32[i : i + 1]
-            D, I = index.search(x, args.k)  # D: (1, k) similarities, I: (1, k) indices
-            sims = D[0]
-            neigh = I[0]
-
-            for sim, j in zip(sims[1:], neigh[1:]):  # [0] — это i само
-                if j < 0:
-                    continue
-                if sim < args.threshold:
-                    continue
-                if cluster_id[j] == -1:
-                    cluster_id[j] = cid
-
-            pbar.update(1)
+    if args.graph_dir and graph_exists(args.graph_dir):
+        ids, sims, meta = open_graph(args.graph_dir)
+        if meta["n"] != n or meta["k"] < args.k:
+            print(f"[error] graph {args.graph_dir} is {meta['n']:,} x {meta['k']}, "
+                  f"need {n:,} x >= {args.k}", file=sys.stderr)
+            sys.exit(1)
+        problem = check_graph_emb(meta, str(emb_path))
+        if problem:
+            print(f"[error] graph {args.graph_dir} was not built from {emb_path}: {problem}",
+                  file=sys.stderr)
+            sys.exit(1)
+        print("[info] leader clustering from saved kNN graph...", file=sys.stderr)
+        cluster_id, current_cluster = leader_clusters(ids, sims, args.threshold, k=args.k)
+    else:
+        index = build_index(emb, args.batch_size, hnsw_m=32, ef_construction=200)
+        print("[info] index built, starting leader clustering...", file=sys.stderr)
+
+        if args.graph_dir:
+            meta = {"n": n, "k": args.k, "dim": d, **emb_fingerprint(str(emb_path)),
+                    "hnsw_m": 32, "ef_construction": 200}
+            search_graph(index, emb, args.k, args.batch_size, args.graph_dir, meta)
+            ids, sims, _meta = open_graph(args.graph_dir)
+            cluster_id, current_cluster = leader_clusters(ids, sims, args.threshold)
+        else:
+            cluster_id, current_cluster = cluster_batched(
+                index, emb, args.k, args.threshold, args.batch_size
+            )
 
     print(f"[info] total clusters: {current_cluster:,}", file=sys.stderr)
 
@@ -82,6 +148,9 @@ def main():
     np.savetxt(out_path, cluster_id, fmt="%d")
     print(f"[done] cluster ids written to {out_path}", file=sys.stderr)
 
+    if args.state_dir:
+        save_full_state(args.state_dir, emb, args.meta, cluster_id, args.threshold)
+
 
 if __name__ == "__main__":
     main()
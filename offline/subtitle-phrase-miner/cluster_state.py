@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+cluster_state.py
+
+Состояние кластеризации для инкрементальных запусков (cluster_incremental.py):
+индекс лидеров кластеров и назначение фраз кластерам по ключу фразы
+(xxh3 нормализованного текста, как в embedding_cache.py). Номера кластеров
+не меняются между запусками: новые фразы присоединяются к существующим
+лидерам или открывают кластеры с номерами после последнего.
+
+Каталог состояния:
+
+    leaders.faiss     HNSW (inner product) по векторам лидеров
+    leader_cids.i32   cluster_id лидера на каждую позицию индекса
+    phrase_keys.u64   ключи всех когда-либо кластеризованных фраз (по возрастанию)
+    phrase_cids.i32   cluster_id для каждого ключа
+    meta.json         n_clusters, n_phrases, dim, threshold
+"""
+import json
+import os
+import sys
+from typing import Tuple
+
+import numpy as np
+import faiss
+from tqdm import tqdm
+
+from embedding_cache import phrase_keys
+
+INDEX_FILE = "leaders.faiss"
+LEADER_CIDS_FILE = "leader_cids.i32"
+KEYS_FILE = "phrase_keys.u64"
+CIDS_FILE = "phrase_cids.i32"
+META_FILE = "meta.json"
+
+
+def read_meta_phrases(meta_path: str) -> list:
+    """Фразы bge_m3_meta.tsv по row (row<TAB>phrase<TAB>freq<TAB>len)."""
+    phrases = []
+    with open(meta_path, "r", encoding="utf-8") as f:
+        for line in f:
+            parts = line.rstrip("\n").split("\t")
+            if len(parts) != 4:
+                continue
+            row = int(parts[0])
+            if row != len(phrases):
+                raise ValueError(f"{meta_path}: row {row} out of order")
+            phrases.append(parts[1])
+    return phrases
+
+
+def build_leader_index(emb: np.ndarray, rows: np.ndarray, dim: int,
+                       hnsw_m: int = 32, ef_construction: int = 200, chunk: int = 4096):
+    index = faiss.IndexHNSWFlat(dim, hnsw_m, faiss.METRIC_INNER_PRODUCT)
+    index.hnsw.efConstruction = ef_construction
+    for s in tqdm(range(0, len(rows), chunk), desc="leader index", unit="chunk"):
+        index.add(np.asarray(emb[rows[s:s + chunk]], dtype="float32"))
+    return index
+
+
+def save_state(state_dir: str, index, leader_cids: np.ndarray,
+               keys: np.ndarray, cids: np.ndarray, meta: dict):
+    """Записать состояние; meta.json — последним (через os.replace)."""
+    os.makedirs(state_dir, exist_ok=True)
+    order = np.argsort(keys, kind="stable")
+
+    def put(name, write):
+        tmp = os.path.join(state_dir, name + ".tmp")
+        write(tmp)
+        os.replace(tmp, os.path.join(state_dir, name))
+
+    put(INDEX_FILE, lambda p: faiss.write_index(index, p))
+    put(LEADER_CIDS_FILE, lambda p: leader_cids.astype(np.int32).tofile(p))
+    put(KEYS_FILE, lambda p: keys[order].astype(np.uint64).tofile(p))
+    put(CIDS_FILE, lambda p: cids[order].astype(np.int32).tofile(p))
+
+    def write_meta(p):
+        with open(p, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+    put(META_FILE, write_meta)
+    print(f"[done] cluster state saved to {state_dir}: {meta['n_clusters']:,} clusters, "
+          f"{meta['n_phrases']:,} phrases", file=sys.stderr)
+
+
+def save_full_state(state_dir: str, emb: np.ndarray, meta_path: str,
+                    cluster_id: np.ndarray, threshold: float):
+    """Состояние после полной кластеризации: лидер кластера — его первая строка."""
+    phrases = read_meta_phrases(meta_path)
+    if len(phrases) != len(cluster_id):
+        raise ValueError(f"meta has {len(phrases):,} rows, cluster ids {len(cluster_id):,}")
+    keys = phrase_keys(phrases)
+    del phrases
+
+    leader_cids, leader_rows = np.unique(cluster_id, return_index=True)
+    index = build_leader_index(emb, leader_rows, emb.shape[1])
+    meta = {"n_clusters": int(cluster_id.max()) + 1 if len(cluster_id) else 0,
+            "n_phrases": int(len(keys)), "dim": int(emb.shape[1]), "threshold": threshold}
+    save_state(state_dir, index, leader_cids, keys, cluster_id, meta)
+
+
+def open_state(state_dir: str) -> Tuple[object, np.ndarray, np.ndarray, np.ndarray, dict]:
+    with open(os.path.join(state_dir, META_FILE), "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    index = faiss.read_index(os.path.join(state_dir, INDEX_FILE))
+    leader_cids = np.fromfile(os.path.join(state_dir, LEADER_CIDS_FILE), dtype=np.int32)
+    keys = np.fromfile(os.path.join(state_dir, KEYS_FILE), dtype=np.uint64)
+    cids = np.fromfile(os.path.join(state_dir, CIDS_FILE), dtype=np.int32)
+    print(f"[info] cluster state {state_dir}: {meta['n_clusters']:,} clusters, "
+          f"{len(keys):,} phrases, {index.ntotal:,} leaders", file=sys.stderr)
+    return index, leader_cids, keys, cids, meta
+
+
+def lookup_keys(sorted_keys: np.ndarray, values: np.ndarray, keys: np.ndarray) -> np.ndarray:
+    """values[позиция ключа] для каждого ключа из keys, -1 — нет в состоянии."""
+    out = np.full(len(keys), -1, dtype=np.int64)
+    if len(sorted_keys) == 0:
+        return out
+    pos = np.minimum(np.searchsorted(sorted_keys, keys), len(sorted_keys) - 1)
+    hit = sorted_keys[pos] == keys
+    out[hit] = values[pos[hit]]
+    return out
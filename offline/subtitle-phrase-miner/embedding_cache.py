@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+embedding_cache.py
+
+Кэш эмбеддингов фраз по содержимому: ключ — xxh3_64 нормализованной фразы,
+значение — строка append-only fp16-матрицы. Повторный encode_bge_m3.py
+кодирует только фразы, которых ещё нет в кэше.
+
+Каталог кэша:
+
+    keys.u64       uint64 — ключ строки, в порядке добавления
+    vectors.f16    (n, dim) float16 — эмбеддинги, в том же порядке
+    meta.json      n, dim, model
+
+meta.json пишется последним: строки vectors.f16 за пределами n
+(прерванный запуск) при следующем добавлении перезаписываются.
+"""
+import json
+import os
+import sys
+import unicodedata
+from typing import List, Tuple
+
+import numpy as np
+import xxhash
+
+KEYS_FILE = "keys.u64"
+VECTORS_FILE = "vectors.f16"
+META_FILE = "meta.json"
+
+
+def normalize_phrase(phrase: str) -> str:
+    """NFC + схлопнутые пробелы; регистр не трогаем (фразы уже в lower после шага 1)."""
+    return " ".join(unicodedata.normalize("NFC", phrase).split())
+
+
+def phrase_keys(phrases: List[str]) -> np.ndarray:
+    return np.fromiter(
+        (xxhash.xxh3_64_intdigest(normalize_phrase(p).encode("utf-8")) for p in phrases),
+        dtype=np.uint64, count=len(phrases),
+    )
+
+
+class EmbeddingCache:
+    def __init__(self, cache_dir: str, model: str):
+        self.cache_dir = cache_dir
+        self.model = model
+        os.makedirs(cache_dir, exist_ok=True)
+
+        meta_path = os.path.join(cache_dir, META_FILE)
+        if os.path.exists(meta_path):
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta["model"] != model:
+                raise ValueError(f"cache {cache_dir} is for model {meta['model']!r}, not {model!r}")
+            self.n, self.dim = meta["n"], meta["dim"]
+        else:
+            self.n, self.dim = 0, None
+
+        if self.n:
+            self.keys = np.fromfile(os.path.join(cache_dir, KEYS_FILE), dtype=np.uint64, count=self.n)
+        else:
+            self.keys = np.zeros(0, dtype=np.uint64)
+        self._order = np.argsort(self.keys, kind="stable")
+        self._sorted = self.keys[self._order]
+        print(f"[info] embedding cache {cache_dir}: {self.n:,} rows", file=sys.stderr)
+
+    def lookup(self, keys: np.ndarray) -> np.ndarray:
+        """Строка кэша для каждого ключа, -1 — промах."""
+        pos = np.searchsorted(self._sorted, keys)
+        pos_c = np.minimum(pos, max(len(self._sorted) - 1, 0))
+        hit = (pos < len(self._sorted)) & (self._sorted[pos_c] == keys) if len(self._sorted) \
+            else np.zeros(len(keys), dtype=bool)
+        rows = np.full(len(keys), -1, dtype=np.int64)
+        rows[hit] = self._order[pos_c[hit]]
+        return rows
+
+    def vectors(self) -> np.memmap:
+        return np.memmap(os.path.join(self.cache_dir, VECTORS_FILE), dtype=np.float16,
+                         mode="r", shape=(self.n, self.dim))
+
+    def reserve(self, m: int, dim: int) -> np.memmap:
+        """
+        Место под m новых строк в конце vectors.f16 (memmap на запись).
+        Видимыми они станут только после commit().
+        """
+        if self.dim is None:
+            self.dim = dim
+        elif dim != self.dim:
+            raise ValueError(f"cache dim {self.dim} != encoder dim {dim}")
+        path = os.path.join(self.cache_dir, VECTORS_FILE)
+        row_bytes = self.dim * np.dtype(np.float16).itemsize
+        with open(path, "ab") as f:
+            f.truncate((self.n + m) * row_bytes)
+        return np.memmap(path, dtype=np.float16, mode="r+",
+                         offset=self.n * row_bytes, shape=(m, self.dim))
+
+    def commit(self, new_keys: np.ndarray, vectors: np.memmap):
+        """Дописать ключи зарезервированных строк и обновить meta.json."""
+        vectors.flush()
+        path = os.path.join(self.cache_dir, KEYS_FILE)
+        with open(path, "ab") as f:
+            f.truncate(self.n * 8)
+            f.write(np.ascontiguousarray(new_keys, dtype=np.uint64).tobytes())
+
+        self.keys = np.concatenate([self.keys, new_keys.astype(np.uint64)])
+        self.n = len(self.keys)
+        self._order = np.argsort(self.keys, kind="stable")
+        self._sorted = self.keys[self._order]
+
+        tmp = os.path.join(self.cache_dir, META_FILE + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"n": self.n, "dim": self.dim, "model": self.model}, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, os.path.join(self.cache_dir, META_FILE))
+
+
+def split_misses(cache: EmbeddingCache, phrases: List[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    keys, cache_rows (-1 — промах) и индексы фраз, которые надо закодировать:
+    по одной на каждый отсутствующий ключ (повторы внутри входа — один раз).
+    """
+    keys = phrase_keys(phrases)
+    rows = cache.lookup(keys)
+    miss = np.flatnonzero(rows < 0)
+    _, first = np.unique(keys[miss], return_index=True)
+    to_encode = np.sort(miss[first])
+    return keys, rows, to_encode
@@ -1,6 +1,11 @@
 #!/usr/bin/env python3
 import argparse
+import multiprocessing as mp
+import os
 import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 import numpy as np
@@ -8,6 +13,10 @@ import torch
 from sentence_transformers import SentenceTransformer
 from tqdm import tqdm
 
+from embedding_cache import EmbeddingCache, split_misses
+
+MODEL_NAME = "BAAI/bge-m3"
+
 
 def count_lines(path: Path, progress_step=1_000_000):
     total = 0
@@ -20,6 +29,217 @@ def count_lines(path: Path, progress_step=1_000_000):
     return total
 
 
+def parse_line(line: str):
+    """phrase<TAB>count -> (phrase, freq) или None для пустой/битой строки."""
+    line = line.rstrip("\n")
+    if not line:
+        return None
+    try:
+        phrase, count_str = line.rsplit("\t", 1)
+        return phrase, int(count_str)
+    except ValueError:
+        return None
+
+
+def read_phrases(path: Path, max_lines: int):
+    """Все фразы файла в памяти (для сортировки по длине); max_lines — по строкам файла."""
+    phrases, freqs = [], []
+    line_idx = 0
+    with path.open("r", encoding="utf-8", errors="ignore") as fin:
+        for line in fin:
+            if max_lines and line_idx >= max_lines:
+                break
+            line_idx += 1
+            parsed = parse_line(line)
+            if parsed is None:
+                continue
+            phrases.append(parsed[0])
+            freqs.append(parsed[1])
+    return phrases, freqs, line_idx
+
+
+# ---------------------------
+# CPU: пул процессов, в каждом своя копия модели
+# ---------------------------
+_cpu_model = None
+
+
+def init_cpu_worker(threads: int, quantize: bool):
+    """Инициализатор процесса: потоки BLAS/torch на процесс, модель на CPU, опц. int8."""
+    global _cpu_model
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(threads)
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass
+
+    model = SentenceTransformer(MODEL_NAME, device="cpu")
+    model.eval()
+    if quantize:
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    _cpu_model = model
+
+
+def encode_cpu_batch(rows: np.ndarray, texts):
+    with torch.inference_mode():
+        vectors = _cpu_model.encode(
+            texts,
+            batch_size=len(texts),
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+        ).astype("float16")
+    return rows, vectors
+
+
+def write_meta(meta_path: Path, phrases, freqs):
+    with meta_path.open("w", encoding="utf-8") as fmeta:
+        for row, (phr, fr) in enumerate(zip(phrases, freqs)):
+            fmeta.write(f"{row}\t{phr}\t{fr}\t{len(phr.split())}\n")
+
+
+def length_order(texts) -> np.ndarray:
+    """Индексы текстов по возрастанию длины: соседние батчи почти без паддинга."""
+    return np.argsort(np.fromiter((len(t) for t in texts), dtype=np.int64, count=len(texts)),
+                      kind="stable")
+
+
+def encode_texts_cpu(args, texts, open_out):
+    """
+    CPU: батчи — подряд идущие куски порядка по длине, кодируются пулом
+    процессов; вектор i-го текста пишется в open_out(dim)[i]
+    (размерность узнаём по первому батчу).
+    """
+    n = len(texts)
+    order = length_order(texts)
+
+    threads = max(1, args.cpu_threads)
+    workers = args.cpu_workers or max(1, (os.cpu_count() or 1) // threads)
+    print(f"[info] CPU encoding: {workers} workers x {threads} threads"
+          f"{', int8 dynamic quantization' if args.quantize else ''}", file=sys.stderr)
+
+    out = None
+    t0 = time.time()
+    max_inflight = 2 * workers
+    ctx = mp.get_context("spawn")
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx,
+                             initializer=init_cpu_worker,
+                             initargs=(threads, args.quantize)) as ex, \
+            tqdm(total=n, desc="encoding", unit="phr") as progress:
+        inflight = deque()
+
+        def take_head():
+            nonlocal out
+            rows, vectors = inflight.popleft().result()
+            if out is None:
+                print(f"[info] embedding dim = {vectors.shape[1]}", file=sys.stderr)
+                out = open_out(vectors.shape[1])
+            out[rows] = vectors
+            progress.update(len(rows))
+
+        for s in range(0, n, args.batch_size):
+            if len(inflight) >= max_inflight:
+                take_head()
+            rows = order[s:s + args.batch_size]
+            inflight.append(ex.submit(encode_cpu_batch, rows, [texts[r] for r in rows]))
+        while inflight:
+            take_head()
+
+    elapsed = time.time() - t0
+    print(f"[stats] {n / max(elapsed, 1e-9):,.1f} sentences/s ({elapsed:.1f}s)", file=sys.stderr)
+    return out
+
+
+def encode_texts_gpu(args, texts, open_out):
+    """GPU по списку текстов в памяти (для кэша): те же батчи по длине, fp16 autocast."""
+    n = len(texts)
+    order = length_order(texts)
+
+    print("[info] loading BGE-M3...", file=sys.stderr)
+    model = SentenceTransformer(MODEL_NAME)
+    model = model.to("cuda")
+    dim = model.get_sentence_embedding_dimension()
+    print(f"[info] embedding dim = {dim}", file=sys.stderr)
+    out = open_out(dim)
+
+    t0 = time.time()
+    with torch.autocast("cuda", dtype=torch.float16):
+        for s in tqdm(range(0, n, args.batch_size), desc="encoding", unit="batch"):
+            rows = order[s:s + args.batch_size]
+            out[rows] = model.encode(
+                [texts[r] for r in rows],
+                batch_size=len(rows),
+                convert_to_numpy=True,
+                normalize_embeddings=True,
+            ).astype("float16")
+
+    elapsed = time.time() - t0
+    print(f"[stats] {n / max(elapsed, 1e-9):,.1f} sentences/s ({elapsed:.1f}s)", file=sys.stderr)
+    return out
+
+
+def encode_cpu(args, in_path: Path, emb_path: Path, meta_path: Path):
+    """
+    CPU-режим: фразы читаются целиком, кодируются батчами по длине,
+    векторы пишутся в memmap по исходному row.
+    Строки meta и эмбеддингов совпадают с GPU-режимом.
+    """
+    phrases, freqs, line_idx = read_phrases(in_path, args.max_lines)
+    n = len(phrases)
+    print(f"[info] phrases: {n:,} (lines read: {line_idx:,})", file=sys.stderr)
+    write_meta(meta_path, phrases, freqs)
+
+    # memmap — ровно по числу фраз
+    emb = encode_texts_cpu(
+        args, phrases,
+        lambda dim: np.memmap(emb_path, dtype="float16", mode="w+", shape=(n, dim)),
+    )
+    if emb is not None:
+        emb.flush()
+        del emb
+    return n, line_idx
+
+
+def encode_cached(args, device: str, in_path: Path, emb_path: Path, meta_path: Path):
+    """
+    С кэшем (--cache-dir): кодируются только фразы, которых нет в кэше
+    (дописываются в него), выходные embeddings/meta собираются из кэша
+    в порядке входного файла — те же файлы, что без кэша.
+    """
+    phrases, freqs, line_idx = read_phrases(in_path, args.max_lines)
+    n = len(phrases)
+    print(f"[info] phrases: {n:,} (lines read: {line_idx:,})", file=sys.stderr)
+    write_meta(meta_path, phrases, freqs)
+
+    model_id = MODEL_NAME + ("+int8" if device == "cpu" and args.quantize else "")
+    cache = EmbeddingCache(args.cache_dir, model_id)
+    keys, rows, to_encode = split_misses(cache, phrases)
+    m = len(to_encode)
+    print(f"[info] cache hits: {int((rows >= 0).sum()):,}, phrases to encode: {m:,}",
+          file=sys.stderr)
+
+    if m:
+        encode_texts = encode_texts_cpu if device == "cpu" else encode_texts_gpu
+        new_vectors = encode_texts(args, [phrases[i] for i in to_encode],
+                                   lambda dim: cache.reserve(m, dim))
+        cache.commit(keys[to_encode], new_vectors)
+        del new_vectors
+        rows = cache.lookup(keys)
+
+    if n == 0:
+        return n, line_idx
+
+    vectors = cache.vectors()
+    emb = np.memmap(emb_path, dtype="float16", mode="w+", shape=(n, cache.dim))
+    for s in range(0, n, 65536):
+        emb[s:s + 65536] = vectors[rows[s:s + 65536]]
+    emb.flush()
+    del emb, vectors
+    return n, line_idx
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Encode phrases using BGE-M3 (1024-dim, fp16)"
@@ -28,12 +248,42 @@ def main():
     parser.add_argument("-d", "--out-dir", required=True)
     parser.add_argument("--batch-size", type=int, default=128)
     parser.add_argument("--max-lines", type=int, default=0)
+    parser.add_argument("--device", choices=["auto", "cuda", "cpu"], default="auto",
+                        help="auto: cuda if available, otherwise the CPU process pool.")
+    parser.add_argument("--cpu-workers", type=int, default=0,
+                        help="CPU mode: model replicas (processes); 0 = cpu_count // cpu-threads.")
+    parser.add_argument("--cpu-threads", type=int, default=4,
+                        help="CPU mode: torch/BLAS threads per process.")
+    parser.add_argument("--quantize", action="store_true",
+                        help="CPU mode: int8 dynamic quantization of Linear layers.")
+    parser.add_argument("--cache-dir", default=None,
+                        help="Embedding cache (xxhash of the normalized phrase -> fp16 row): "
+                             "only phrases missing from it are encoded and appended.")
     args = parser.parse_args()
 
     in_path = Path(args.input)
     out_dir = Path(args.out_dir)
     out_dir.mkdir(parents=True, exist_ok=True)
 
+    emb_path = out_dir / "bge_m3_embeddings.dat"
+    meta_path = out_dir / "bge_m3_meta.tsv"
+
+    device = args.device
+    if device == "auto":
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+    print(f"[info] device = {device}", file=sys.stderr)
+
+    if args.cache_dir or device == "cpu":
+        if args.cache_dir:
+            row, line_idx = encode_cached(args, device, in_path, emb_path, meta_path)
+        else:
+            row, line_idx = encode_cpu(args, in_path, emb_path, meta_path)
+        print(f"[done] embeddings saved to {emb_path}", file=sys.stderr)
+        print(f"[done] meta saved to      {meta_path}", file=sys.stderr)
+        print(f"[done] encoded rows:      {row:,}", file=sys.stderr)
+        print(f"[info] total lines read:  {line_idx:,}", file=sys.stderr)
+        return
+
     # ---------------------------
     # 1. Count phrases (по строкам файла)
     # ---------------------------
@@ -46,7 +296,7 @@ def main():
     # 2. Load model
     # ---------------------------
     print("[info] loading BGE-M3...", file=sys.stderr)
-    model = SentenceTransformer("BAAI/bge-m3")
+    model = SentenceTransformer(MODEL_NAME)
     model = model.to("cuda")
     dim = model.get_sentence_embedding_dimension()
     print(f"[info] embedding dim = {dim}", file=sys.stderr)
@@ -54,9 +304,6 @@ def main():
     # ---------------------------
     # 3. Prepare memmap
     # ---------------------------
-    emb_path = out_dir / "bge_m3_embeddings.dat"
-    meta_path = out_dir / "bge_m3_meta.tsv"
-
     # резервируем по числу строк файла (может оказаться чуть с запасом,
     # если какие-то строки будут пропущены)
     emb = np.memmap(
@@ -66,6 +313,7 @@ def main():
     # ---------------------------
     # 4. Streaming encoding FP16
     # ---------------------------
+    t0 = time.time()
     line_idx = 0          # сколько строк файла прочитали
     row = 0               # сколько фраз реально закодировали
     batch_texts = []
@@ -83,17 +331,12 @@ def main():
             line_idx += 1
             progress.update(1)
 
-            line = line.rstrip("\n")
-            if not line:
-                continue
-
-            # file is of format "phrase<TAB>count"
-            try:
-                phrase, count_str = line.rsplit("\t", 1)
-                freq = int(count_str)
-            except ValueError:
-                # битая строка — пропускаем, но line_idx уже учтён
+            # file is of format "phrase<TAB>count";
+            # битая строка — пропускаем, но line_idx уже учтён
+            parsed = parse_line(line)
+            if parsed is None:
                 continue
+            phrase, freq = parsed
 
             batch_texts.append(phrase)
             batch_meta.append((phrase, freq, len(phrase.split())))
@@ -134,6 +377,8 @@ def main():
         progress.close()
 
     del emb
+    elapsed = time.time() - t0
+    print(f"[stats] {row / max(elapsed, 1e-9):,.1f} sentences/s ({elapsed:.1f}s)", file=sys.stderr)
     print(f"[done] embeddings saved to {emb_path}", file=sys.stderr)
     print(f"[done] meta saved to      {meta_path}", file=sys.stderr)
     print(f"[done] encoded rows:      {row:,}", file=sys.stderr)
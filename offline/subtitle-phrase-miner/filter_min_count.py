@@ -1,6 +1,29 @@
 #!/usr/bin/env python3
 import argparse
+import os
 import sys
+from functools import partial
+from pathlib import Path
+from typing import Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "common"))
+from parallel_lines import filter_lines_parallel  # noqa: E402
+
+
+def keep_min_count(line: str, min_count: int) -> Optional[str]:
+    """Строка phrase<TAB>count, если count >= min_count, иначе None."""
+    if not line:
+        return None
+
+    # ожидаем формат: фраза<TAB>count
+    try:
+        phrase, count_str = line.rsplit("\t", 1)
+        count = int(count_str)
+    except ValueError:
+        # пропускаем повреждённые строки
+        return None
+
+    return line if count >= min_count else None
 
 
 def main():
@@ -24,43 +47,20 @@ def main():
         help="Минимальное количество вхождений. По умолчанию 5.",
     )
     parser.add_argument(
-        "--progress-interval",
+        "--workers",
         type=int,
-        default=1_000_000,
-        help="Как часто показывать прогресс по строкам.",
+        default=os.cpu_count() or 1,
+        help="Число процессов (файл режется на диапазоны байт). По умолчанию = числу CPU.",
     )
 
     args = parser.parse_args()
 
-    kept = 0
-    total = 0
-    next_progress = args.progress_interval
-
-    with open(args.input, "r", encoding="utf-8", errors="ignore") as fin, \
-         open(args.output, "w", encoding="utf-8") as fout:
-
-        for line in fin:
-            total += 1
-
-            if total >= next_progress:
-                print(f"[progress] processed {total:,} lines, kept {kept:,}", file=sys.stderr)
-                next_progress += args.progress_interval
-
-            line = line.rstrip("\n")
-            if not line:
-                continue
-
-            # ожидаем формат: фраза<TAB>count
-            try:
-                phrase, count_str = line.rsplit("\t", 1)
-                count = int(count_str)
-            except ValueError:
-                # пропускаем повреждённые строки
-                continue
-
-            if count >= args.min_count:
-                fout.write(line + "\n")
-                kept += 1
+    total, kept, _ = filter_lines_parallel(
+        args.input,
+        args.output,
+        partial(keep_min_count, min_count=args.min_count),
+        workers=args.workers,
+    )
 
     print(f"[done] total lines processed: {total:,}", file=sys.stderr)
     print(f"[done] kept phrases: {kept:,}", file=sys.stderr)
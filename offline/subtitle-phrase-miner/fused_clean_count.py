@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+fused_clean_count.py
+
+Шаги 1–4 майнера за один проход по сырому корпусу:
+
+    clean_phrases_step1 → step2_count_phrases → filter_min_count
+        → step3_word_freq → step4_filter_phrases_by_vocab
+
+Воркеры очищают строки (clean_line из clean_phrases_step1) и сразу
+считают частоты фраз в своём чанке; родитель сливает счётчики.
+Промежуточные файлы (очищенный корпус, частоты до/после min-count)
+не пишутся, если их не попросить явно. Хвост, min-count, частоты слов
+и фильтр по top-N словарю считаются в памяти по итоговому счётчику —
+с той же семантикой, что и отдельные скрипты:
+
+  --out-freq       = вывод step2_count_phrases.py (после обрезки хвоста)
+  --out-freq-min   = вывод filter_min_count.py
+  --out-words      = вывод step3_word_freq.py (по фразам после min-count)
+  --out-top-vocab  = вывод step4_filter_phrases_by_vocab.py
+
+При равных частотах порядок строк — по алфавиту (в отдельных скриптах
+он зависел от порядка завершения воркеров).
+"""
+import argparse
+import os
+import resource
+import sys
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+
+from clean_phrases_step1 import chunk_reader, clean_line
+
+
+def clean_and_count_chunk(lines: List[str], min_words: int, max_words: int) -> Counter:
+    """
+    Очистка чанка сырых строк и подсчёт частот получившихся фраз.
+    """
+    c = Counter()
+    for line in lines:
+        phrase = clean_line(line, min_words, max_words)
+        if phrase is not None:
+            c[phrase] += 1
+    return c
+
+
+def write_counts(path: str, items) -> int:
+    n = 0
+    with open(path, "w", encoding="utf-8") as fout:
+        for key, count in items:
+            fout.write(f"{key}\t{count}\n")
+            n += 1
+    return n
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Шаги 1–4 за один проход: очистка корпуса, частоты фраз, "
+            "min-count, частоты слов и фильтр по top-N словарю."
+        )
+    )
+    parser.add_argument(
+        "-i", "--input",
+        required=True,
+        help="Сырой корпус (одна реплика на строку), как для clean_phrases_step1.py.",
+    )
+    parser.add_argument("--out-freq", default=None,
+                        help="Частоты фраз после обрезки хвоста (как step2_count_phrases.py).")
+    parser.add_argument("--out-freq-min", default=None,
+                        help="Частоты фраз после --min-count (как filter_min_count.py).")
+    parser.add_argument("--out-words", default=None,
+                        help="Частоты слов word<TAB>count (как step3_word_freq.py).")
+    parser.add_argument("--out-top-vocab", default=None,
+                        help="Фразы из top-N слов (как step4_filter_phrases_by_vocab.py).")
+    parser.add_argument("--min-words", type=int, default=2,
+                        help="Мин. число слов в фразе (включительно). По умолчанию 2.")
+    parser.add_argument("--max-words", type=int, default=6,
+                        help="Макс. число слов в фразе (включительно). По умолчанию 6.")
+    parser.add_argument("--tail-percent", type=float, default=5.0,
+                        help="Процент самых редких типов фраз, которые удаляются. По умолчанию 5.0.")
+    parser.add_argument("--min-count", type=int, default=5,
+                        help="Минимальная частота фразы. По умолчанию 5.")
+    parser.add_argument("--top-n", type=int, default=5000,
+                        help="Размер словаря для --out-top-vocab. По умолчанию 5000.")
+    parser.add_argument("--chunk-size", type=int, default=100_000,
+                        help="Число строк в одном чанке. По умолчанию 100000.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Число процессов-воркеров. По умолчанию = числу CPU.")
+    parser.add_argument("--max-inflight", type=int, default=0,
+                        help="Макс. число чанков в обработке одновременно. По умолчанию 2 * workers.")
+    parser.add_argument("--progress-interval", type=int, default=1_000_000,
+                        help="Как часто показывать прогресс (по числу строк). По умолчанию 1_000_000.")
+    args = parser.parse_args()
+
+    if not (args.out_freq or args.out_freq_min or args.out_words or args.out_top_vocab):
+        parser.error("nothing to write: pass at least one of --out-freq/--out-freq-min/--out-words/--out-top-vocab")
+
+    max_inflight = args.max_inflight or 2 * args.workers
+    t0 = time.time()
+
+    # ---------------------------
+    # 1. Очистка + подсчёт фраз (один проход)
+    # ---------------------------
+    phrase_freq: Counter = Counter()
+    total_lines = 0
+    next_progress = args.progress_interval
+
+    print(f"[info] cleaning and counting {args.input}", file=sys.stderr)
+    print(f"[info] using {args.workers} workers, chunk_size={args.chunk_size}, "
+          f"max {max_inflight} chunks in flight", file=sys.stderr)
+
+    with open(args.input, "r", encoding="utf-8", errors="ignore") as fin, \
+         ProcessPoolExecutor(max_workers=args.workers) as ex:
+
+        inflight = deque()
+
+        def merge_head():
+            nonlocal total_lines, next_progress
+            fut, n_lines = inflight.popleft()
+            phrase_freq.update(fut.result())
+            total_lines += n_lines
+            if total_lines >= next_progress:
+                print(f"[progress] processed {total_lines:,} lines", file=sys.stderr)
+                next_progress += args.progress_interval
+
+        for chunk in chunk_reader(fin, args.chunk_size):
+            if len(inflight) >= max_inflight:
+                merge_head()
+            fut = ex.submit(clean_and_count_chunk, chunk, args.min_words, args.max_words)
+            inflight.append((fut, len(chunk)))
+
+        while inflight:
+            merge_head()
+
+    vocab_size = len(phrase_freq)
+    print(f"[info] total lines processed: {total_lines:,}", file=sys.stderr)
+    print(f"[info] phrase types before trimming: {vocab_size:,}", file=sys.stderr)
+
+    # ---------------------------
+    # 2. Хвост (step2) и min-count (filter_min_count)
+    # ---------------------------
+    items = sorted(phrase_freq.items(), key=lambda x: (-x[1], x[0]))
+    del phrase_freq
+
+    tail_percent = max(0.0, min(100.0, args.tail_percent))
+    if tail_percent > 0.0 and vocab_size > 0:
+        tail_n = int(vocab_size * (tail_percent / 100.0))
+        if tail_n > 0:
+            items = items[: vocab_size - tail_n]
+        print(f"[info] removed tail {tail_percent:.2f}% ({tail_n:,} phrase types), "
+              f"kept {len(items):,}", file=sys.stderr)
+
+    if args.out_freq:
+        n = write_counts(args.out_freq, items)
+        print(f"[done] written {n:,} phrases to {args.out_freq}", file=sys.stderr)
+
+    # список отсортирован по убыванию частоты — min-count это просто срез
+    keep = len(items)
+    while keep > 0 and items[keep - 1][1] < args.min_count:
+        keep -= 1
+    items = items[:keep]
+    print(f"[info] phrases with count >= {args.min_count}: {len(items):,}", file=sys.stderr)
+
+    if args.out_freq_min:
+        n = write_counts(args.out_freq_min, items)
+        print(f"[done] written {n:,} phrases to {args.out_freq_min}", file=sys.stderr)
+
+    # ---------------------------
+    # 3. Частоты слов (step3) и фильтр по словарю (step4)
+    # ---------------------------
+    if args.out_words or args.out_top_vocab:
+        word_freq: Counter = Counter()
+        for phrase, count in items:
+            for w in phrase.split():
+                word_freq[w] += count
+        words_sorted = sorted(word_freq.items(), key=lambda x: (-x[1], x[0]))
+        print(f"[info] word vocab size: {len(words_sorted):,}", file=sys.stderr)
+
+        if args.out_words:
+            n = write_counts(args.out_words, words_sorted)
+            print(f"[done] written {n:,} words to {args.out_words}", file=sys.stderr)
+
+        if args.out_top_vocab:
+            vocab = {w for w, _ in words_sorted[: args.top_n]}
+            kept = [(p, c) for p, c in items if all(w in vocab for w in p.split())]
+            n = write_counts(args.out_top_vocab, kept)
+            print(f"[done] written {n:,} phrases (top-{args.top_n} vocab) "
+                  f"to {args.out_top_vocab}", file=sys.stderr)
+
+    elapsed = max(time.time() - t0, 1e-9)
+    rss_main = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"[stats] elapsed: {elapsed:.1f}s, {total_lines / elapsed:,.0f} lines/s, "
+          f"peak RSS (main): {rss_main:,.0f} MB", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
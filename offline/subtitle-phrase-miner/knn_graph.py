@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+knn_graph.py
+
+Граф k ближайших соседей эмбеддингов на диске (memmap) и leader-кластеризация
+по нему — общие куски для cluster_leader_faiss.py и инструментов,
+которым нужен тот же граф без повторного поиска в FAISS.
+
+Каталог графа:
+
+    knn_ids.i32    (n, k) int32 — id соседей в порядке убывания сходства
+                   (столбец 0 — обычно сама точка; -1 — соседа нет)
+    knn_sims.f32   (n, k) float32 — косинусное сходство (inner product)
+    meta.json      n, k, dim, emb, emb_size, emb_mtime_ns, hnsw_m, ef_construction
+
+emb / emb_size / emb_mtime_ns — отпечаток файла эмбеддингов, по которому
+построен граф: граф по другому или перезаписанному файлу не используется.
+"""
+import json
+import os
+import sys
+from pathlib import Path
+from typing import Optional, Tuple
+
+import numpy as np
+
+IDS_FILE = "knn_ids.i32"
+SIMS_FILE = "knn_sims.f32"
+META_FILE = "meta.json"
+
+
+def emb_fingerprint(emb_path: str) -> dict:
+    """Путь, размер и mtime файла эмбеддингов для meta.json графа."""
+    path = Path(emb_path).resolve()
+    st = path.stat()
+    return {"emb": str(path), "emb_size": st.st_size, "emb_mtime_ns": st.st_mtime_ns}
+
+
+def check_graph_emb(meta: dict, emb_path: Optional[str] = None) -> Optional[str]:
+    """
+    Построен ли граф по этому файлу эмбеддингов (emb_path=None — по файлу
+    из meta.json, как он есть сейчас). None — да, иначе причина отказа.
+    """
+    if "emb_size" not in meta or "emb_mtime_ns" not in meta:
+        return "meta.json has no embedding size/mtime (graph from an older version), rebuild it"
+    path = emb_path or meta.get("emb")
+    if not path or not os.path.exists(path):
+        return f"embeddings {path} not found"
+    current = emb_fingerprint(path)
+    for key in ("emb", "emb_size", "emb_mtime_ns"):
+        if current[key] != meta.get(key):
+            return f"{key} differs: graph {meta.get(key)}, embeddings {current[key]}"
+    return None
+
+
+def graph_exists(graph_dir: str) -> bool:
+    return os.path.exists(os.path.join(graph_dir, META_FILE))
+
+
+def create_graph(graph_dir: str, n: int, k: int) -> Tuple[np.memmap, np.memmap]:
+    """Пустые memmap-массивы графа (n, k) для записи блоками."""
+    os.makedirs(graph_dir, exist_ok=True)
+    ids = np.memmap(os.path.join(graph_dir, IDS_FILE), dtype=np.int32, mode="w+", shape=(n, k))
+    sims = np.memmap(os.path.join(graph_dir, SIMS_FILE), dtype=np.float32, mode="w+", shape=(n, k))
+    return ids, sims
+
+
+def finish_graph(graph_dir: str, ids: np.memmap, sims: np.memmap, meta: dict):
+    """Сбросить массивы на диск и записать meta.json (граф считается готовым после него)."""
+    ids.flush()
+    sims.flush()
+    with open(os.path.join(graph_dir, META_FILE), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+
+
+def open_graph(graph_dir: str) -> Tuple[np.memmap, np.memmap, dict]:
+    with open(os.path.join(graph_dir, META_FILE), "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    n, k = meta["n"], meta["k"]
+    ids = np.memmap(os.path.join(graph_dir, IDS_FILE), dtype=np.int32, mode="r", shape=(n, k))
+    sims = np.memmap(os.path.join(graph_dir, SIMS_FILE), dtype=np.float32, mode="r", shape=(n, k))
+    print(f"[info] kNN graph {graph_dir}: {n:,} x {k}", file=sys.stderr)
+    return ids, sims, meta
+
+
+def assign_leader(cluster_id: np.ndarray, i: int, cid: int,
+                  neigh: np.ndarray, sims: np.ndarray, threshold: float):
+    """
+    Шаг leader-кластеризации: i — новый лидер cid, его ещё не назначенные
+    соседи со сходством >= threshold уходят в тот же кластер.
+    Столбец 0 (сама точка) пропускается, как в исходном цикле.
+    """
+    cluster_id[i] = cid
+    nb = neigh[1:][sims[1:] >= threshold]
+    nb = nb[nb >= 0]
+    nb = nb[cluster_id[nb] == -1]
+    cluster_id[nb] = cid
+
+
+def leader_clusters(ids: np.ndarray, sims: np.ndarray, threshold: float,
+                    k: int = 0, block: int = 65536) -> Tuple[np.ndarray, int]:
+    """
+    Leader-кластеризация по готовому графу: точки по порядку, каждая
+    не назначенная становится лидером. k > 0 — смотреть только первые k
+    соседей (столбцов). Возвращает (cluster_id, число кластеров).
+    """
+    n = ids.shape[0]
+    k = k or ids.shape[1]
+    cluster_id = np.full(n, -1, dtype=np.int32)
+    current = 0
+
+    for b0 in range(0, n, block):
+        b1 = min(b0 + block, n)
+        ids_b = np.asarray(ids[b0:b1, :k])
+        sims_b = np.asarray(sims[b0:b1, :k])
+        for r in range(b1 - b0):
+            i = b0 + r
+            if cluster_id[i] != -1:
+                continue
+            assign_leader(cluster_id, i, current, ids_b[r], sims_b[r], threshold)
+            current += 1
+
+    return cluster_id, current
+
+
+def connected_components(ids: np.ndarray, sims: np.ndarray, threshold: float,
+                         k: int = 0) -> Tuple[np.ndarray, int]:
+    """
+    Кластеры как компоненты связности графа рёбер со сходством >= threshold.
+    Номера кластеров — по порядку первой точки кластера, как у leader.
+    """
+    n = ids.shape[0]
+    k = k or ids.shape[1]
+    nb = np.asarray(ids[:, 1:k])
+    mask = (np.asarray(sims[:, 1:k]) >= threshold) & (nb >= 0)
+    u = np.repeat(np.arange(n, dtype=np.int32), mask.sum(axis=1))
+    v = nb[mask].astype(np.int32)
+    del nb, mask
+
+    return union_components(n, u, v)
+
+
+def union_components(n: int, u: np.ndarray, v: np.ndarray) -> Tuple[np.ndarray, int]:
+    """
+    Компоненты связности n точек по рёбрам (u[i], v[i]) — union-find
+    на NumPy: подвешивание корней к меньшему + сжатие путей.
+    Номера компонент — по порядку первой (минимальной) точки.
+    """
+    labels = np.arange(n, dtype=np.int32)
+    while len(u):
+        lu = labels[u]
+        lv = labels[v]
+        lo = np.minimum(lu, lv)
+        new = labels.copy()
+        np.minimum.at(new, lu, lo)
+        np.minimum.at(new, lv, lo)
+        # сжатие путей: каждую точку — сразу к корню
+        while True:
+            nxt = new[new]
+            if np.array_equal(nxt, new):
+                break
+            new = nxt
+        if np.array_equal(new, labels):
+            break
+        labels = new
+
+    # корень = минимальный индекс компоненты, unique сортирует по нему
+    _roots, cluster_id = np.unique(labels, return_inverse=True)
+    return cluster_id.astype(np.int32).reshape(-1), len(_roots)
@@ -1,10 +1,25 @@
 #!/usr/bin/env python3
+import argparse
 import os
 import psycopg2
+import struct
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+
+import numpy as np
 from dotenv import load_dotenv
 
+from phrase_index import (
+    phrase_word_rows,
+    read_phrase_table,
+    read_word_ids,
+    write_phrase_db_ids,
+    write_phrase_words,
+    write_phrases,
+)
+
 
 # =============================
 # 1. Load .env
@@ -38,6 +53,10 @@ FINAL_PHRASES_TSV = Path("data/final_phrases_top300k_qrestored.tsv")
 
 PHRASES_TSV       = Path("data/phrases_for_db.tsv")
 PHRASE_WORDS_TSV  = Path("data/phrase_words_for_db.tsv")
+# phrases с word_ids / word_positions — для --full --word-arrays
+PHRASES_ARRAYS_TSV = Path("data/phrases_arrays_for_db.tsv")
+# phrase_id файла -> id в БД после загрузки (для build_concordance / build_similar_index)
+PHRASE_IDS_TSV    = Path("data/phrase_ids_for_db.tsv")
 
 
 # =============================
@@ -67,6 +86,11 @@ CREATE TABLE IF NOT EXISTS phrase_words (
     PRIMARY KEY (phrase_id, word_id, position)
 );
 
+-- фраза, пропавшая из файла при дельта-загрузке: строка и её phrase_words
+-- остаются (на них опирается история и replay_word_state.py), а кандидатом
+-- фраза больше не бывает
+ALTER TABLE phrases ADD COLUMN IF NOT EXISTS retired_at TIMESTAMPTZ;
+
 CREATE INDEX IF NOT EXISTS idx_phrase_words_word   ON phrase_words (word_id);
 CREATE INDEX IF NOT EXISTS idx_phrase_words_phrase ON phrase_words (phrase_id);
 
@@ -110,6 +134,67 @@ CREATE INDEX IF NOT EXISTS idx_user_phrase_history_user_phrase
 """
 
 
+# Денормализованный вариант (--word-arrays): слова фразы массивом в самой
+# phrases (word_ids по порядку позиций, word_positions — их позиции) с
+# GIN-индексом; srs_logic.py с SRS_PHRASE_SCHEMA=arrays ищет кандидатов по
+# ним без соединения с phrase_words. При полной загрузке массивы идут в
+# COPY phrases из тех же строк, что и phrase_words (без UPDATE всей
+# таблицы), при дельте — строятся из phrase_words шагами ниже; в обоих
+# режимах совпадают с ней.
+
+SQL_WORD_ARRAYS_COLUMNS = """
+ALTER TABLE phrases ADD COLUMN IF NOT EXISTS word_ids INTEGER[];
+ALTER TABLE phrases ADD COLUMN IF NOT EXISTS word_positions SMALLINT[];
+"""
+
+SQL_HAS_WORD_ARRAYS = """
+SELECT EXISTS (
+    SELECT 1 FROM information_schema.columns
+    WHERE table_name = 'phrases' AND column_name = 'word_ids'
+);
+"""
+
+WORD_ARRAY_INDEXES = {
+    "idx_phrases_word_ids":
+        "CREATE INDEX IF NOT EXISTS idx_phrases_word_ids ON phrases USING GIN (word_ids);",
+    "idx_phrases_freq":
+        "CREATE INDEX IF NOT EXISTS idx_phrases_freq ON phrases (freq DESC, id);",
+}
+
+# индекс, оставшийся INVALID после прерванного CREATE INDEX CONCURRENTLY
+# (IF NOT EXISTS такой пропустил бы навсегда)
+SQL_INDEX_INVALID = """
+SELECT NOT i.indisvalid
+FROM pg_index i
+JOIN pg_class c ON c.oid = i.indexrelid
+WHERE c.relname = %s;
+"""
+
+WORD_ARRAY_STEPS = [
+    ("word arrays updated", """
+        UPDATE phrases p
+        SET word_ids = a.word_ids, word_positions = a.word_positions
+        FROM (
+            SELECT phrase_id,
+                   array_agg(word_id  ORDER BY position) AS word_ids,
+                   array_agg(position ORDER BY position) AS word_positions
+            FROM phrase_words
+            GROUP BY phrase_id
+        ) a
+        WHERE p.id = a.phrase_id
+          AND (p.word_ids, p.word_positions) IS DISTINCT FROM (a.word_ids, a.word_positions);
+    """),
+    # фразы без phrase_words (все слова вне словаря) кандидатами не бывают;
+    # у retired массивы остаются, их отсекает retired_at в запросах
+    ("word arrays cleared", """
+        UPDATE phrases p
+        SET word_ids = NULL, word_positions = NULL
+        WHERE p.word_ids IS NOT NULL
+          AND NOT EXISTS (SELECT 1 FROM phrase_words pw WHERE pw.phrase_id = p.id);
+    """),
+]
+
+
 # =============================
 # 4. Build phrases_for_db.tsv + phrase_words_for_db.tsv
 # =============================
@@ -125,52 +210,16 @@ def build_phrases_files():
 
     print(f"[INFO] Building {PHRASES_TSV} and {PHRASE_WORDS_TSV} ...")
 
-    # load word -> id mapping
-    word2id = {}
-    with WORDS_TSV.open("r", encoding="utf-8") as f:
-        header = f.readline()
-        for line in f:
-            wid_str, word, freq_str, rank_str = line.rstrip("\n").split("\t")
-            word2id[word] = int(wid_str)
-
-    pid = 0
-    total = 0
-
-    with FINAL_PHRASES_TSV.open("r", encoding="utf-8") as fin, \
-         PHRASES_TSV.open("w", encoding="utf-8") as fp, \
-         PHRASE_WORDS_TSV.open("w", encoding="utf-8") as fpw:
-
-        # header for phrases.tsv
-        fp.write("id\tphrase\tfreq\tcluster_size\tlength\n")
-
-        for line in fin:
-            total += 1
-            line = line.rstrip("\n")
-            if not line:
-                continue
-
-            parts = line.split("\t")
-            if len(parts) < 3:
-                continue
-
-            phrase       = parts[0]
-            freq         = int(parts[1])
-            cluster_size = int(parts[2])
-
-            words  = phrase.split()
-            length = len(words)
-
-            fp.write(f"{pid}\t{phrase}\t{freq}\t{cluster_size}\t{length}\n")
+    # тот же разбор, что в build_indices_for_srs.py; id слов — из words.tsv
+    table = read_phrase_table(str(FINAL_PHRASES_TSV))
+    word_ids = table.mapped_word_ids(read_word_ids(str(WORDS_TSV)))[table.tokens]
 
-            # записываем каждое вхождение слова с позицией
-            for pos, w in enumerate(words):
-                wid = word2id.get(w)
-                if wid is not None:
-                    fpw.write(f"{pid}\t{wid}\t{pos}\n")
+    write_phrases(str(PHRASES_TSV), table, id_column="id")
+    # каждое вхождение слова с позицией
+    rows = write_phrase_words(str(PHRASE_WORDS_TSV), table, word_ids, with_positions=True)
 
-            pid += 1
-
-    print(f"[INFO] Built {pid} phrases (from {total} lines).")
+    print(f"[INFO] Built {table.n} phrases, {rows} phrase-word rows.")
+    return table, word_ids
 
 
 # =============================
@@ -195,28 +244,378 @@ def copy_tsv(cur, table, file_path, columns, header=True):
 
 
 # =============================
-# 6. Main
+# 6. Bulk load (binary COPY, deferred indexes)
 # =============================
 
-def main():
-    print("[INFO] Connecting to PostgreSQL...")
-    try:
-        conn = psycopg2.connect(DB_DSN)
-    except Exception as e:
-        print("[ERROR] Could not connect:", e)
-        sys.exit(1)
+BINARY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+BINARY_TRAILER = struct.pack(">h", -1)
+# строк на один кодируемый блок binary COPY
+BINARY_BLOCK_ROWS = 65536
+COPY_READ_BYTES = 1 << 20
+
+# вторичные индексы и FK phrase_words: при полной загрузке снимаются
+# до COPY и строятся после (одним проходом вместо вставки по строке)
+DEFERRED_INDEXES = {
+    "idx_phrase_words_word":
+        "CREATE INDEX IF NOT EXISTS idx_phrase_words_word ON phrase_words (word_id);",
+    "idx_phrase_words_phrase":
+        "CREATE INDEX IF NOT EXISTS idx_phrase_words_phrase ON phrase_words (phrase_id);",
+}
+DEFERRED_FKEYS = {
+    "phrase_words_phrase_id_fkey": "FOREIGN KEY (phrase_id) REFERENCES phrases(id)",
+    "phrase_words_word_id_fkey": "FOREIGN KEY (word_id) REFERENCES words(id)",
+}
+
+
+class BinaryCopyReader:
+    """
+    Поток для COPY ... FROM STDIN WITH (FORMAT binary) из целочисленных
+    numpy-столбцов: columns — [(массив, тип '>i4' / '>i2'), ...].
+    Строки кодируются блоками через структурный dtype, без цикла по строкам.
+    """
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.n = len(columns[0][0]) if columns else 0
+        fields = [("n", ">i2")]
+        for i, (_, dt) in enumerate(columns):
+            fields += [(f"len{i}", ">i4"), (f"val{i}", dt)]
+        self.dtype = np.dtype(fields)
+        self.pos = 0
+        self.buf = BINARY_HEADER
+        self.done = False
+
+    def _block(self) -> bytes:
+        start, end = self.pos, min(self.pos + BINARY_BLOCK_ROWS, self.n)
+        rec = np.empty(end - start, dtype=self.dtype)
+        rec["n"] = len(self.columns)
+        for i, (col, dt) in enumerate(self.columns):
+            rec[f"len{i}"] = np.dtype(dt).itemsize
+            rec[f"val{i}"] = col[start:end]
+        self.pos = end
+        return rec.tobytes()
+
+    def read(self, size=-1):
+        while not self.done and (size < 0 or len(self.buf) < size):
+            if self.pos < self.n:
+                self.buf += self._block()
+            else:
+                self.buf += BINARY_TRAILER
+                self.done = True
+        if size < 0:
+            size = len(self.buf)
+        out, self.buf = self.buf[:size], self.buf[size:]
+        return out
+
+
+def copy_binary_parallel(table, columns_sql, columns, workers) -> int:
+    """
+    Binary COPY столбцов в table из нескольких соединений: строки делятся
+    на workers непрерывных диапазонов (по phrase_id, строки уже по нему
+    отсортированы), каждый диапазон — отдельное соединение и транзакция.
+    """
+    n = len(columns[0][0])
+    bounds = np.linspace(0, n, workers + 1).astype(np.int64).tolist()
+    sql = f"COPY {table} ({columns_sql}) FROM STDIN WITH (FORMAT binary);"
+
+    def run(start, end):
+        part = psycopg2.connect(DB_DSN)
+        try:
+            with part.cursor() as cur:
+                reader = BinaryCopyReader([(col[start:end], dt) for col, dt in columns])
+                cur.copy_expert(sql, reader, size=COPY_READ_BYTES)
+            part.commit()
+        finally:
+            part.close()
+        return end - start
+
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        return sum(ex.map(run, bounds[:-1], bounds[1:]))
+
+
+def report_rate(table, rows, seconds):
+    rate = rows / seconds if seconds > 0 else 0.0
+    print(f"[OK] {table:20s}: {rows:,} rows in {seconds:.1f}s ({rate:,.0f} rows/s)")
+
+
+SQL_EXISTING_FKEYS = """
+SELECT conname FROM pg_constraint
+WHERE conrelid = 'phrase_words'::regclass AND conname = ANY(%s);
+"""
 
-    print("[OK] Connected.")
-    cur = conn.cursor()
 
-    print("[INFO] Creating schema...")
-    cur.execute(SQL_CREATE_SCHEMA)
+def restore_fkeys(conn, cur):
+    """FK phrase_words, снятые прерванной полной загрузкой, — вернуть."""
+    cur.execute(SQL_EXISTING_FKEYS, (list(DEFERRED_FKEYS),))
+    existing = {r[0] for r in cur.fetchall()}
+    for name, definition in DEFERRED_FKEYS.items():
+        if name in existing:
+            continue
+        cur.execute(f"ALTER TABLE phrase_words ADD CONSTRAINT {name} {definition} NOT VALID;")
+        cur.execute(f"ALTER TABLE phrase_words VALIDATE CONSTRAINT {name};")
+        print(f"[INFO] Restored missing foreign key {name}.")
     conn.commit()
-    print("[OK] Schema ready.")
 
-    # build intermediate files
-    build_phrases_files()
 
+def drop_deferred(conn, cur, indexes):
+    for name in indexes:
+        cur.execute(f"DROP INDEX IF EXISTS {name};")
+    for name in DEFERRED_FKEYS:
+        cur.execute(f"ALTER TABLE phrase_words DROP CONSTRAINT IF EXISTS {name};")
+    conn.commit()
+
+
+def rebuild_deferred(workers, indexes):
+    """
+    Индексы строятся параллельно, каждый в своём соединении (обычный
+    CREATE INDEX берёт SHARE-блокировку, такие сборки друг другу не мешают;
+    CONCURRENTLY на одной таблице ждут друг друга до deadlock, а корпус при
+    полной загрузке и так недоступен). FK — NOT VALID + VALIDATE; затем ANALYZE.
+    """
+    def run(statements):
+        part = psycopg2.connect(DB_DSN)
+        part.autocommit = True
+        try:
+            with part.cursor() as cur:
+                for sql in statements:
+                    cur.execute(sql)
+        finally:
+            part.close()
+
+    t0 = time.time()
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(indexes)))) as ex:
+        list(ex.map(run, [[sql] for sql in indexes.values()]))
+    print(f"[OK] Indexes rebuilt in {time.time() - t0:.1f}s.")
+
+    t0 = time.time()
+    fkeys = []
+    for name, definition in DEFERRED_FKEYS.items():
+        fkeys.append(f"ALTER TABLE phrase_words ADD CONSTRAINT {name} {definition} NOT VALID;")
+        fkeys.append(f"ALTER TABLE phrase_words VALIDATE CONSTRAINT {name};")
+    run(fkeys + [f"ANALYZE {tbl};" for tbl in ("words", "phrases", "phrase_words")])
+    print(f"[OK] Foreign keys validated, tables analyzed in {time.time() - t0:.1f}s.")
+
+
+# =============================
+# 7. Delta load (staging + upsert)
+# =============================
+
+# Новые данные сначала копируются в staging-таблицы (временные, живут до
+# конца транзакции), затем сравниваются с текущими по тексту слова/фразы:
+# существующие строки сохраняют свои id (на них ссылаются user_word_state
+# и user_phrase_history), меняются только изменившиеся, новые получают
+# id после максимального. Всё — одна транзакция: до COMMIT приложение видит
+# старый корпус, после — новый целиком. Пользовательские таблицы не трогаются.
+
+SQL_CREATE_STAGING = """
+CREATE TEMP TABLE stage_words (
+    id          INTEGER,
+    word        TEXT,
+    total_freq  INTEGER,
+    rank        INTEGER
+) ON COMMIT DROP;
+
+CREATE TEMP TABLE stage_phrases (
+    id           INTEGER,
+    phrase       TEXT,
+    freq         INTEGER,
+    cluster_size INTEGER,
+    length       SMALLINT
+) ON COMMIT DROP;
+
+CREATE TEMP TABLE stage_phrase_words (
+    phrase_id  INTEGER,
+    word_id    INTEGER,
+    position   SMALLINT
+) ON COMMIT DROP;
+"""
+
+# индексы staging — после COPY, а не во время
+SQL_INDEX_STAGING = """
+CREATE INDEX ON stage_words (word);
+CREATE INDEX ON stage_phrases (id);
+ANALYZE stage_words;
+ANALYZE stage_phrases;
+ANALYZE stage_phrase_words;
+"""
+
+# (метка, SQL); rowcount шага с меткой печатается
+DELTA_STEPS = [
+    ("words updated", """
+        UPDATE words w
+        SET total_freq = s.total_freq, rank = s.rank
+        FROM stage_words s
+        WHERE w.word = s.word
+          AND (w.total_freq, w.rank) IS DISTINCT FROM (s.total_freq, s.rank);
+    """),
+    ("words inserted", """
+        INSERT INTO words (id, word, total_freq, rank)
+        SELECT (SELECT COALESCE(MAX(id), -1) FROM words)
+                   + ROW_NUMBER() OVER (ORDER BY s.rank, s.id),
+               s.word, s.total_freq, s.rank
+        FROM stage_words s
+        WHERE NOT EXISTS (SELECT 1 FROM words w WHERE w.word = s.word);
+    """),
+    ("word ids mapped", """
+        CREATE TEMP TABLE map_words ON COMMIT DROP AS
+        SELECT s.id AS file_id, w.id AS db_id
+        FROM stage_words s
+        JOIN words w ON w.word = s.word;
+    """),
+    # одинаковый текст может встречаться несколько раз: ключ фразы —
+    # (текст, номер повтора по возрастанию id)
+    ("phrase ids mapped", """
+        CREATE TEMP TABLE map_phrases ON COMMIT DROP AS
+        SELECT s.id AS file_id, d.id AS db_id
+        FROM (
+            SELECT id, phrase, ROW_NUMBER() OVER (PARTITION BY phrase ORDER BY id) AS dup
+            FROM stage_phrases
+        ) s
+        JOIN (
+            SELECT id, phrase, ROW_NUMBER() OVER (PARTITION BY phrase ORDER BY id) AS dup
+            FROM phrases
+        ) d ON d.phrase = s.phrase AND d.dup = s.dup;
+    """),
+    ("phrases updated", """
+        UPDATE phrases p
+        SET freq = s.freq, cluster_size = s.cluster_size, length = s.length
+        FROM stage_phrases s
+        JOIN map_phrases m ON m.file_id = s.id
+        WHERE p.id = m.db_id
+          AND (p.freq, p.cluster_size, p.length)
+              IS DISTINCT FROM (s.freq, s.cluster_size, s.length);
+    """),
+    ("phrases inserted", """
+        WITH fresh AS (
+            INSERT INTO map_phrases (file_id, db_id)
+            SELECT s.id,
+                   (SELECT COALESCE(MAX(id), -1) FROM phrases)
+                       + ROW_NUMBER() OVER (ORDER BY s.id)
+            FROM stage_phrases s
+            WHERE NOT EXISTS (SELECT 1 FROM map_phrases m WHERE m.file_id = s.id)
+            RETURNING file_id, db_id
+        )
+        INSERT INTO phrases (id, phrase, freq, cluster_size, length)
+        SELECT f.db_id, s.phrase, s.freq, s.cluster_size, s.length
+        FROM fresh f
+        JOIN stage_phrases s ON s.id = f.file_id;
+    """),
+    ("phrase_words staged", """
+        CREATE TEMP TABLE new_phrase_words ON COMMIT DROP AS
+        SELECT mp.db_id AS phrase_id, mw.db_id AS word_id, s.position
+        FROM stage_phrase_words s
+        JOIN map_phrases mp ON mp.file_id = s.phrase_id
+        JOIN map_words   mw ON mw.file_id = s.word_id;
+    """),
+    (None, """
+        CREATE INDEX ON new_phrase_words (phrase_id, word_id, position);
+        ANALYZE new_phrase_words;
+    """),
+    # фразы, которых нет в новом файле, остаются в phrases (на них может
+    # ссылаться история), но без phrase_words — кандидатами они больше не будут
+    # меняются только phrase_words фраз из файла; у retired они остаются как
+    # были (обычно words.tsv строится по тому же файлу, и у живой фразы
+    # строки phrase_words между загрузками не меняются)
+    ("phrase_words deleted", """
+        DELETE FROM phrase_words pw
+        WHERE EXISTS (SELECT 1 FROM map_phrases m WHERE m.db_id = pw.phrase_id)
+          AND NOT EXISTS (
+            SELECT 1 FROM new_phrase_words n
+            WHERE n.phrase_id = pw.phrase_id
+              AND n.word_id = pw.word_id
+              AND n.position = pw.position
+        );
+    """),
+    ("phrase_words inserted", """
+        INSERT INTO phrase_words (phrase_id, word_id, position)
+        SELECT n.phrase_id, n.word_id, n.position
+        FROM new_phrase_words n
+        WHERE NOT EXISTS (
+            SELECT 1 FROM phrase_words pw
+            WHERE pw.phrase_id = n.phrase_id
+              AND pw.word_id = n.word_id
+              AND pw.position = n.position
+        );
+    """),
+    ("phrases retired", """
+        UPDATE phrases p
+        SET retired_at = now()
+        WHERE p.retired_at IS NULL
+          AND NOT EXISTS (SELECT 1 FROM map_phrases m WHERE m.db_id = p.id);
+    """),
+    # фраза вернулась в файл — снова кандидат
+    ("phrases revived", """
+        UPDATE phrases p
+        SET retired_at = NULL
+        WHERE p.retired_at IS NOT NULL
+          AND EXISTS (SELECT 1 FROM map_phrases m WHERE m.db_id = p.id);
+    """),
+    ("words retired", """
+        SELECT COUNT(*) FROM words w
+        WHERE NOT EXISTS (SELECT 1 FROM map_words m WHERE m.db_id = w.id);
+    """),
+]
+
+
+def run_steps(cur, steps, tag):
+    """Выполнить (метка, SQL) по порядку; для шагов с меткой печатается rowcount."""
+    for label, sql in steps:
+        t1 = time.time()
+        cur.execute(sql)
+        if label is None:
+            continue
+        n = cur.fetchone()[0] if cur.description else cur.rowcount
+        print(f"{tag} {label:22s}: {n:,} ({time.time() - t1:.1f}s)")
+
+
+def load_delta(conn, cur, word_arrays):
+    """
+    Загрузить файлы через staging одной транзакцией (см. выше).
+    Возвращает (file_id, db_id) фраз — map_phrases живёт до COMMIT.
+    """
+    t0 = time.time()
+    cur.execute(SQL_CREATE_STAGING)
+    copy_tsv(cur, "stage_words", WORDS_TSV, "id, word, total_freq, rank", header=True)
+    copy_tsv(cur, "stage_phrases", PHRASES_TSV, "id, phrase, freq, cluster_size, length",
+             header=True)
+    copy_tsv(cur, "stage_phrase_words", PHRASE_WORDS_TSV, "phrase_id, word_id, position",
+             header=False)
+    cur.execute(SQL_INDEX_STAGING)
+    print(f"[OK] Staging loaded in {time.time() - t0:.1f}s.")
+
+    run_steps(cur, DELTA_STEPS, "[DELTA]")
+    if word_arrays:
+        run_steps(cur, WORD_ARRAY_STEPS, "[DELTA]")
+
+    cur.execute("SELECT file_id, db_id FROM map_phrases ORDER BY file_id;")
+    phrase_ids = np.array(cur.fetchall(), dtype=np.int64).reshape(-1, 2)
+
+    conn.commit()
+    print(f"[OK] Delta committed in {time.time() - t0:.1f}s.")
+
+    conn.autocommit = True
+    if word_arrays:
+        # первый раз индексы строятся без блокировки записи в phrases
+        for name, sql in WORD_ARRAY_INDEXES.items():
+            cur.execute(SQL_INDEX_INVALID, (name,))
+            row = cur.fetchone()
+            if row and row[0]:
+                print(f"[INFO] Index {name} is INVALID (interrupted build), recreating...")
+                cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name};")
+            cur.execute(sql.replace("CREATE INDEX", "CREATE INDEX CONCURRENTLY", 1))
+    # статистика планировщика — после замены данных
+    for tbl in ("words", "phrases", "phrase_words"):
+        cur.execute(f"ANALYZE {tbl};")
+    conn.autocommit = False
+    return phrase_ids[:, 0], phrase_ids[:, 1]
+
+
+def load_full(conn, cur, table, word_ids, workers, word_arrays):
+    """
+    Старый режим: TRUNCATE всего, включая прогресс пользователей, и COPY заново.
+    Вторичные индексы и FK phrase_words снимаются на время загрузки,
+    phrase_words идёт binary COPY в несколько соединений.
+    """
     # truncate all dependent tables safely
     print("[INFO] Truncating tables...")
     cur.execute("""
@@ -231,34 +630,128 @@ def main():
     conn.commit()
     print("[OK] Tables truncated.")
 
-    # load words
-    copy_tsv(
-        cur,
-        table="words",
-        file_path=WORDS_TSV,
-        columns="id, word, total_freq, rank",
-        header=True,
-    )
+    indexes = dict(DEFERRED_INDEXES)
+    if word_arrays:
+        indexes.update(WORD_ARRAY_INDEXES)
+    drop_deferred(conn, cur, indexes)
+    print("[OK] Secondary indexes and foreign keys of phrase_words dropped.")
 
-    # load phrases
-    copy_tsv(
-        cur,
-        table="phrases",
-        file_path=PHRASES_TSV,
-        columns="id, phrase, freq, cluster_size, length",
-        header=True,
-    )
+    # индексы и FK восстанавливаются и при ошибке: иначе phrase_words
+    # осталась бы без них (CREATE TABLE IF NOT EXISTS их не вернёт)
+    try:
+        # load words
+        t0 = time.time()
+        copy_tsv(
+            cur,
+            table="words",
+            file_path=WORDS_TSV,
+            columns="id, word, total_freq, rank",
+            header=True,
+        )
+        report_rate("words", cur.rowcount, time.time() - t0)
+
+        # load phrases; с --word-arrays массивы слов — сразу в COPY
+        t0 = time.time()
+        if word_arrays:
+            write_phrases(str(PHRASES_ARRAYS_TSV), table, id_column="id", word_ids=word_ids)
+        copy_tsv(
+            cur,
+            table="phrases",
+            file_path=PHRASES_ARRAYS_TSV if word_arrays else PHRASES_TSV,
+            columns="id, phrase, freq, cluster_size, length"
+                    + (", word_ids, word_positions" if word_arrays else ""),
+            header=True,
+        )
+        report_rate("phrases", cur.rowcount, time.time() - t0)
+        conn.commit()
+
+        # load phrase_words (3 колонки: phrase_id, word_id, position) — binary, параллельно
+        print(f"[LOAD] Importing into phrase_words (binary COPY, {workers} connections) ...")
+        t0 = time.time()
+        pid, wid, pos = phrase_word_rows(table, word_ids)
+        rows = copy_binary_parallel(
+            "phrase_words",
+            "phrase_id, word_id, position",
+            [(pid, ">i4"), (wid, ">i4"), (pos, ">i2")],
+            workers,
+        )
+        report_rate("phrase_words", rows, time.time() - t0)
+    except BaseException:
+        conn.rollback()
+        print("[ERROR] Full load failed: phrase_words may be partly loaded, "
+              "rerun load_corpus_to_db.py --full")
+        raise
+    finally:
+        rebuild_deferred(workers, indexes)
+
+    # полная загрузка: id в БД = phrase_id файла
+    ids = np.arange(table.n, dtype=np.int64)
+    return ids, ids
+
+
+# =============================
+# 8. Main
+# =============================
 
-    # load phrase_words (3 колонки: phrase_id, word_id, position)
-    copy_tsv(
-        cur,
-        table="phrase_words",
-        file_path=PHRASE_WORDS_TSV,
-        columns="phrase_id, word_id, position",
-        header=False,
+def main():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Загрузить корпус (words, phrases, phrase_words) в PostgreSQL. По умолчанию — "
+            "дельтой через staging-таблицы, без простоя и без потери прогресса пользователей."
+        )
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Полная перезагрузка: TRUNCATE корпуса И пользовательских таблиц "
+             "(user_word_state, user_phrase_history), затем COPY.",
     )
+    parser.add_argument(
+        "--copy-workers",
+        type=int,
+        default=4,
+        help="Соединений для binary COPY phrase_words и построения индексов (--full).",
+    )
+    parser.add_argument(
+        "--word-arrays",
+        action="store_true",
+        help="Заполнять phrases.word_ids / word_positions (+ GIN-индекс) для "
+             "SRS_PHRASE_SCHEMA=arrays. Если столбцы уже есть, поддерживаются и без флага.",
+    )
+    args = parser.parse_args()
 
+    print("[INFO] Connecting to PostgreSQL...")
+    try:
+        conn = psycopg2.connect(DB_DSN)
+    except Exception as e:
+        print("[ERROR] Could not connect:", e)
+        sys.exit(1)
+
+    print("[OK] Connected.")
+    cur = conn.cursor()
+
+    print("[INFO] Creating schema...")
+    cur.execute(SQL_CREATE_SCHEMA)
+    cur.execute(SQL_HAS_WORD_ARRAYS)
+    word_arrays = args.word_arrays or cur.fetchone()[0]
+    if word_arrays:
+        cur.execute(SQL_WORD_ARRAYS_COLUMNS)
     conn.commit()
+    restore_fkeys(conn, cur)
+    print("[OK] Schema ready." + (" (with phrases.word_ids)" if word_arrays else ""))
+
+    # build intermediate files
+    table, word_ids = build_phrases_files()
+
+    if args.full:
+        file_ids, db_ids = load_full(conn, cur, table, word_ids, args.copy_workers, word_arrays)
+    else:
+        file_ids, db_ids = load_delta(conn, cur, word_arrays)
+
+    # пишется только после COMMIT: индексы по id БД строятся по этому файлу
+    write_phrase_db_ids(str(PHRASE_IDS_TSV), file_ids, db_ids)
+    print(f"[OK] Phrase id map written to {PHRASE_IDS_TSV} "
+          f"({int((file_ids != db_ids).sum()):,} ids differ from file rows).")
 
     print("\n=== DATABASE STATISTICS ===")
     for tbl in ("words", "phrases", "phrase_words"):
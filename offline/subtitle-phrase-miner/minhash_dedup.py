@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+minhash_dedup.py
+
+CPU-замена encode_bge_m3.py + cluster_leader_faiss.py для поверхностных
+почти-дубликатов: MinHash по символьным шинглам, LSH по полосам,
+проверка пар по оценке Жаккара, компоненты связности.
+
+Выход — те же файлы, что читает aggregate_clusters.py:
+  --meta-out   row<TAB>phrase<TAB>freq<TAB>length (как bge_m3_meta.tsv)
+  --out        cluster_id на строку, по row
+"""
+import argparse
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
+
+import numpy as np
+
+from knn_graph import union_components
+
+# перестановки (a*h + b) mod 2**61-1: h < 2**32, a, b < 2**29 — в uint64 без переполнения
+PRIME = np.uint64((1 << 61) - 1)
+
+
+def read_phrases(path: str) -> Tuple[List[str], List[int]]:
+    """phrase<TAB>count, с тем же разбором, что в encode_bge_m3.py."""
+    phrases, freqs = [], []
+    with open(path, "r", encoding="utf-8", errors="ignore") as fin:
+        for line in fin:
+            line = line.rstrip("\n")
+            if not line:
+                continue
+            try:
+                phrase, count_str = line.rsplit("\t", 1)
+                freq = int(count_str)
+            except ValueError:
+                continue
+            phrases.append(phrase)
+            freqs.append(freq)
+    return phrases, freqs
+
+
+def make_perms(num_perm: int, seed: int) -> Tuple[np.ndarray, np.ndarray]:
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 1 << 29, size=num_perm, dtype=np.uint64)
+    b = rng.integers(0, 1 << 29, size=num_perm, dtype=np.uint64)
+    return a, b
+
+
+def minhash_chunk(phrases: List[str], shingle: int, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """
+    MinHash-сигнатуры (len(phrases), num_perm) uint32 для куска фраз.
+    Шинглы — окна по shingle символов строки " фраза " (короткие фразы
+    дают хотя бы один шингл); всё, кроме сборки строки, — векторно.
+    """
+    n = len(phrases)
+    texts = [" " + p + " " for p in phrases]
+    lens = np.fromiter((len(t) for t in texts), dtype=np.int64, count=n)
+    cps = np.frombuffer("".join(texts).encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+
+    # шингл начинается в позиции p фразы, если p + shingle <= len(фразы)
+    n_sh = np.maximum(lens - shingle + 1, 1)
+    starts = np.concatenate(([0], np.cumsum(lens)[:-1]))
+    sh_pos = np.repeat(starts, n_sh) + (np.arange(n_sh.sum()) - np.repeat(np.cumsum(n_sh) - n_sh, n_sh))
+
+    # полиномиальный хеш окна в uint32
+    h = np.zeros(len(sh_pos), dtype=np.uint64)
+    end = np.repeat(starts + lens, n_sh)
+    for j in range(shingle):
+        pos = sh_pos + j
+        c = np.where(pos < end, cps[np.minimum(pos, len(cps) - 1)], 0)
+        h = (h * np.uint64(1000003) + c) & np.uint64(0xFFFFFFFF)
+
+    sig = np.empty((n, len(a)), dtype=np.uint32)
+    group_starts = np.cumsum(n_sh) - n_sh
+    for p in range(len(a)):
+        hv = ((a[p] * h + b[p]) % PRIME) & np.uint64(0xFFFFFFFF)
+        sig[:, p] = np.minimum.reduceat(hv, group_starts).astype(np.uint32)
+    return sig
+
+
+def lsh_edges(sig: np.ndarray, bands: int, threshold: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Кандидатные пары из совпадающих полос (каждая строка корзины — с первой
+    строкой корзины), оставляются пары с оценкой Жаккара >= threshold.
+    """
+    n, num_perm = sig.shape
+    rows = num_perm // bands
+    us, vs = [], []
+    for band in range(bands):
+        part = sig[:, band * rows:(band + 1) * rows]
+        key = np.zeros(n, dtype=np.uint64)
+        for j in range(rows):
+            key = key * np.uint64(0x100000001B3) + part[:, j].astype(np.uint64)
+        order = np.argsort(key, kind="stable")
+        ks = key[order]
+        new_bucket = np.concatenate(([True], ks[1:] != ks[:-1]))
+        first = order[np.flatnonzero(new_bucket)][np.cumsum(new_bucket) - 1]
+        m = first != order
+        u, v = first[m], order[m]
+        if len(u) == 0:
+            continue
+        est = (sig[u] == sig[v]).mean(axis=1)
+        ok = est >= threshold
+        us.append(u[ok])
+        vs.append(v[ok])
+
+    if not us:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return np.concatenate(us), np.concatenate(vs)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Почти-дубликаты фраз на CPU: MinHash по символьным шинглам + LSH. "
+            "Пишет meta и cluster_ids.txt в формате для aggregate_clusters.py."
+        )
+    )
+    parser.add_argument("-i", "--input", required=True,
+                        help="Вход: phrase<TAB>count (как для encode_bge_m3.py).")
+    parser.add_argument("--meta-out", required=True,
+                        help="Выход: row<TAB>phrase<TAB>freq<TAB>length (как bge_m3_meta.tsv).")
+    parser.add_argument("--out", required=True, help="Выход: cluster_id на строку.")
+    parser.add_argument("--shingle", type=int, default=3, help="Длина символьного шингла. По умолчанию 3.")
+    parser.add_argument("--num-perm", type=int, default=64, help="Длина MinHash-сигнатуры. По умолчанию 64.")
+    parser.add_argument("--bands", type=int, default=16,
+                        help="Число LSH-полос (num_perm делится на bands). По умолчанию 16.")
+    parser.add_argument("--threshold", type=float, default=0.7,
+                        help="Мин. оценка Жаккара для склейки пары. По умолчанию 0.7.")
+    parser.add_argument("--chunk-size", type=int, default=20000, help="Фраз в одном задании воркера.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Число процессов для MinHash. По умолчанию = числу CPU.")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    if args.num_perm % args.bands:
+        parser.error("--num-perm must be divisible by --bands")
+
+    t0 = time.time()
+    phrases, freqs = read_phrases(args.input)
+    n = len(phrases)
+    print(f"[info] phrases: {n:,}", file=sys.stderr)
+
+    with open(args.meta_out, "w", encoding="utf-8") as fmeta:
+        for row, (phr, fr) in enumerate(zip(phrases, freqs)):
+            fmeta.write(f"{row}\t{phr}\t{fr}\t{len(phr.split())}\n")
+
+    # ---------------------------
+    # 1. MinHash-сигнатуры
+    # ---------------------------
+    a, b = make_perms(args.num_perm, args.seed)
+    sig = np.empty((n, args.num_perm), dtype=np.uint32)
+    max_inflight = 2 * args.workers
+
+    with ProcessPoolExecutor(max_workers=args.workers) as ex:
+        inflight = deque()
+
+        def take_head():
+            fut, s = inflight.popleft()
+            part = fut.result()
+            sig[s:s + len(part)] = part
+
+        for s in range(0, n, args.chunk_size):
+            if len(inflight) >= max_inflight:
+                take_head()
+            inflight.append((ex.submit(minhash_chunk, phrases[s:s + args.chunk_size],
+                                       args.shingle, a, b), s))
+        while inflight:
+            take_head()
+
+    t_sig = time.time() - t0
+    print(f"[info] signatures: {t_sig:.1f}s ({n / max(t_sig, 1e-9):,.0f} phrases/s)", file=sys.stderr)
+
+    # ---------------------------
+    # 2. LSH + компоненты связности
+    # ---------------------------
+    u, v = lsh_edges(sig, args.bands, args.threshold)
+    print(f"[info] near-duplicate pairs: {len(u):,}", file=sys.stderr)
+    cluster_id, n_clusters = union_components(n, u.astype(np.int32), v.astype(np.int32))
+
+    np.savetxt(args.out, cluster_id, fmt="%d")
+    print(f"[info] total clusters: {n_clusters:,}", file=sys.stderr)
+    print(f"[done] cluster ids written to {args.out} in {time.time() - t0:.1f}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
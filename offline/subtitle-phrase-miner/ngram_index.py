@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+import argparse
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "common"))
+from suffix_index import SuffixIndex, build_suffix_index  # noqa: E402
+
+
+def cmd_build(args):
+    build_suffix_index(args.store, args.index, depth=args.depth, lcp_max=args.lcp_max)
+
+
+def cmd_count(args):
+    idx = SuffixIndex(args.index)
+    phrases = args.phrase or [line.rstrip("\n") for line in sys.stdin]
+    for phrase in phrases:
+        if not phrase:
+            continue
+        occ, weighted = idx.count(phrase)
+        print(f"{phrase}\t{weighted if args.weighted else occ}")
+
+
+def cmd_dump(args):
+    idx = SuffixIndex(args.index)
+    rows = [
+        (idx.decode(ids), weighted if args.weighted else occ)
+        for ids, occ, weighted in idx.ngrams(args.n, args.min_count, args.weighted)
+    ]
+    rows.sort(key=lambda x: (-x[1], x[0]))
+
+    out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    try:
+        for phrase, c in rows:
+            out.write(f"{phrase}\t{c}\n")
+    finally:
+        if args.output:
+            out.close()
+    print(f"[done] {len(rows):,} {args.n}-grams with count >= {args.min_count}", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Суффиксный массив (с LCP) над хранилищем id слов: точные частоты "
+            "любой фразы по запросу вместо таблиц n-грамм."
+        )
+    )
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("build", help="Построить индекс по хранилищу tokenize_phrases.py.")
+    p.add_argument("--store", required=True, help="Каталог хранилища id слов.")
+    p.add_argument("--index", required=True, help="Каталог индекса.")
+    p.add_argument("--depth", type=int, default=0,
+                   help="Упорядочить суффиксы только по первым N словам (быстрее; "
+                        "запросы длиннее N не поддерживаются). 0 = полностью.")
+    p.add_argument("--lcp-max", type=int, default=32,
+                   help="Верхняя граница хранимого LCP (и n для dump). По умолчанию 32.")
+    p.set_defaults(func=cmd_build)
+
+    p = sub.add_parser("count", help="Частоты фраз (аргументы или по строке из stdin).")
+    p.add_argument("--index", required=True, help="Каталог индекса.")
+    p.add_argument("--weighted", action="store_true",
+                   help="Суммировать count строк хранилища (для файлов phrase<TAB>count).")
+    p.add_argument("phrase", nargs="*", help="Фразы; без аргументов читаются из stdin.")
+    p.set_defaults(func=cmd_count)
+
+    p = sub.add_parser("dump", help="Все n-граммы длины N с частотой >= --min-count.")
+    p.add_argument("--index", required=True, help="Каталог индекса.")
+    p.add_argument("-n", type=int, required=True, help="Длина n-граммы (в словах).")
+    p.add_argument("--min-count", type=int, default=1, help="Минимальная частота. По умолчанию 1.")
+    p.add_argument("--weighted", action="store_true",
+                   help="Суммировать count строк хранилища (для файлов phrase<TAB>count).")
+    p.add_argument("-o", "--output", default=None,
+                   help="Выход phrase<TAB>count по убыванию частоты (по умолчанию stdout).")
+    p.set_defaults(func=cmd_dump)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+phrase_index.py
+
+Один проход по финальному файлу фраз (phrase<TAB>freq<TAB>cluster_size)
+в память: тексты, freq, cluster_size и слова фраз как массив id
+(словарь по первому появлению слова). Из этого представления пишутся
+все варианты индекса — build_indices_for_srs.py и load_corpus_to_db.py
+используют один и тот же код.
+
+Строка файла — фраза, если в ней >= 3 полей и freq/cluster_size целые
+(остальные пропускаются); phrase_id — номер фразы среди таких строк,
+как id в БД.
+
+Файлы индекса:
+
+    words.tsv                word_id<TAB>word<TAB>total_freq<TAB>rank (с заголовком),
+                             word_id = rank - 1 по убыванию суммарной freq
+    phrases.tsv              phrase_id<TAB>phrase<TAB>freq<TAB>cluster_size<TAB>length
+    phrase_words.tsv         phrase_id<TAB>word_id на каждое вхождение (без заголовка)
+    phrase_words_pos.tsv     phrase_id<TAB>word_id<TAB>position (без заголовка)
+    phrase_word_ids.i32      word_id всех фраз подряд, -1 — слова нет в словаре
+    phrase_word_offsets.u64  начало фразы в phrase_word_ids.i32, n + 1 значений
+
+После дельта-загрузки id фраз в БД не равны phrase_id файла: соответствие
+load_corpus_to_db.py пишет в phrase_ids_for_db.tsv (file_id<TAB>db_id),
+по нему build_concordance.py / build_similar_index.py ключуют индексы id БД.
+"""
+import os
+import sys
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "common"))
+from parallel_lines import iter_range_lines, map_byte_ranges  # noqa: E402
+
+WORDS_FILE = "words.tsv"
+PHRASES_FILE = "phrases.tsv"
+PHRASE_WORDS_FILE = "phrase_words.tsv"
+PHRASE_WORDS_POS_FILE = "phrase_words_pos.tsv"
+WORD_IDS_FILE = "phrase_word_ids.i32"
+WORD_OFFSETS_FILE = "phrase_word_offsets.u64"
+
+# строк phrase_words на одну запись в файл
+WRITE_ROWS = 1_000_000
+
+
+def parse_final_line(line: str) -> Optional[Tuple[str, int, int]]:
+    """(phrase, freq, cluster_size) или None."""
+    parts = line.split("\t")
+    if len(parts) < 3:
+        return None
+    try:
+        return parts[0], int(parts[1]), int(parts[2])
+    except ValueError:
+        return None
+
+
+def _read_range(path: str, start: int, end: int):
+    """Фразы диапазона [start, end) с локальным словарём."""
+    vocab: Dict[str, int] = {}
+    words: List[str] = []
+    phrases: List[str] = []
+    freqs: List[int] = []
+    sizes: List[int] = []
+    tokens: List[int] = []
+    lengths: List[int] = []
+
+    for line in iter_range_lines(path, start, end):
+        parsed = parse_final_line(line)
+        if parsed is None:
+            continue
+        phrase, freq, size = parsed
+        n = 0
+        for w in phrase.split():
+            tid = vocab.get(w)
+            if tid is None:
+                tid = len(words)
+                vocab[w] = tid
+                words.append(w)
+            tokens.append(tid)
+            n += 1
+        phrases.append(phrase)
+        freqs.append(freq)
+        sizes.append(size)
+        lengths.append(n)
+
+    return (phrases, np.asarray(freqs, dtype=np.int64), np.asarray(sizes, dtype=np.int64),
+            words, np.asarray(tokens, dtype=np.uint32), np.asarray(lengths, dtype=np.int64))
+
+
+class PhraseTable:
+    """
+    Фразы файла в памяти: phrases[i], freqs[i], sizes[i];
+    слова фразы i — vocab[tokens[offsets[i]:offsets[i + 1]]].
+    """
+
+    def __init__(self, phrases: List[str], freqs: np.ndarray, sizes: np.ndarray,
+                 vocab: List[str], tokens: np.ndarray, offsets: np.ndarray):
+        self.phrases = phrases
+        self.freqs = freqs
+        self.sizes = sizes
+        self.vocab = vocab
+        self.tokens = tokens
+        self.offsets = offsets
+
+    @property
+    def n(self) -> int:
+        return len(self.phrases)
+
+    @property
+    def lengths(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    def word_totals(self) -> np.ndarray:
+        """Суммарная freq фраз с каждым словом (по вхождениям), по id словаря."""
+        weights = np.repeat(self.freqs, self.lengths).astype(np.float64)
+        totals = np.bincount(self.tokens, weights=weights, minlength=len(self.vocab))
+        return np.rint(totals).astype(np.int64)
+
+    def ranked_word_ids(self, totals: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        (order, wid_of): order — id словаря по убыванию totals (при равенстве —
+        по первому появлению, как устойчивая сортировка), wid_of[id] = rank - 1.
+        """
+        order = np.argsort(-totals, kind="stable")
+        wid_of = np.empty(len(order), dtype=np.int64)
+        wid_of[order] = np.arange(len(order))
+        return order, wid_of
+
+    def mapped_word_ids(self, word2id: Dict[str, int]) -> np.ndarray:
+        """wid_of[id] по внешнему словарю (words.tsv), -1 — слова в нём нет."""
+        return np.array([word2id.get(w, -1) for w in self.vocab], dtype=np.int64)
+
+
+def read_phrase_table(path: str, workers: int = 1) -> PhraseTable:
+    """
+    Прочитать файл фраз. Диапазоны читаются параллельно с локальными
+    словарями и склеиваются по порядку — id слов те же, что при
+    последовательном чтении.
+    """
+    if workers > 1:
+        results = map_byte_ranges(path, _read_range, workers)
+    elif os.path.getsize(path):
+        results = [_read_range(path, 0, os.path.getsize(path))]
+    else:
+        results = []
+
+    word2id: Dict[str, int] = {}
+    vocab: List[str] = []
+    phrases: List[str] = []
+    freqs, sizes, tokens, lengths = [], [], [], []
+    for r_phrases, r_freqs, r_sizes, r_words, r_tokens, r_lengths in results:
+        remap = np.empty(len(r_words), dtype=np.uint32)
+        for i, w in enumerate(r_words):
+            gid = word2id.get(w)
+            if gid is None:
+                gid = len(vocab)
+                word2id[w] = gid
+                vocab.append(w)
+            remap[i] = gid
+        phrases.extend(r_phrases)
+        freqs.append(r_freqs)
+        sizes.append(r_sizes)
+        tokens.append(remap[r_tokens])
+        lengths.append(r_lengths)
+
+    def cat(arrays, dtype):
+        return np.concatenate(arrays).astype(dtype) if arrays else np.zeros(0, dtype=dtype)
+
+    offsets = np.zeros(len(phrases) + 1, dtype=np.int64)
+    np.cumsum(cat(lengths, np.int64), out=offsets[1:])
+    return PhraseTable(phrases, cat(freqs, np.int64), cat(sizes, np.int64),
+                       vocab, cat(tokens, np.uint32), offsets)
+
+
+def read_word_ids(words_path: str) -> Dict[str, int]:
+    """word -> word_id из words.tsv."""
+    word2id = {}
+    with open(words_path, "r", encoding="utf-8") as f:
+        f.readline()
+        for line in f:
+            parts = line.rstrip("\n").split("\t")
+            if len(parts) < 2:
+                continue
+            word2id[parts[1]] = int(parts[0])
+    return word2id
+
+
+def write_words(path: str, table: PhraseTable, totals: np.ndarray, order: np.ndarray):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("word_id\tword\ttotal_freq\trank\n")
+        tot = totals.tolist()
+        for rank, tid in enumerate(order.tolist(), start=1):
+            f.write(f"{rank - 1}\t{table.vocab[tid]}\t{tot[tid]}\t{rank}\n")
+
+
+def write_phrases(path: str, table: PhraseTable, id_column: str = "phrase_id",
+                  word_ids: Optional[np.ndarray] = None):
+    """
+    phrases.tsv; в файле для БД столбец id называется id. С word_ids (wid на
+    каждый токен) — ещё word_ids / word_positions литералами массивов
+    PostgreSQL по phrase_word_rows; пусто (NULL в COPY csv), если слов нет.
+    """
+    with open(path, "w", encoding="utf-8") as f:
+        header = f"{id_column}\tphrase\tfreq\tcluster_size\tlength"
+        f.write(header + ("\tword_ids\tword_positions\n" if word_ids is not None else "\n"))
+        rows = zip(table.phrases, table.freqs.tolist(), table.sizes.tolist(),
+                   table.lengths.tolist())
+        if word_ids is None:
+            for pid, (phrase, freq, size, length) in enumerate(rows):
+                f.write(f"{pid}\t{phrase}\t{freq}\t{size}\t{length}\n")
+            return
+
+        pid_rows, wid, pos = phrase_word_rows(table, word_ids)
+        bounds = np.searchsorted(pid_rows, np.arange(table.n + 1)).tolist()
+        wid, pos = wid.tolist(), pos.tolist()
+        for pid, (phrase, freq, size, length) in enumerate(rows):
+            s, e = bounds[pid], bounds[pid + 1]
+            arrays = (f"{{{','.join(map(str, wid[s:e]))}}}\t{{{','.join(map(str, pos[s:e]))}}}"
+                      if e > s else "\t")
+            f.write(f"{pid}\t{phrase}\t{freq}\t{size}\t{length}\t{arrays}\n")
+
+
+def phrase_word_rows(table: PhraseTable, word_ids: np.ndarray) -> Tuple[np.ndarray, ...]:
+    """
+    (phrase_id, word_id, position) на каждое вхождение слова, по порядку фраз
+    (word_ids — wid на каждый токен); слова вне словаря (-1) пропускаются,
+    позиция остаётся позицией в фразе.
+    """
+    lengths = table.lengths
+    pid = np.repeat(np.arange(table.n, dtype=np.int64), lengths)
+    pos = np.arange(len(word_ids), dtype=np.int64) - np.repeat(table.offsets[:-1], lengths)
+    keep = np.flatnonzero(word_ids >= 0)
+    return pid[keep], word_ids[keep], pos[keep]
+
+
+def write_phrase_words(path: str, table: PhraseTable, word_ids: np.ndarray,
+                       with_positions: bool = False) -> int:
+    """Пары фраза-слово (phrase_word_rows) в TSV. Возвращает число строк."""
+    pid, wid, pos = phrase_word_rows(table, word_ids)
+    with open(path, "w", encoding="utf-8") as f:
+        for s in range(0, len(pid), WRITE_ROWS):
+            e = s + WRITE_ROWS
+            if with_positions:
+                rows = zip(pid[s:e].tolist(), wid[s:e].tolist(), pos[s:e].tolist())
+                f.write("".join(f"{p}\t{w}\t{k}\n" for p, w, k in rows))
+            else:
+                rows = zip(pid[s:e].tolist(), wid[s:e].tolist())
+                f.write("".join(f"{p}\t{w}\n" for p, w in rows))
+    return len(pid)
+
+
+def write_word_arrays(out_dir: str, table: PhraseTable, word_ids: np.ndarray):
+    """Двоичный вариант phrase_words: CSR (ids + offsets)."""
+    word_ids.astype(np.int32).tofile(os.path.join(out_dir, WORD_IDS_FILE))
+    table.offsets.astype(np.uint64).tofile(os.path.join(out_dir, WORD_OFFSETS_FILE))
+
+
+def write_phrase_db_ids(path: str, file_ids: np.ndarray, db_ids: np.ndarray):
+    """Соответствие phrase_id файла -> id в БД (file_id<TAB>db_id, с заголовком)."""
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write("file_id\tdb_id\n")
+        for s in range(0, len(file_ids), WRITE_ROWS):
+            rows = zip(file_ids[s:s + WRITE_ROWS].tolist(), db_ids[s:s + WRITE_ROWS].tolist())
+            f.write("".join(f"{a}\t{b}\n" for a, b in rows))
+    os.replace(tmp, path)
+
+
+def read_phrase_db_ids(path: str, n: int) -> np.ndarray:
+    """
+    db_id для каждой из n фраз файла. ValueError, если соответствие не от
+    этого файла (не все phrase_id 0..n-1 или повторяющиеся id БД).
+    """
+    pairs = np.loadtxt(path, dtype=np.int64, delimiter="\t", skiprows=1, ndmin=2)
+    file_ids, db_ids = pairs[:, 0], pairs[:, 1]
+    if len(file_ids) != n or not np.array_equal(np.sort(file_ids), np.arange(n)):
+        raise ValueError(f"{path}: {len(file_ids):,} rows do not cover phrase_id 0..{n - 1}")
+    if len(np.unique(db_ids)) != n or (n and db_ids.min() < 0):
+        raise ValueError(f"{path}: db_id values are not unique non-negative ids")
+    out = np.empty(n, dtype=np.int64)
+    out[file_ids] = db_ids
+    return out
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+from tqdm import tqdm
+
+from knn_graph import create_graph, emb_fingerprint, finish_graph
+from vector_codes import (
+    assign_lists, create_codes, decode_block, encode_block, finish_codes, kmeans,
+    open_codes, probe_lists, search_codes, train_int8, train_pq,
+)
+
+
+def open_embeddings(path: str, dim: int) -> np.memmap:
+    n = Path(path).stat().st_size // (2 * dim)
+    print(f"[info] memmap: {n:,} x {dim} (float16)", file=sys.stderr)
+    return np.memmap(path, mode="r", dtype="float16", shape=(n, dim))
+
+
+def sample_rows(n: int, size: int, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    return np.sort(rng.choice(n, size=min(size, n), replace=False))
+
+
+def cmd_encode(args):
+    emb = open_embeddings(args.emb, args.dim)
+    n, d = emb.shape
+    t0 = time.time()
+
+    train = np.asarray(emb[sample_rows(n, args.train_size, args.seed)], dtype=np.float32)
+    print(f"[info] training {args.kind} on {len(train):,} vectors...", file=sys.stderr)
+    if args.kind == "int8":
+        codebook = train_int8(train)
+    else:
+        codebook = train_pq(train, args.m, iters=args.iters, seed=args.seed)
+    del train
+
+    codes = create_codes(args.codes, n, d, args.kind, codebook)
+    for s in tqdm(range(0, n, args.batch_size), desc="encode", unit="batch"):
+        codes[s:s + args.batch_size] = encode_block(
+            np.asarray(emb[s:s + args.batch_size], dtype=np.float32), args.kind, codebook
+        )
+    meta = {"n": n, "dim": d, "kind": args.kind, "m": args.m if args.kind == "pq" else d,
+            **emb_fingerprint(args.emb)}
+    finish_codes(args.codes, codes, meta)
+
+    code_bytes = codes.shape[1] * codes.itemsize
+    print(f"[stats] {code_bytes} B/vector: fp16 / {2 * d / code_bytes:.1f}, "
+          f"fp32 / {4 * d / code_bytes:.1f}", file=sys.stderr)
+    print(f"[done] codes written to {args.codes} in {time.time() - t0:.1f}s", file=sys.stderr)
+
+
+def cmd_recall(args):
+    codes, codebook, meta = open_codes(args.codes)
+    emb = open_embeddings(args.emb, meta["dim"])
+    if len(emb) != meta["n"]:
+        print(f"[error] codes have {meta['n']:,} rows, embeddings {len(emb):,}", file=sys.stderr)
+        sys.exit(1)
+
+    q_rows = sample_rows(meta["n"], args.queries, args.seed)
+    queries = np.asarray(emb[q_rows], dtype=np.float32)
+
+    t0 = time.time()
+    _s, exact = search_codes(emb, "fp16", None, queries, args.k, block=args.batch_size)
+    t_exact = time.time() - t0
+    t0 = time.time()
+    _s, approx = search_codes(codes, meta["kind"], codebook, queries, args.k, block=args.batch_size)
+    t_codes = time.time() - t0
+
+    hits = [len(np.intersect1d(a, b)) for a, b in zip(exact, approx)]
+    recall = float(np.mean(hits)) / args.k
+    top1 = float(np.mean(exact[:, 0] == approx[:, 0]))
+    code_bytes = codes.shape[1] * codes.itemsize
+    print(f"{meta['kind']}  B/vector={code_bytes}  fp16/{2 * meta['dim'] / code_bytes:.1f}  "
+          f"recall@{args.k}={recall:.4f}  top1={top1:.4f}  "
+          f"queries={len(queries):,}  search fp16={t_exact:.1f}s codes={t_codes:.1f}s")
+
+
+def cmd_graph(args):
+    """
+    kNN-граф (формат knn_graph.py) по кодам через грубый индекс IVF: дальше
+    sweep_cluster_thresholds.py / cluster_leader_faiss.py --graph-dir.
+    Запросы списка ищут по его --nprobe ближайшим спискам (ADC для pq),
+    это примерно n * nprobe * n / nlist сравнений вместо n^2.
+    Столбец 0 — сама точка, как в графе из FAISS; не найденные соседи — -1.
+    """
+    codes, codebook, meta = open_codes(args.codes)
+    n, kind = meta["n"], meta["kind"]
+    t0 = time.time()
+
+    nlist = args.nlist or int(np.sqrt(n))
+    nlist = max(1, min(nlist, n, args.train_size // 16))
+    train = decode_block(np.asarray(codes[sample_rows(n, args.train_size, args.seed)]), kind, codebook)
+    print(f"[info] IVF: training {nlist:,} lists on {len(train):,} vectors, "
+          f"nprobe={args.nprobe}", file=sys.stderr)
+    centroids = kmeans(train, nlist, args.iters, args.seed)
+    del train
+    lists = assign_lists(codes, kind, codebook, centroids, block=args.batch_size)
+    order = np.argsort(lists, kind="stable")
+    bounds = np.searchsorted(lists[order], np.arange(nlist + 1))
+    probes = probe_lists(centroids, args.nprobe)
+
+    ids, sims = create_graph(args.graph_dir, n, args.k)
+    scanned = 0
+    for lst in tqdm(range(nlist), desc="kNN graph (IVF codes)", unit="list"):
+        members = order[bounds[lst]:bounds[lst + 1]]
+        if not len(members):
+            continue
+        cand = np.sort(np.concatenate([order[bounds[p]:bounds[p + 1]] for p in probes[lst]]))
+        scanned += len(members) * len(cand)
+
+        for s in range(0, len(members), args.query_batch):
+            rows = members[s:s + args.query_batch]
+            q = decode_block(np.asarray(codes[rows]), kind, codebook)
+            best_s, best_i = search_codes(codes, kind, codebook, q, args.k,
+                                          block=args.batch_size, rows=cand)
+
+            best_s = np.where(best_i == rows[:, None], -np.inf, best_s)
+            top = np.argsort(-best_s, axis=1, kind="stable")[:, :args.k - 1]
+            nb_s = np.take_along_axis(best_s, top, axis=1)
+            nb_i = np.where(np.isfinite(nb_s), np.take_along_axis(best_i, top, axis=1), -1)
+            w = 1 + nb_i.shape[1]
+            ids[rows, 0] = rows
+            sims[rows, 0] = (q * q).sum(axis=1)
+            ids[rows, 1:w] = nb_i
+            sims[rows, 1:w] = nb_s
+            ids[rows, w:] = -1
+            sims[rows, w:] = -np.inf
+
+    finish_graph(args.graph_dir, ids, sims,
+                 {"n": n, "k": args.k, "dim": meta["dim"], "emb": meta.get("emb"),
+                  "emb_size": meta.get("emb_size"), "emb_mtime_ns": meta.get("emb_mtime_ns"),
+                  "codes": str(Path(args.codes).resolve()), "kind": kind,
+                  "nlist": nlist, "nprobe": int(probes.shape[1])})
+    print(f"[stats] compared {scanned / max(n, 1):,.0f} codes per query "
+          f"({scanned / max(n * n, 1):.2%} of full scan)", file=sys.stderr)
+    print(f"[done] kNN graph saved to {args.graph_dir} in {time.time() - t0:.1f}s", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Сжатие эмбеддингов BGE-M3 (int8 или product quantization), "
+            "замер recall и kNN-граф для кластеризации по сжатым кодам."
+        )
+    )
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("encode", help="bge_m3_embeddings.dat -> каталог кодов.")
+    p.add_argument("--emb", required=True, help="bge_m3_embeddings.dat")
+    p.add_argument("--dim", type=int, default=1024, help="Размерность эмбеддингов.")
+    p.add_argument("--codes", required=True, help="Каталог кодов.")
+    p.add_argument("--kind", choices=["int8", "pq"], default="int8",
+                   help="int8 — fp16 / 2; pq — m байт на вектор. По умолчанию int8.")
+    p.add_argument("--m", type=int, default=128,
+                   help="pq: число подвекторов (dim делится на m). По умолчанию 128 (fp16 / 16).")
+    p.add_argument("--train-size", type=int, default=16384,
+                   help="Векторов для обучения (pq: ~64 на центроид). По умолчанию 16384.")
+    p.add_argument("--iters", type=int, default=15, help="pq: итераций k-means.")
+    p.add_argument("--batch-size", type=int, default=65536, help="Строк на блок кодирования.")
+    p.add_argument("--seed", type=int, default=1)
+    p.set_defaults(func=cmd_encode)
+
+    p = sub.add_parser("recall", help="recall@k поиска по кодам против точного по fp16.")
+    p.add_argument("--emb", required=True, help="bge_m3_embeddings.dat (эталон).")
+    p.add_argument("--codes", required=True, help="Каталог кодов.")
+    p.add_argument("--k", type=int, default=32)
+    p.add_argument("--queries", type=int, default=1000, help="Случайных запросов из самих фраз.")
+    p.add_argument("--batch-size", type=int, default=65536, help="Строк на блок поиска.")
+    p.add_argument("--seed", type=int, default=2)
+    p.set_defaults(func=cmd_recall)
+
+    p = sub.add_parser("graph", help="kNN-граф по кодам (грубый индекс IVF) в формате knn_graph.py.")
+    p.add_argument("--codes", required=True, help="Каталог кодов.")
+    p.add_argument("--graph-dir", required=True, help="Каталог kNN-графа.")
+    p.add_argument("--k", type=int, default=32)
+    p.add_argument("--nlist", type=int, default=0,
+                   help="Число списков IVF (не больше --train-size / 16). По умолчанию sqrt(n).")
+    p.add_argument("--nprobe", type=int, default=8,
+                   help="Ближайших списков на запрос: больше — точнее и медленнее. По умолчанию 8.")
+    p.add_argument("--train-size", type=int, default=65536,
+                   help="Векторов для обучения центроидов IVF. По умолчанию 65536.")
+    p.add_argument("--iters", type=int, default=10, help="Итераций k-means для IVF.")
+    p.add_argument("--query-batch", type=int, default=1024, help="Запросов на один проход по спискам.")
+    p.add_argument("--batch-size", type=int, default=65536, help="Строк кодов на блок поиска.")
+    p.add_argument("--seed", type=int, default=3)
+    p.set_defaults(func=cmd_graph)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
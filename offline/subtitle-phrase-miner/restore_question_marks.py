@@ -1,7 +1,12 @@
 #!/usr/bin/env python3
+import os
 import sys
 import argparse
 from pathlib import Path
+from typing import Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "common"))
+from parallel_lines import filter_lines_parallel  # noqa: E402
 
 # Однословные вопросительные слова (с ударением)
 QUESTION_WORDS_1 = {
@@ -49,6 +54,24 @@ def is_strong_question(phrase: str) -> bool:
     return False
 
 
+def restore_line(line: str) -> Optional[str]:
+    """
+    phrase<TAB>... -> ¿phrase?<TAB>... для явно вопросительных фраз.
+    Пустые строки выбрасываются.
+    """
+    if not line:
+        return None
+
+    parts = line.split("\t")
+    phrase = parts[0]
+
+    if is_strong_question(phrase):
+        # восстановление знаков вопроса
+        parts[0] = f"¿{phrase}?"
+
+    return "\t".join(parts)
+
+
 def main():
     parser = argparse.ArgumentParser(
         description=(
@@ -67,43 +90,20 @@ def main():
         help="Выходной файл с восстановленными знаками вопроса.",
     )
     parser.add_argument(
-        "--progress-interval",
+        "--workers",
         type=int,
-        default=200_000,
-        help="Интервал прогресса по числу строк (по умолчанию 200000).",
+        default=os.cpu_count() or 1,
+        help="Число процессов (файл режется на диапазоны байт). По умолчанию = числу CPU.",
     )
 
     args = parser.parse_args()
 
-    in_path = Path(args.input)
-    out_path = Path(args.output)
-
-    n_total = 0
-    n_q = 0
-
-    with in_path.open("r", encoding="utf-8") as fin, \
-         out_path.open("w", encoding="utf-8") as fout:
-
-        for line in fin:
-            n_total += 1
-            if n_total % args.progress_interval == 0:
-                print(f"[progress] {n_total:,} lines processed, "
-                      f"{n_q:,} marked as questions", file=sys.stderr)
-
-            line = line.rstrip("\n")
-            if not line:
-                continue
-
-            parts = line.split("\t")
-            phrase = parts[0]
-
-            if is_strong_question(phrase):
-                # восстановление знаков вопроса
-                phrase_q = f"¿{phrase}?"
-                parts[0] = phrase_q
-                n_q += 1
-
-            fout.write("\t".join(parts) + "\n")
+    n_total, _n_out, n_q = filter_lines_parallel(
+        str(Path(args.input)),
+        str(Path(args.output)),
+        restore_line,
+        workers=args.workers,
+    )
 
     print(f"[done] total lines: {n_total:,}", file=sys.stderr)
     print(f"[done] questions marked: {n_q:,}", file=sys.stderr)
@@ -1,9 +1,16 @@
 #!/usr/bin/env python3
 import argparse
+import heapq
 import sys
 from pathlib import Path
 
-from tqdm import tqdm
+from restore_question_marks import is_strong_question
+
+
+def has_repeated_word(phrase: str) -> bool:
+    """То же условие, что delete_repeated_phrases.py проверяет по phrase_words."""
+    words = phrase.split()
+    return len(set(words)) < len(words)
 
 
 def main():
@@ -44,14 +51,30 @@ def main():
         default=500000,
         help="Интервал прогресса при чтении.",
     )
+    parser.add_argument(
+        "--restore-questions",
+        action="store_true",
+        help="Сразу восстановить ¿ ? у вопросительных фраз (как restore_question_marks.py).",
+    )
+    parser.add_argument(
+        "--drop-repeated-words",
+        action="store_true",
+        help="Отбросить фразы с повторяющимся словом (как delete_repeated_phrases.py, "
+             "но до отбора top-K, а не после загрузки в БД).",
+    )
 
     args = parser.parse_args()
 
     in_path = Path(args.input)
     out_path = Path(args.output)
 
+    # при --top-k держим только K лучших: min-куча по (freq, -seq), seq — номер
+    # строки, чтобы при равной частоте побеждала более ранняя (как у устойчивой сортировки)
     rows = []
     total = 0
+    kept = 0
+    repeated = 0
+    seq = 0
     next_progress = args.progress_interval
 
     # clusters_aggregated.tsv:
@@ -84,25 +107,44 @@ def main():
                 continue
             if size < args.min_size:
                 continue
+            if args.drop_repeated_words and has_repeated_word(phrase):
+                repeated += 1
+                continue
 
-            rows.append((phrase, freq, size))
+            kept += 1
+            seq += 1
+            item = (freq, -seq, phrase, size)
+            if args.top_k <= 0:
+                rows.append(item)
+            elif len(rows) < args.top_k:
+                heapq.heappush(rows, item)
+            elif item[:2] > rows[0][:2]:
+                heapq.heapreplace(rows, item)
 
     print(f"[info] total clusters read: {total:,}", file=sys.stderr)
-    print(f"[info] clusters after filters: {len(rows):,}", file=sys.stderr)
-
-    # сортировка по частоте (убывание)
-    rows.sort(key=lambda x: x[1], reverse=True)
+    if args.drop_repeated_words:
+        print(f"[info] dropped with repeated words: {repeated:,}", file=sys.stderr)
+    print(f"[info] clusters after filters: {kept:,}", file=sys.stderr)
 
-    if args.top_k > 0 and len(rows) > args.top_k:
-        rows = rows[: args.top_k]
+    if args.top_k > 0 and kept > args.top_k:
         print(f"[info] taking top-{args.top_k} clusters", file=sys.stderr)
 
+    # сортировка по частоте (убывание), при равенстве — порядок входа
+    rows.sort(key=lambda x: (-x[0], -x[1]))
+
     # запись финального словаря
     with out_path.open("w", encoding="utf-8") as fout:
         # без заголовка, чтобы удобно было дальше обрабатывать
-        for phrase, freq, size in rows:
+        n_q = 0
+        for freq, _seq, phrase, size in rows:
+            if args.restore_questions and is_strong_question(phrase):
+                phrase = f"¿{phrase}?"
+                n_q += 1
             fout.write(f"{phrase}\t{freq}\t{size}\n")
 
+    if args.restore_questions:
+        print(f"[info] questions marked: {n_q:,}", file=sys.stderr)
+
     print(f"[done] written {len(rows):,} phrases to {out_path}", file=sys.stderr)
 
 
@@ -83,6 +83,7 @@ candidates AS (
      AND h.phrase_id = p.id
     WHERE a.n_new = 1
       AND h.phrase_id IS NULL   -- фраза ещё ни разу не показывалась
+      AND p.retired_at IS NULL  -- фраза есть в текущем файле корпуса
 )
 SELECT id, phrase, freq, n_new, n_intro, n_learn
 FROM candidates
@@ -121,6 +122,7 @@ SELECT
 FROM agg a
 JOIN phrases p ON p.id = a.phrase_id
 WHERE a.n_new = 1
+  AND p.retired_at IS NULL
 ORDER BY p.freq DESC
 LIMIT 1;
 """
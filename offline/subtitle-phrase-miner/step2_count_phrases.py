@@ -1,10 +1,15 @@
 #!/usr/bin/env python3
 import argparse
+import heapq
 import os
+import shutil
 import sys
+import tempfile
+import zlib
 from collections import Counter
-from concurrent.futures import ProcessPoolExecutor, as_completed
-from typing import List, Iterable
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
+from pathlib import Path
+from typing import List, Iterable, Iterator, Tuple
 
 
 def chunk_reader(fh, chunk_size: int) -> Iterable[List[str]]:
@@ -34,6 +39,162 @@ def count_chunk(lines: List[str]) -> Counter:
     return c
 
 
+# =========================
+#   РЕЖИМ С РАЗБИЕНИЕМ НА ДИСК
+# =========================
+
+def partition_of(phrase: str, partitions: int) -> int:
+    """
+    Стабильный (между процессами) номер партиции фразы.
+    hash() для str рандомизирован, поэтому берём crc32.
+    """
+    return zlib.crc32(phrase.encode("utf-8")) % partitions
+
+
+def count_chunk_to_spills(
+    lines: List[str],
+    chunk_idx: int,
+    partitions: int,
+    tmp_dir: str,
+) -> int:
+    """
+    Считает частоты в чанке и раскладывает их по P spill-файлам:
+    tmp_dir/part_XXXX/chunk_YYYYYYYY.tsv (phrase<TAB>count).
+    Возвращает число строк чанка.
+    """
+    c = count_chunk(lines)
+
+    buckets: List[List[str]] = [[] for _ in range(partitions)]
+    for phrase, count in c.items():
+        buckets[partition_of(phrase, partitions)].append(f"{phrase}\t{count}\n")
+
+    for p, rows in enumerate(buckets):
+        if not rows:
+            continue
+        path = Path(tmp_dir) / f"part_{p:04d}" / f"chunk_{chunk_idx:08d}.tsv"
+        with path.open("w", encoding="utf-8") as f:
+            f.writelines(rows)
+
+    return len(lines)
+
+
+def reduce_partition(part_dir: str) -> Tuple[str, int]:
+    """
+    Суммирует все spill-файлы одной партиции и пишет её
+    отсортированной по (count desc, phrase). Возвращает (путь, число типов).
+    """
+    c: Counter = Counter()
+    part_path = Path(part_dir)
+    for spill in sorted(part_path.glob("chunk_*.tsv")):
+        with spill.open("r", encoding="utf-8") as f:
+            for line in f:
+                phrase, count_str = line.rstrip("\n").rsplit("\t", 1)
+                c[phrase] += int(count_str)
+        spill.unlink()
+
+    items = sorted(c.items(), key=lambda x: (-x[1], x[0]))
+    out_path = part_path.with_suffix(".sorted.tsv")
+    with out_path.open("w", encoding="utf-8") as f:
+        for phrase, count in items:
+            f.write(f"{phrase}\t{count}\n")
+
+    return str(out_path), len(items)
+
+
+def read_sorted_partition(path: str) -> Iterator[Tuple[int, str]]:
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            phrase, count_str = line.rstrip("\n").rsplit("\t", 1)
+            yield -int(count_str), phrase
+
+
+def count_partitioned(args) -> None:
+    """
+    Подсчёт с ограниченной памятью:
+      1) map: воркеры считают чанки и раскладывают фразы по P партициям на диске
+         (в полёте не больше --max-inflight чанков);
+      2) reduce: каждая партиция суммируется и сортируется независимо, параллельно;
+      3) k-way merge отсортированных партиций: обрезка хвоста и запись результата.
+
+    Пик памяти: ~ chunk_size * max_inflight строк на этапе map
+    и ~ vocab / partitions типов на воркер на этапе reduce.
+    """
+    partitions = args.partitions
+    max_inflight = args.max_inflight or 2 * args.workers
+    tmp_dir = tempfile.mkdtemp(prefix="step2_parts_", dir=args.tmp_dir)
+    for p in range(partitions):
+        (Path(tmp_dir) / f"part_{p:04d}").mkdir()
+
+    print(
+        f"[info] partitioned mode: {partitions} partitions in {tmp_dir}, "
+        f"max {max_inflight} chunks in flight",
+        file=sys.stderr,
+    )
+
+    total_lines = 0
+    next_progress = args.progress_interval
+
+    try:
+        # --- map ---
+        with open(args.input, "r", encoding="utf-8", errors="ignore") as fin, \
+             ProcessPoolExecutor(max_workers=args.workers) as ex:
+
+            pending = set()
+            for chunk_idx, chunk in enumerate(chunk_reader(fin, args.chunk_size)):
+                if len(pending) >= max_inflight:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for fut in done:
+                        total_lines += fut.result()
+                pending.add(ex.submit(count_chunk_to_spills, chunk, chunk_idx, partitions, tmp_dir))
+
+                if total_lines >= next_progress:
+                    print(f"[progress] processed {total_lines:,} lines", file=sys.stderr)
+                    next_progress += args.progress_interval
+
+            for fut in as_completed(pending):
+                total_lines += fut.result()
+
+        print(f"[info] total lines processed: {total_lines:,}", file=sys.stderr)
+
+        # --- reduce ---
+        part_dirs = [str(Path(tmp_dir) / f"part_{p:04d}") for p in range(partitions)]
+        sorted_parts = []
+        vocab_size = 0
+        with ProcessPoolExecutor(max_workers=args.workers) as ex:
+            for path, n_types in ex.map(reduce_partition, part_dirs):
+                sorted_parts.append(path)
+                vocab_size += n_types
+
+        print(f"[info] vocabulary size before trimming: {vocab_size:,}", file=sys.stderr)
+
+        # --- merge + хвост ---
+        tail_percent = max(0.0, min(100.0, args.tail_percent))
+        tail_n = 0
+        if tail_percent > 0.0 and vocab_size > 0:
+            tail_n = int(vocab_size * (tail_percent / 100.0))
+            print(
+                f"[info] removed tail {tail_percent:.2f}% "
+                f"({tail_n:,} phrase types), kept {vocab_size - tail_n:,}",
+                file=sys.stderr,
+            )
+        else:
+            print("[info] tail trimming disabled", file=sys.stderr)
+        keep_n = vocab_size - tail_n
+
+        written = 0
+        with open(args.output, "w", encoding="utf-8") as fout:
+            merged = heapq.merge(*(read_sorted_partition(p) for p in sorted_parts))
+            for neg_count, phrase in merged:
+                if written >= keep_n:
+                    break
+                fout.write(f"{phrase}\t{-neg_count}\n")
+                written += 1
+
+        print(f"[done] written {written:,} phrases to {args.output}", file=sys.stderr)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
 def main():
     parser = argparse.ArgumentParser(
         description=(
@@ -78,8 +239,34 @@ def main():
         help="Процент самых редких фраз, которые нужно удалить (по количеству типов). По умолчанию 5.0.",
     )
 
+    parser.add_argument(
+        "--partitions",
+        type=int,
+        default=0,
+        help=(
+            "Число дисковых партиций (режим с ограниченной памятью). "
+            "0 = всё в памяти, как раньше. Чем больше партиций, тем меньше пик памяти."
+        ),
+    )
+    parser.add_argument(
+        "--max-inflight",
+        type=int,
+        default=0,
+        help="Макс. число чанков в обработке одновременно (только с --partitions). По умолчанию 2 * workers.",
+    )
+    parser.add_argument(
+        "--tmp-dir",
+        type=str,
+        default=None,
+        help="Каталог для временных партиций (только с --partitions). По умолчанию системный tmp.",
+    )
+
     args = parser.parse_args()
 
+    if args.partitions > 0:
+        count_partitioned(args)
+        return
+
     global_counter: Counter = Counter()
     total_lines = 0
 
@@ -1,7 +1,41 @@
 #!/usr/bin/env python3
 import argparse
+import os
 import sys
 from collections import Counter
+from pathlib import Path
+from typing import Tuple
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "common"))
+from parallel_lines import iter_range_lines, map_byte_ranges  # noqa: E402
+from token_store import TokenStore  # noqa: E402
+
+
+def count_words_range(path: str, start: int, end: int) -> Tuple[int, Counter]:
+    """
+    Частоты слов (взвешенные count фразы) в диапазоне байт [start, end).
+    Возвращает (число строк, Counter).
+    """
+    word_freq = Counter()
+    n_lines = 0
+    for line in iter_range_lines(path, start, end):
+        n_lines += 1
+        if not line:
+            continue
+
+        try:
+            phrase, count_str = line.rsplit("\t", 1)
+            count = int(count_str)
+        except ValueError:
+            continue
+
+        words = phrase.split()
+        for w in words:
+            if w:
+                word_freq[w] += count
+    return n_lines, word_freq
 
 
 def main():
@@ -10,47 +44,55 @@ def main():
     )
     parser.add_argument(
         "-i", "--input",
-        required=True,
+        default=None,
         help="Вход: файл с фразами и частотами (phrase<TAB>count).",
     )
+    parser.add_argument(
+        "--store",
+        default=None,
+        help="Вместо -i: хранилище id слов из tokenize_phrases.py (без разбора строк).",
+    )
     parser.add_argument(
         "-o", "--output",
         required=True,
         help="Выход: файл слов и частот (word<TAB>count), отсортированный по убыванию.",
     )
     parser.add_argument(
-        "--progress-interval",
+        "--workers",
         type=int,
-        default=1_000_000,
-        help="Интервал прогресса по строкам. По умолчанию 1_000_000.",
+        default=os.cpu_count() or 1,
+        help="Число процессов (файл режется на диапазоны байт). По умолчанию = числу CPU.",
     )
     args = parser.parse_args()
 
+    if (args.input is None) == (args.store is None):
+        parser.error("pass exactly one of -i/--input or --store")
+
+    if args.store:
+        # id словаря выданы по первому появлению — стабильная сортировка
+        # по частоте даёт тот же порядок, что и Counter ниже
+        store = TokenStore(args.store)
+        freq = store.word_weights()
+        order = np.argsort(-freq, kind="stable")
+        vocab = store.vocab
+
+        print(f"[info] total rows in store: {store.n_rows:,}", file=sys.stderr)
+        print(f"[info] vocab size: {len(order):,}", file=sys.stderr)
+
+        with open(args.output, "w", encoding="utf-8") as fout:
+            for wid, c in zip(order.tolist(), freq[order].tolist()):
+                fout.write(f"{vocab[wid]}\t{c}\n")
+
+        print(f"[done] written {len(order):,} words to {args.output}", file=sys.stderr)
+        return
+
+    # результаты идут в порядке диапазонов, поэтому порядок первых
+    # появлений слов (и порядок при равных частотах) как при одном проходе
     word_freq = Counter()
     total_lines = 0
-    next_progress = args.progress_interval
-
-    with open(args.input, "r", encoding="utf-8", errors="ignore") as fin:
-        for line in fin:
-            total_lines += 1
-            if total_lines >= next_progress:
-                print(f"[progress] processed {total_lines:,} lines", file=sys.stderr)
-                next_progress += args.progress_interval
-
-            line = line.rstrip("\n")
-            if not line:
-                continue
-
-            try:
-                phrase, count_str = line.rsplit("\t", 1)
-                count = int(count_str)
-            except ValueError:
-                continue
-
-            words = phrase.split()
-            for w in words:
-                if w:
-                    word_freq[w] += count
+    for n_lines, c in map_byte_ranges(args.input, count_words_range, args.workers):
+        total_lines += n_lines
+        word_freq.update(c)
 
     print(f"[info] total lines processed: {total_lines:,}", file=sys.stderr)
     print(f"[info] vocab size: {len(word_freq):,}", file=sys.stderr)
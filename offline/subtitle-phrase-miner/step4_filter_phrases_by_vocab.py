@@ -1,6 +1,16 @@
 #!/usr/bin/env python3
 import argparse
+import os
 import sys
+from functools import partial
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "common"))
+from parallel_lines import filter_lines_parallel  # noqa: E402
+from token_store import TokenStore  # noqa: E402
 
 
 def load_top_vocab(path: str, top_n: int) -> set[str]:
@@ -20,6 +30,50 @@ def load_top_vocab(path: str, top_n: int) -> set[str]:
     return vocab
 
 
+def keep_in_vocab(line: str, vocab: frozenset, min_count: int) -> Optional[str]:
+    """Строка phrase<TAB>count, если count >= min_count и все слова в словаре."""
+    if not line:
+        return None
+
+    try:
+        phrase, count_str = line.rsplit("\t", 1)
+        count = int(count_str)
+    except ValueError:
+        return None
+
+    if count < min_count:
+        return None
+
+    words = phrase.split()
+    # если ВСЕ слова из допустимого словаря — оставляем фразу
+    if all(w in vocab for w in words):
+        return line
+    return None
+
+
+def filter_store(store_dir: str, out_path: str, vocab: set, min_count: int):
+    """
+    То же, что keep_in_vocab, но по хранилищу id слов: словарь — маска
+    по id, проверка фраз — векторная. Фразы пишутся как " ".join(слова).
+    Возвращает (строк всего, оставлено).
+    """
+    store = TokenStore(store_dir)
+    allowed = np.zeros(store.vocab_size, dtype=bool)
+    word2id = store.word2id
+    for w in vocab:
+        wid = word2id.get(w)
+        if wid is not None:
+            allowed[wid] = True
+
+    kept = 0
+    with open(out_path, "w", encoding="utf-8") as fout:
+        for rows in store.rows_within(allowed, min_count):
+            for r in rows.tolist():
+                fout.write(f"{store.phrase(r)}\t{int(store.counts[r])}\n")
+            kept += len(rows)
+    return store.n_rows, kept
+
+
 def main():
     parser = argparse.ArgumentParser(
         description=(
@@ -29,9 +83,14 @@ def main():
     )
     parser.add_argument(
         "-i", "--input",
-        required=True,
+        default=None,
         help="Вход: phrase<TAB>count.",
     )
+    parser.add_argument(
+        "--store",
+        default=None,
+        help="Вместо -i: хранилище id слов из tokenize_phrases.py для этого файла.",
+    )
     parser.add_argument(
         "-o", "--output",
         required=True,
@@ -55,48 +114,29 @@ def main():
         help="Доп. фильтр: минимальная частота фразы. По умолчанию 5.",
     )
     parser.add_argument(
-        "--progress-interval",
+        "--workers",
         type=int,
-        default=1_000_000,
-        help="Интервал прогресса по строкам.",
+        default=os.cpu_count() or 1,
+        help="Число процессов (файл режется на диапазоны байт). По умолчанию = числу CPU.",
     )
 
     args = parser.parse_args()
 
+    if (args.input is None) == (args.store is None):
+        parser.error("pass exactly one of -i/--input or --store")
+
     vocab = load_top_vocab(args.word_freq, args.top_n)
     print(f"[info] loaded vocab of {len(vocab):,} words (top-{args.top_n})", file=sys.stderr)
 
-    total = 0
-    kept = 0
-    next_progress = args.progress_interval
-
-    with open(args.input, "r", encoding="utf-8", errors="ignore") as fin, \
-         open(args.output, "w", encoding="utf-8") as fout:
-
-        for line in fin:
-            total += 1
-            if total >= next_progress:
-                print(f"[progress] processed {total:,} lines, kept {kept:,}", file=sys.stderr)
-                next_progress += args.progress_interval
-
-            line = line.rstrip("\n")
-            if not line:
-                continue
-
-            try:
-                phrase, count_str = line.rsplit("\t", 1)
-                count = int(count_str)
-            except ValueError:
-                continue
-
-            if count < args.min_count:
-                continue
-
-            words = phrase.split()
-            # если ВСЕ слова из допустимого словаря — оставляем фразу
-            if all(w in vocab for w in words):
-                fout.write(line + "\n")
-                kept += 1
+    if args.store:
+        total, kept = filter_store(args.store, args.output, vocab, args.min_count)
+    else:
+        total, kept, _ = filter_lines_parallel(
+            args.input,
+            args.output,
+            partial(keep_in_vocab, vocab=frozenset(vocab), min_count=args.min_count),
+            workers=args.workers,
+        )
 
     print(f"[done] total lines: {total:,}", file=sys.stderr)
     print(f"[done] kept: {kept:,}", file=sys.stderr)
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+from knn_graph import check_graph_emb, connected_components, leader_clusters, open_graph
+
+SIZE_BUCKETS = [(1, 1), (2, 2), (3, 5), (6, 10), (11, 100), (101, None)]
+
+
+def size_report(cluster_id: np.ndarray, n_clusters: int) -> str:
+    sizes = np.bincount(cluster_id, minlength=n_clusters)
+    n = len(cluster_id)
+    parts = []
+    for lo, hi in SIZE_BUCKETS:
+        m = (sizes >= lo) if hi is None else ((sizes >= lo) & (sizes <= hi))
+        label = f"{lo}+" if hi is None else (str(lo) if lo == hi else f"{lo}-{hi}")
+        parts.append(f"{label}:{int(m.sum())}")
+    p50, p90, p99 = np.percentile(sizes, [50, 90, 99]) if n_clusters else (0, 0, 0)
+    in_multi = int(sizes[sizes > 1].sum())
+    return (f"clusters={n_clusters:,}  max={int(sizes.max()) if n_clusters else 0:,}  "
+            f"p50/p90/p99={p50:.0f}/{p90:.0f}/{p99:.0f}  "
+            f"in_multi={in_multi / max(n, 1):.1%}  sizes[{' '.join(parts)}]")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Перебор порогов кластеризации по сохранённому kNN-графу "
+            "(cluster_leader_faiss.py --graph-dir): число кластеров и "
+            "распределение размеров для каждого порога, без FAISS."
+        )
+    )
+    parser.add_argument("--graph-dir", required=True, help="Каталог kNN-графа.")
+    parser.add_argument("--thresholds", type=float, nargs="+",
+                        default=[0.85, 0.88, 0.90, 0.92, 0.94, 0.96],
+                        help="Пороги косинусного сходства.")
+    parser.add_argument("--k", type=int, nargs="+", default=[0],
+                        help="Сколько соседей учитывать (<= k графа); 0 = все. Можно несколько.")
+    parser.add_argument("--mode", choices=["leader", "components", "both"], default="leader",
+                        help="leader — как cluster_leader_faiss.py; components — "
+                             "компоненты связности (union-find). По умолчанию leader.")
+    parser.add_argument("--out-dir", default=None,
+                        help="Если задан — записать cluster_ids_<mode>_k<k>_t<threshold>.txt "
+                             "для каждого варианта.")
+    args = parser.parse_args()
+
+    ids, sims, meta = open_graph(args.graph_dir)
+    problem = check_graph_emb(meta)
+    if problem:
+        print(f"[error] graph {args.graph_dir} is stale: {problem}", file=sys.stderr)
+        sys.exit(1)
+    modes = ["leader", "components"] if args.mode == "both" else [args.mode]
+    out_dir = Path(args.out_dir) if args.out_dir else None
+    if out_dir:
+        out_dir.mkdir(parents=True, exist_ok=True)
+
+    for k in args.k:
+        k_eff = k or meta["k"]
+        if k_eff > meta["k"]:
+            print(f"[warn] k={k} > graph k={meta['k']}, skipped", file=sys.stderr)
+            continue
+        for mode in modes:
+            for thr in args.thresholds:
+                t0 = time.time()
+                if mode == "leader":
+                    cluster_id, n_clusters = leader_clusters(ids, sims, thr, k=k_eff)
+                else:
+                    cluster_id, n_clusters = connected_components(ids, sims, thr, k=k_eff)
+                elapsed = time.time() - t0
+
+                print(f"{mode:10s} k={k_eff:<3d} t={thr:.3f}  {size_report(cluster_id, n_clusters)}  "
+                      f"({elapsed:.1f}s)")
+                sys.stdout.flush()
+
+                if out_dir:
+                    path = out_dir / f"cluster_ids_{mode}_k{k_eff}_t{thr:.3f}.txt"
+                    np.savetxt(path, cluster_id, fmt="%d")
+
+
+if __name__ == "__main__":
+    main()
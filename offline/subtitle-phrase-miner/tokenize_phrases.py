@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "common"))
+from token_store import build_token_store, log_meta  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Один раз токенизировать файл фраз (phrase<TAB>count[<TAB>...]) "
+            "в хранилище id слов (vocab.txt + uint32 токены + смещения) для --store "
+            "в step3_word_freq.py и step4_filter_phrases_by_vocab.py."
+        )
+    )
+    parser.add_argument(
+        "-i", "--input",
+        required=True,
+        help="Вход: phrase<TAB>count[<TAB>...].",
+    )
+    parser.add_argument(
+        "-o", "--out-dir",
+        required=True,
+        help="Каталог хранилища (vocab.txt, tokens.u32, offsets.u64, counts.i64, meta.json).",
+    )
+    parser.add_argument(
+        "--no-counts",
+        action="store_true",
+        help="Вход без частот (одна фраза на строку, например очищенный корпус): count = 1.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Число процессов (файл режется на диапазоны байт). По умолчанию = числу CPU.",
+    )
+    args = parser.parse_args()
+
+    t0 = time.time()
+    print(f"[info] tokenizing {args.input} with {args.workers} workers", file=sys.stderr)
+    meta = build_token_store(args.input, args.out_dir, args.workers,
+                             with_counts=not args.no_counts)
+    log_meta(meta, args.out_dir)
+
+    elapsed = max(time.time() - t0, 1e-9)
+    print(f"[stats] elapsed: {elapsed:.1f}s, {meta['n_rows'] / elapsed:,.0f} rows/s",
+          file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+vector_codes.py
+
+Сжатое хранение эмбеддингов фраз и поиск по сжатым кодам (NumPy, без FAISS).
+
+Два вида кодов:
+
+    int8   (n, dim) int8 — масштаб на измерение, x ≈ code * scale[j];
+           1 байт на измерение (fp16 / 2, fp32-копия / 4)
+    pq     (n, m) uint8 — product quantization: вектор режется на m
+           подвекторов, каждый заменяется номером ближайшего из 256
+           центроидов; m байт на вектор (при dim=1024, m=128 — fp16 / 16)
+
+Каталог кодов:
+
+    codes.bin      (n, code_size) — коды, memmap
+    codebook.npy   int8: scale (dim,) float32; pq: центроиды (m, 256, dim/m) float32
+    meta.json      n, dim, kind, m
+
+Поиск коды не декодирует: для int8 масштаб переносится в запрос
+(q · (c * scale) = (q * scale) · c), для pq считается асимметричное
+расстояние (ADC) — на каждый запрос таблица q_j · centroid[j, :] размера
+(m, 256), сходство с кодом c = sum_j table[j, c_j].
+
+Грубый индекс (IVF) для kNN-графа: nlist центроидов k-means по
+декодированной выборке, каждая строка кодов приписана к ближайшему;
+запросы списка ищут только по его nprobe ближайшим спискам.
+"""
+import json
+import os
+import sys
+from typing import Optional, Tuple
+
+import numpy as np
+
+CODES_FILE = "codes.bin"
+CODEBOOK_FILE = "codebook.npy"
+META_FILE = "meta.json"
+
+PQ_CENTROIDS = 256
+
+
+# ---------------------------
+# Обучение
+# ---------------------------
+def kmeans(x: np.ndarray, k: int, iters: int, seed: int) -> np.ndarray:
+    """Lloyd k-means (float32); пустые кластеры получают случайную точку."""
+    rng = np.random.default_rng(seed)
+    cent = x[rng.choice(len(x), size=k, replace=len(x) < k)].copy()
+    x_sq = (x * x).sum(axis=1)
+    for _ in range(iters):
+        d = x_sq[:, None] - 2.0 * (x @ cent.T) + (cent * cent).sum(axis=1)[None, :]
+        assign = d.argmin(axis=1)
+        counts = np.bincount(assign, minlength=k)
+        sums = np.stack([np.bincount(assign, weights=x[:, j], minlength=k)
+                         for j in range(x.shape[1])], axis=1)
+        nonempty = counts > 0
+        cent[nonempty] = sums[nonempty] / counts[nonempty, None]
+        empty = np.flatnonzero(~nonempty)
+        if len(empty):
+            cent[empty] = x[rng.choice(len(x), size=len(empty))]
+    return cent
+
+
+def train_int8(sample: np.ndarray) -> np.ndarray:
+    """Масштаб на измерение: max|x| / 127 по обучающей выборке."""
+    scale = np.abs(sample).max(axis=0).astype(np.float32) / 127.0
+    scale[scale == 0] = 1.0
+    return scale
+
+
+def train_pq(sample: np.ndarray, m: int, iters: int = 20, seed: int = 1) -> np.ndarray:
+    n, d = sample.shape
+    if d % m:
+        raise ValueError(f"dim {d} is not divisible by m={m}")
+    ds = d // m
+    return np.stack([
+        kmeans(np.ascontiguousarray(sample[:, j * ds:(j + 1) * ds]), PQ_CENTROIDS, iters, seed + j)
+        for j in range(m)
+    ])
+
+
+# ---------------------------
+# Кодирование / декодирование блока
+# ---------------------------
+def encode_block(x: np.ndarray, kind: str, codebook: np.ndarray) -> np.ndarray:
+    if kind == "int8":
+        return np.clip(np.rint(x / codebook), -127, 127).astype(np.int8)
+    m, _k, ds = codebook.shape
+    codes = np.empty((len(x), m), dtype=np.uint8)
+    for j in range(m):
+        sub = x[:, j * ds:(j + 1) * ds]
+        cent = codebook[j]
+        d = (cent * cent).sum(axis=1)[None, :] - 2.0 * (sub @ cent.T)
+        codes[:, j] = d.argmin(axis=1)
+    return codes
+
+
+def decode_block(codes: np.ndarray, kind: str, codebook: np.ndarray) -> np.ndarray:
+    if kind == "int8":
+        return codes.astype(np.float32) * codebook
+    m, _k, ds = codebook.shape
+    out = np.empty((len(codes), m * ds), dtype=np.float32)
+    for j in range(m):
+        out[:, j * ds:(j + 1) * ds] = codebook[j][codes[:, j]]
+    return out
+
+
+# ---------------------------
+# Каталог кодов
+# ---------------------------
+def create_codes(codes_dir: str, n: int, dim: int, kind: str, codebook: np.ndarray) -> np.memmap:
+    os.makedirs(codes_dir, exist_ok=True)
+    np.save(os.path.join(codes_dir, CODEBOOK_FILE), codebook)
+    if kind == "int8":
+        dtype, width = np.int8, dim
+    else:
+        dtype, width = np.uint8, codebook.shape[0]
+    return np.memmap(os.path.join(codes_dir, CODES_FILE), dtype=dtype, mode="w+", shape=(n, width))
+
+
+def finish_codes(codes_dir: str, codes: np.memmap, meta: dict):
+    codes.flush()
+    with open(os.path.join(codes_dir, META_FILE), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+
+
+def open_codes(codes_dir: str) -> Tuple[np.memmap, np.ndarray, dict]:
+    with open(os.path.join(codes_dir, META_FILE), "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    codebook = np.load(os.path.join(codes_dir, CODEBOOK_FILE))
+    if meta["kind"] == "int8":
+        dtype, width = np.int8, meta["dim"]
+    else:
+        dtype, width = np.uint8, meta["m"]
+    codes = np.memmap(os.path.join(codes_dir, CODES_FILE), dtype=dtype, mode="r",
+                      shape=(meta["n"], width))
+    print(f"[info] codes {codes_dir}: {meta['n']:,} x {meta['kind']} "
+          f"({width * codes.itemsize} B/vector)", file=sys.stderr)
+    return codes, codebook, meta
+
+
+# ---------------------------
+# Поиск
+# ---------------------------
+def merge_topk(best_s: np.ndarray, best_i: np.ndarray,
+               sims: np.ndarray, ids: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Слить текущий top-k (по строкам) с новым блоком сходств."""
+    s = np.concatenate([best_s, sims], axis=1)
+    i = np.concatenate([best_i, np.broadcast_to(ids, sims.shape)], axis=1)
+    if s.shape[1] > k:
+        top = np.argpartition(-s, k - 1, axis=1)[:, :k]
+        s = np.take_along_axis(s, top, axis=1)
+        i = np.take_along_axis(i, top, axis=1)
+    order = np.argsort(-s, axis=1, kind="stable")
+    return np.take_along_axis(s, order, axis=1), np.take_along_axis(i, order, axis=1)
+
+
+def prepare_queries(queries: np.ndarray, kind: str, codebook: np.ndarray) -> np.ndarray:
+    """
+    Запросы в виде для code_sims: fp16 — как есть, int8 — с масштабом,
+    pq — таблицы ADC, shape (m, 256, nq): строка таблицы на код непрерывна.
+    """
+    queries = np.asarray(queries, dtype=np.float32)
+    if kind == "fp16":
+        return queries
+    if kind == "int8":
+        return queries * codebook[None, :]
+    m, _k, ds = codebook.shape
+    sub = queries.reshape(len(queries), m, ds).transpose(1, 2, 0)
+    return np.ascontiguousarray(np.matmul(codebook, sub))
+
+
+def code_sims(prepared: np.ndarray, chunk: np.ndarray, kind: str) -> np.ndarray:
+    """Сходства (nq, len(chunk)) подготовленных запросов с блоком кодов."""
+    if kind != "pq":
+        return prepared @ chunk.astype(np.float32).T
+    sims = np.zeros((len(chunk), prepared.shape[2]), dtype=np.float32)
+    for j in range(chunk.shape[1]):
+        sims += prepared[j][chunk[:, j]]
+    return sims.T
+
+
+def search_codes(codes: np.ndarray, kind: str, codebook: np.ndarray, queries: np.ndarray,
+                 k: int, block: int = 65536,
+                 rows: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Точный (по кодам) поиск top-k по inner product: (sims, ids), shape (nq, <=k).
+    kind="fp16" — codes это сами несжатые векторы (эталон для recall).
+    rows — искать только среди этих строк (возрастающие номера), иначе по всем.
+    """
+    nq = len(queries)
+    prepared = prepare_queries(queries, kind, codebook)
+    best_s = np.full((nq, 0), -np.inf, dtype=np.float32)
+    best_i = np.full((nq, 0), -1, dtype=np.int64)
+    total = len(codes) if rows is None else len(rows)
+    for s in range(0, total, block):
+        if rows is None:
+            chunk = np.asarray(codes[s:s + block])
+            ids = np.arange(s, s + len(chunk), dtype=np.int64)
+        else:
+            ids = rows[s:s + block].astype(np.int64)
+            chunk = np.asarray(codes[ids])
+        sims = code_sims(prepared, chunk, kind)
+        best_s, best_i = merge_topk(best_s, best_i, sims, ids[None, :], k)
+    return best_s, best_i
+
+
+# ---------------------------
+# Грубый индекс (IVF)
+# ---------------------------
+def assign_lists(codes: np.ndarray, kind: str, codebook: np.ndarray,
+                 centroids: np.ndarray, block: int = 65536) -> np.ndarray:
+    """Номер ближайшего (L2) грубого центроида для каждой строки кодов."""
+    cent_sq = (centroids * centroids).sum(axis=1)[None, :]
+    lists = np.empty(len(codes), dtype=np.int32)
+    for s in range(0, len(codes), block):
+        x = decode_block(np.asarray(codes[s:s + block]), kind, codebook)
+        lists[s:s + len(x)] = (cent_sq - 2.0 * (x @ centroids.T)).argmin(axis=1)
+    return lists
+
+
+def probe_lists(centroids: np.ndarray, nprobe: int) -> np.ndarray:
+    """(nlist, nprobe): для каждого списка — ближайшие к его центроиду списки, сам первый."""
+    sq = (centroids * centroids).sum(axis=1)
+    d = sq[:, None] - 2.0 * (centroids @ centroids.T) + sq[None, :]
+    np.fill_diagonal(d, -np.inf)
+    nprobe = min(nprobe, len(centroids))
+    return np.argsort(d, axis=1, kind="stable")[:, :nprobe]
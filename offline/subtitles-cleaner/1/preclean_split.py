@@ -6,7 +6,9 @@ preclean_split.py
 1, 2, 3, 4, 5, 6+.
 
 Что делает:
-- читает входной файл построчно (любой размер, потоково);
+- режет входной файл на диапазоны байт по границам строк и обрабатывает
+  их параллельно (offline/common/parallel_lines.py); выходные файлы
+  склеиваются по порядку диапазонов, порядок строк как при одном проходе;
 - убирает управляющие символы и простые артефакты разметки;
 - схлопывает последовательности пробелов в один;
 - сохраняет пунктуацию и регистр (это важно для LLM);
@@ -16,9 +18,15 @@ preclean_split.py
 Пустые строки и строки без буквенных слов не записываются.
 """
 
+import os
 import re
+import shutil
+import sys
+import tempfile
 from pathlib import Path
-from tqdm import tqdm
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "common"))
+from parallel_lines import iter_range_lines, map_byte_ranges  # noqa: E402
 
 # ==========================
 #   НАСТРОЙКИ ПУТЕЙ
@@ -38,6 +46,13 @@ OUT_4 = OUTPUT_DIR / "es.4w.soft.txt"
 OUT_5 = OUTPUT_DIR / "es.5w.soft.txt"
 OUT_6P = OUTPUT_DIR / "es.6plusw.soft.txt"
 
+# выходные файлы по ключу "число слов" (6 и больше -> "6+")
+OUT_KEYS = (1, 2, 3, 4, 5, "6+")
+OUT_PATHS = {1: OUT_1, 2: OUT_2, 3: OUT_3, 4: OUT_4, 5: OUT_5, "6+": OUT_6P}
+
+# число процессов
+WORKERS = os.cpu_count() or 1
+
 # ==========================
 #   ОЧИСТКА И ТОКЕНИЗАЦИЯ
 # ==========================
@@ -111,26 +126,25 @@ def count_words(line: str) -> int:
 #   MAIN
 # ==========================
 
-def main():
-    if not SOURCE_PATH.exists():
-        raise SystemExit(f"Source file not found: {SOURCE_PATH}")
+def part_path(part_dir: str, key, start: int) -> Path:
+    return Path(part_dir) / f"{key}.{start:016d}.txt"
 
-    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 
+def split_range(path: str, start: int, end: int, part_dir: str):
+    """
+    Обработать диапазон байт [start, end) исходного файла:
+    пишет по части каждого выходного файла в part_dir.
+    Возвращает (строк прочитано, строк с текстом).
+    """
     total_lines = 0
     kept_lines = 0
 
-    with SOURCE_PATH.open("r", encoding="utf-8", errors="ignore") as src, \
-            OUT_1.open("w", encoding="utf-8") as f1, \
-            OUT_2.open("w", encoding="utf-8") as f2, \
-            OUT_3.open("w", encoding="utf-8") as f3, \
-            OUT_4.open("w", encoding="utf-8") as f4, \
-            OUT_5.open("w", encoding="utf-8") as f5, \
-            OUT_6P.open("w", encoding="utf-8") as f6p:
-
-        files = {1: f1, 2: f2, 3: f3, 4: f4, 5: f5, "6+": f6p}
-
-        for line in tqdm(src, desc="preclean & split"):
+    files = {
+        key: part_path(part_dir, key, start).open("w", encoding="utf-8")
+        for key in OUT_KEYS
+    }
+    try:
+        for line in iter_range_lines(path, start, end):
             total_lines += 1
 
             cleaned = soft_clean_line(line)
@@ -143,20 +157,40 @@ def main():
 
             kept_lines += 1
 
-            if n_words == 1:
-                target = files[1]
-            elif n_words == 2:
-                target = files[2]
-            elif n_words == 3:
-                target = files[3]
-            elif n_words == 4:
-                target = files[4]
-            elif n_words == 5:
-                target = files[5]
-            else:
-                target = files["6+"]
-
-            target.write(cleaned + "\n")
+            key = n_words if n_words <= 5 else "6+"
+            files[key].write(cleaned + "\n")
+    finally:
+        for f in files.values():
+            f.close()
+
+    return total_lines, kept_lines
+
+
+def main():
+    if not SOURCE_PATH.exists():
+        raise SystemExit(f"Source file not found: {SOURCE_PATH}")
+
+    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+    part_dir = tempfile.mkdtemp(prefix="preclean_", dir=OUTPUT_DIR)
+
+    total_lines = 0
+    kept_lines = 0
+
+    try:
+        results = map_byte_ranges(str(SOURCE_PATH), split_range, WORKERS, part_dir)
+
+        for n_total, n_kept in results:
+            total_lines += n_total
+            kept_lines += n_kept
+
+        # склейка частей по порядку диапазонов (имена частей = смещения)
+        for key in OUT_KEYS:
+            with OUT_PATHS[key].open("wb") as fout:
+                for part in sorted(Path(part_dir).glob(f"{key}.*.txt")):
+                    with part.open("rb") as fin:
+                        shutil.copyfileobj(fin, fout, 16 * 1024 * 1024)
+    finally:
+        shutil.rmtree(part_dir, ignore_errors=True)
 
     print(f"Total lines read:  {total_lines}")
     print(f"Lines with text:   {kept_lines}")